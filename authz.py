@@ -0,0 +1,119 @@
+# authz.py
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from models import AdminUser, Role
+
+
+class PermissionRegistry:
+    """把权限键驻留为位序号：每个键分配一个固定的二进制位，权限集合即一个整数"""
+    def __init__(self):
+        self._bits: Dict[str, int] = {}
+        self._keys: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def bit(self, key: str) -> int:
+        """返回 key 对应的位，首次出现时分配新位"""
+        bit = self._bits.get(key)
+        if bit is None:
+            with self._lock:
+                bit = self._bits.get(key)
+                if bit is None:
+                    bit = self._bits[key] = 1 << len(self._keys)
+                    self._keys.append(key)
+        return bit
+
+    def lookup(self, key: str) -> int:
+        """只查询不分配；未登记的键返回 0，任何人都不具备它"""
+        return self._bits.get(key, 0)
+
+    def mask(self, keys: Iterable[str]) -> int:
+        mask = 0
+        for key in keys:
+            mask |= self.bit(key)
+        return mask
+
+    def lookup_mask(self, keys: Iterable[str]) -> Optional[int]:
+        """只查询不分配；任何一个键未登记时返回 None"""
+        mask = 0
+        for key in keys:
+            bit = self._bits.get(key)
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def keys(self, mask: int) -> List[str]:
+        return [key for i, key in enumerate(self._keys) if mask >> i & 1]
+
+
+PERMISSIONS = PermissionRegistry()
+
+
+class AuthorizationEngine:
+    """管理员鉴权：角色和管理员的有效权限预先合并成位掩码并缓存在对象上，
+    检查时只做一次整数与运算。assign_role / add_permission 会使相关缓存失效；
+    直接改写 role.permissions 列表不会触发失效。"""
+    def __init__(self, registry: Optional[PermissionRegistry] = None):
+        self.registry: PermissionRegistry = registry or PERMISSIONS
+
+    def role_mask(self, role: Role) -> int:
+        cached = role._permission_mask
+        if cached is not None and cached[0] is self.registry:
+            return cached[1]
+        mask = self.registry.mask(p.permissionKey for p in role.permissions)
+        role._permission_mask = (self.registry, mask)
+        return mask
+
+    def effective_mask(self, admin: AdminUser) -> int:
+        cached = admin._permission_mask
+        if cached is not None and cached[0] is self.registry:
+            return cached[1]
+        mask = 0
+        for role in admin.roles:
+            mask |= self.role_mask(role)
+        admin._permission_mask = (self.registry, mask)
+        return mask
+
+    def requirement(self, keys: Iterable[str]) -> Optional[int]:
+        """把一组权限键编译成掩码，热点路径可预先编译后反复调用 allows；
+        含未登记的键时返回 None（没有人具备），不会为请求中的任意键分配新位"""
+        return self.registry.lookup_mask(keys)
+
+    def allows(self, admin: AdminUser, required: Optional[int]) -> bool:
+        if required is None:
+            return False
+        return self.effective_mask(admin) & required == required
+
+    # 以下检查先取管理员掩码再查位：管理员具备的键在合并掩码时必然已驻留，查不到即不具备
+    def has_permission(self, admin: AdminUser, permission_key: str) -> bool:
+        mask = self.effective_mask(admin)
+        return mask & self.registry.lookup(permission_key) != 0
+
+    def has_all(self, admin: AdminUser, permission_keys: Iterable[str]) -> bool:
+        mask = self.effective_mask(admin)
+        required = self.registry.lookup_mask(permission_keys)
+        return required is not None and mask & required == required
+
+    def has_any(self, admin: AdminUser, permission_keys: Iterable[str]) -> bool:
+        mask = self.effective_mask(admin)
+        wanted = 0
+        for key in permission_keys:
+            wanted |= self.registry.lookup(key)
+        return mask & wanted != 0
+
+    def check_many(self, admin: AdminUser, permission_keys: Iterable[str]) -> Dict[str, bool]:
+        """逐个返回检查结果，管理员掩码只取一次"""
+        mask = self.effective_mask(admin)
+        lookup = self.registry.lookup
+        return {key: mask & lookup(key) != 0 for key in permission_keys}
+
+    def require(self, admin: AdminUser, permission_key: str):
+        if not self.has_permission(admin, permission_key):
+            raise PermissionError(f"管理员 {admin.username} 缺少权限: {permission_key}")
+
+    def permissions_of(self, admin: AdminUser) -> List[str]:
+        return self.registry.keys(self.effective_mask(admin))
@@ -0,0 +1,117 @@
+# bench_broker.py
+"""跨进程聊天吞吐基准：一个发送进程经本机消息代理向另一个进程的用户发消息
+
+对比三种发送方式：逐条发送并等待确认、逐条发送但流水线确认、批量发送加流水线确认。
+吞吐按发送进程开始发送到接收进程存完最后一条消息的时间计算。
+
+用法: python bench_broker.py [--messages N] [--receivers R]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MODES = (
+    ("逐条确认", 1, 1),
+    ("流水线", 1, 16),
+    ("批量+流水线", 256, 16),
+)
+
+
+def _quiet():
+    sys.path.insert(0, HERE)
+    # IMService 每条消息都会打印日志，基准期间屏蔽标准输出
+    sys.stdout = open(os.devnull, "w")
+
+
+def receiver_process(path: str, receivers: int, total: int, ready, results):
+    _quiet()
+    from broker import BrokerClient
+    from services import IMService, NotificationService, UserService
+    user_service = UserService()
+    users = user_service.register_many((f"r{i}", f"r{i}@bench", "x", f"接收者{i}") for i in range(receivers))
+    for user in users:
+        user.is_online = True
+    client = BrokerClient(path, name="receiver").connect()
+    im_service = IMService(NotificationService(), user_service, router=client)
+    client.announce(users)
+    ready.set()
+    while len(im_service.message_db) < total:
+        time.sleep(0.001)
+    results.put(("received", time.time()))
+    client.close()
+
+
+def sender_process(path: str, receivers: int, total: int, batch_size: int, max_in_flight: int, ready, results):
+    _quiet()
+    from broker import BrokerClient
+    from services import IMService, NotificationService, UserService
+    user_service = UserService()
+    sender = user_service.register("s", "s@bench", "x", "发送者")
+    client = BrokerClient(path, name="sender", batch_size=batch_size, max_in_flight=max_in_flight).connect()
+    im_service = IMService(NotificationService(), user_service, router=client)
+    ready.wait()
+    while len(client.remote_user_ids()) < receivers:
+        time.sleep(0.001)
+    targets = client.remote_user_ids()
+    start = time.time()
+    for i in range(total):
+        im_service.receive_message(sender, targets[i % len(targets)], f"基准消息 {i}")
+        if max_in_flight == 1 and batch_size == 1:
+            # 基线：每条消息都等确认后再发下一条
+            client.flush()
+    client.flush()
+    results.put(("sent", start, time.time(), client.stats()))
+    client.close()
+
+
+def run(path: str, messages: int, receivers: int, batch_size: int, max_in_flight: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=receiver_process, args=(path, receivers, messages, ready, results)),
+             ctx.Process(target=sender_process,
+                         args=(path, receivers, messages, batch_size, max_in_flight, ready, results))]
+    for p in procs:
+        p.start()
+    got = dict((item[0], item[1:]) for item in (results.get(timeout=120) for _ in procs))
+    for p in procs:
+        p.join()
+    start, sent_at, stats = got["sent"]
+    elapsed = got["received"][0] - start
+    return {"elapsed": elapsed, "rate": messages / elapsed, "send_elapsed": sent_at - start,
+            "batches": stats["batches"], "failed": stats["failed"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--receivers", type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from broker import ChatBroker
+    path = os.path.join(tempfile.mkdtemp(), "chat.sock")
+    broker = ChatBroker(path)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        broker.start()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    try:
+        print(f"{args.messages} 条消息, {args.receivers} 个远程接收者")
+        for name, batch_size, max_in_flight in MODES:
+            r = run(path, args.messages, args.receivers, batch_size, max_in_flight)
+            print(f"{name:>10}: {r['rate']:9.0f} 条/秒  端到端 {r['elapsed']:.2f} 秒  "
+                  f"{r['batches']} 个批次  失败 {r['failed']}")
+    finally:
+        broker.stop()
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
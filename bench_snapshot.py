@@ -0,0 +1,116 @@
+# bench_snapshot.py
+"""快照读基准：写线程持续发布、修改商品时，对比三种全目录遍历方式的读吞吐
+
+- 直接遍历 product_db：无锁，但会遇到 "dictionary changed size during iteration"
+- 全局锁：读写共用一把锁，读不会出错，但会和写互相阻塞
+- 快照：读者取 catalog_snapshot() 后无锁遍历
+
+用法: python bench_snapshot.py [--products N] [--writers W] [--readers R] [--seconds S]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_service(products: int):
+    from seed_data import generate_demo_dataset
+    from services import ProductService, UserService
+    from snapshot import CatalogStore
+    user_service, product_service = UserService(), ProductService(snapshots=CatalogStore())
+    generate_demo_dataset(user_service, product_service, users=50, products=products)
+    return user_service, product_service
+
+
+def run(mode: str, products: int, writers: int, readers: int, seconds: float) -> dict:
+    user_service, product_service = build_service(products)
+    sellers = list(user_service.user_db.values())
+    lock = threading.Lock()
+    stop = threading.Event()
+    counts = {"scans": 0, "errors": 0, "writes": 0}
+    counts_lock = threading.Lock()
+
+    def write(rng: random.Random):
+        if rng.random() < 0.5:
+            product_service.publish_product(rng.choice(sellers), f"新品 {rng.random():.6f}", "基准写入", 99.0, "基准")
+        else:
+            product = product_service.find_product_by_id(rng.choice(ids))
+            if product is not None:
+                product_service.update_product(product, price=float(rng.randint(1, 1000)))
+
+    def writer(seed: int):
+        rng = random.Random(seed)
+        done = 0
+        while not stop.is_set():
+            if mode == "lock":
+                with lock:
+                    write(rng)
+            else:
+                write(rng)
+            done += 1
+        with counts_lock:
+            counts["writes"] += done
+
+    def scan() -> int:
+        if mode == "snapshot":
+            return sum(1 for r in product_service.catalog_snapshot() if r.price > 500)
+        if mode == "lock":
+            with lock:
+                return sum(1 for p in product_service.product_db.values() if p.price > 500)
+        return sum(1 for p in product_service.product_db.values() if p.price > 500)
+
+    def reader():
+        scans = errors = 0
+        while not stop.is_set():
+            try:
+                scan()
+                scans += 1
+            except RuntimeError:
+                errors += 1
+        with counts_lock:
+            counts["scans"] += scans
+            counts["errors"] += errors
+
+    ids = list(product_service.product_db)
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    counts["scans_per_sec"] = counts["scans"] / seconds
+    counts["writes_per_sec"] = counts["writes"] / seconds
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    # 发布和修改商品时的打印会拖慢写线程，基准期间屏蔽标准输出
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        results = {mode: run(mode, args.products, args.writers, args.readers, args.seconds)
+                   for mode in ("direct", "lock", "snapshot")}
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print(f"{args.products} 件商品, {args.writers} 个写线程, {args.readers} 个读线程, 每项 {args.seconds:.1f} 秒")
+    for mode, r in results.items():
+        print(f"{mode:>8}: 全表扫描 {r['scans_per_sec']:8.1f} 次/秒  写入 {r['writes_per_sec']:9.1f} 次/秒  "
+              f"遍历出错 {r['errors']} 次")
+
+
+if __name__ == "__main__":
+    main()
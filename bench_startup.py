@@ -0,0 +1,88 @@
+# bench_startup.py
+"""启动耗时基准：对比模块导入时间，以及逐条发布与种子文件载入的启动时间
+
+用法: python bench_startup.py [--products N] [--repeat R]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(module: str, repeat: int) -> float:
+    """在新进程中导入模块，返回中位数耗时（毫秒）"""
+    code = f"import time; s = time.perf_counter(); import {module}; print(time.perf_counter() - s)"
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True)
+        if result.returncode != 0:
+            return float("nan")
+        samples.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return statistics.median(samples)
+
+
+def time_replay(users: int, products: int, repeat: int) -> float:
+    from headless import MarketplaceCore
+    import random
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        core = MarketplaceCore(prepopulate=False)
+        u_svc, p_svc = core.user_service, core.product_service
+        # 逐条重放只模拟旧的启动方式，关闭限流和查重（生成的商品名彼此相近，会被判为重复）
+        p_svc.rate_limiter = None
+        p_svc.dedup = None
+        rng = random.Random(0)
+        sellers = [u_svc.register(str(i), f"user{i}@seed.com", "123", f"用户{i}") for i in range(users)]
+        for i in range(products):
+            p_svc.publish_product(rng.choice(sellers), f"商品 {i}", f"描述 {i}", float(i), f"分类{i % 8}")
+        samples.append((time.perf_counter() - start) * 1000)
+        core.close()
+    return statistics.median(samples)
+
+
+def time_seed_load(path: str, repeat: int) -> float:
+    from headless import MarketplaceCore
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        core = MarketplaceCore(seed_path=path)
+        core.product_service
+        samples.append((time.perf_counter() - start) * 1000)
+        core.close()
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from headless import MarketplaceCore
+    from seed_data import generate_demo_dataset, save_seed
+
+    print(f"导入 headless（无 tkinter）: {time_import('headless', args.repeat):8.1f} ms")
+    print(f"导入 main（含 tkinter）:     {time_import('main', args.repeat):8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_path = os.path.join(tmp, "seed.bin")
+        core = MarketplaceCore(prepopulate=False)
+        generate_demo_dataset(core.user_service, core.product_service, args.users, args.products)
+        size = save_seed(core.user_service, core.product_service, seed_path)
+        core.close()
+        replay = time_replay(args.users, args.products, args.repeat)
+        load = time_seed_load(seed_path, args.repeat)
+    print(f"逐条 register/publish 启动:  {replay:8.1f} ms  ({args.users} 用户, {args.products} 商品)")
+    print(f"种子文件载入启动:            {load:8.1f} ms  (种子 {size} 字节)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# columnar.py
+import json
+import struct
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+MAGIC = b"SPCOL1\n"
+DEFAULT_CHUNK_ROWS = 4096
+
+# 列类型：f64 / i64 使用定长数组，str 使用 偏移数组 + UTF-8 字节块
+COLUMN_TYPES = ("f64", "i64", "str")
+
+_U32 = struct.Struct("<I")
+
+
+def _encode_column(col_type: str, values: list) -> bytes:
+    if col_type == "f64":
+        raw = array("d", values).tobytes()
+    elif col_type == "i64":
+        raw = array("q", values).tobytes()
+    else:
+        encoded = [("" if v is None else str(v)).encode("utf-8") for v in values]
+        offsets = array("I", [0])
+        total = 0
+        for item in encoded:
+            total += len(item)
+            offsets.append(total)
+        raw = _U32.pack(len(offsets)) + offsets.tobytes() + b"".join(encoded)
+    return zlib.compress(raw, 1)
+
+
+def _decode_column(col_type: str, blob: bytes) -> list:
+    raw = zlib.decompress(blob)
+    if col_type == "f64":
+        values = array("d")
+        values.frombytes(raw)
+        return values.tolist()
+    if col_type == "i64":
+        values = array("q")
+        values.frombytes(raw)
+        return values.tolist()
+    count = _U32.unpack_from(raw, 0)[0]
+    offsets = array("I")
+    offsets.frombytes(raw[4:4 + count * 4])
+    data = raw[4 + count * 4:]
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count - 1)]
+
+
+class ColumnarWriter:
+    """按块写入列式文件，每块缓存 chunk_rows 行后落盘，内存占用与总行数无关"""
+    def __init__(self, path: str, schema: Sequence[Tuple[str, str]], chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        for _, col_type in schema:
+            if col_type not in COLUMN_TYPES:
+                raise ValueError(f"不支持的列类型: {col_type}")
+        self.schema: List[Tuple[str, str]] = list(schema)
+        self.chunk_rows: int = chunk_rows
+        self.rows_written: int = 0
+        self._columns: List[list] = [[] for _ in self.schema]
+        self._file = open(path, "wb")
+        header = json.dumps({"columns": self.schema}).encode("utf-8")
+        self._file.write(MAGIC + _U32.pack(len(header)) + header)
+
+    def write_row(self, row: Sequence):
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if len(self._columns[0]) >= self.chunk_rows:
+            self._flush_chunk()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def _flush_chunk(self):
+        count = len(self._columns[0])
+        if not count:
+            return
+        meta = []
+        blobs = []
+        for (name, col_type), values in zip(self.schema, self._columns):
+            blob = _encode_column(col_type, values)
+            entry = {"name": name, "length": len(blob)}
+            if col_type != "str":
+                entry["min"] = min(values)
+                entry["max"] = max(values)
+            meta.append(entry)
+            blobs.append(blob)
+        header = json.dumps({"rows": count, "columns": meta}).encode("utf-8")
+        self._file.write(_U32.pack(len(header)) + header)
+        for blob in blobs:
+            self._file.write(blob)
+        self.rows_written += count
+        self._columns = [[] for _ in self.schema]
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._flush_chunk()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ColumnarReader:
+    """读取列式文件；只解压需要的列，并依据块级 min/max 跳过不满足区间条件的块"""
+    def __init__(self, path: str):
+        self.path: str = path
+        self.chunks_scanned: int = 0
+        self.chunks_skipped: int = 0
+        with open(path, "rb") as f:
+            self.schema: List[Tuple[str, str]] = [tuple(c) for c in self._read_file_header(f)["columns"]]
+        self.types: Dict[str, str] = dict(self.schema)
+
+    @staticmethod
+    def _read_file_header(f) -> dict:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("不是有效的列式导出文件")
+        size = _U32.unpack(f.read(4))[0]
+        return json.loads(f.read(size))
+
+    @staticmethod
+    def _chunk_matches(meta: Dict[str, dict], where: Dict[str, Tuple]) -> bool:
+        for name, (low, high) in where.items():
+            stats = meta[name]
+            if low is not None and stats["max"] < low:
+                return False
+            if high is not None and stats["min"] > high:
+                return False
+        return True
+
+    def scan(self, columns: Optional[Sequence[str]] = None,
+             where: Optional[Dict[str, Tuple]] = None) -> Iterator[Dict[str, object]]:
+        """按行产出字典；where 形如 {"price": (下界, 上界)}，边界可为 None，区间为闭区间"""
+        columns = list(columns) if columns else [name for name, _ in self.schema]
+        where = where or {}
+        for name in list(columns) + list(where):
+            if name not in self.types:
+                raise KeyError(name)
+        for name in where:
+            if self.types[name] == "str":
+                raise ValueError(f"字符串列不支持区间过滤: {name}")
+        needed = set(columns) | set(where)
+
+        with open(self.path, "rb") as f:
+            self._read_file_header(f)
+            while True:
+                size_bytes = f.read(4)
+                if not size_bytes:
+                    break
+                header = json.loads(f.read(_U32.unpack(size_bytes)[0]))
+                meta = {entry["name"]: entry for entry in header["columns"]}
+                if not self._chunk_matches(meta, where):
+                    f.seek(sum(entry["length"] for entry in header["columns"]), 1)
+                    self.chunks_skipped += 1
+                    continue
+                self.chunks_scanned += 1
+                decoded = {}
+                for entry in header["columns"]:
+                    if entry["name"] in needed:
+                        decoded[entry["name"]] = _decode_column(self.types[entry["name"]], f.read(entry["length"]))
+                    else:
+                        f.seek(entry["length"], 1)
+                for i in range(header["rows"]):
+                    keep = True
+                    for name, (low, high) in where.items():
+                        value = decoded[name][i]
+                        if (low is not None and value < low) or (high is not None and value > high):
+                            keep = False
+                            break
+                    if keep:
+                        yield {name: decoded[name][i] for name in columns}
+
+
+PRODUCT_SCHEMA = [
+    ("product_id", "str"), ("seller_id", "str"), ("name", "str"), ("description", "str"),
+    ("price", "f64"), ("category", "str"), ("status", "str"),
+]
+FAVORITE_SCHEMA = [("user_id", "str"), ("product_id", "str"), ("added_at", "f64")]
+MESSAGE_SCHEMA = [
+    ("message_id", "str"), ("sender_id", "str"), ("receiver_id", "str"),
+    ("content", "str"), ("content_type", "str"), ("sent_at", "f64"),
+]
+
+
+def export_products(product_service, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    snapshot = product_service.catalog_snapshot()
+    with ColumnarWriter(path, PRODUCT_SCHEMA, chunk_rows) as writer:
+        if snapshot is not None:
+            # 导出期间不受并发发布、修改影响，得到的是同一版本的完整目录
+            for r in snapshot:
+                writer.write_row((str(r.productId), str(r.sellerId), r.name, r.description,
+                                  float(r.price), r.category, r.status.value))
+        else:
+            for p in product_service.product_db.values():
+                writer.write_row((str(p.productId), str(p.seller.userId), p.name, p.description,
+                                  float(p.price), p.category.name, p.status.value))
+    return writer.rows_written
+
+
+def export_favorites(product_service, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    with ColumnarWriter(path, FAVORITE_SCHEMA, chunk_rows) as writer:
+        for fav in product_service.favorites_db:
+            writer.write_row((str(fav.user.userId), str(fav.product.productId), fav.addedAt.timestamp()))
+    return writer.rows_written
+
+
+def export_messages(im_service, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    with ColumnarWriter(path, MESSAGE_SCHEMA, chunk_rows) as writer:
+        for m in im_service.iter_messages():
+            writer.write_row((str(m.messageId), str(m.sender.userId), str(m.receiver.userId),
+                              m.content, m.contentType.value, m.sentAt.timestamp()))
+    return writer.rows_written
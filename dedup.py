@@ -0,0 +1,236 @@
+# dedup.py
+import hashlib
+import re
+import threading
+from array import array
+from itertools import islice
+from operator import eq
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ids import EntityId
+from models import Product, ProductStatus
+
+DEFAULT_NUM_PERM = 128
+# 16 带 × 每带 8 行：相似度 0.8 的商品对成为候选的概率约 0.95，0.5 的约 0.06
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+# 后台构建时每批计算签名的商品数，批与批之间释放锁让查询插队
+BUILD_CHUNK = 256
+
+_EMPTY = 0xFFFFFFFF
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+class DuplicateListing(Exception):
+    def __init__(self, product: Product, similarity: float):
+        super().__init__(f"与您在售的商品《{product.name}》重复（相似度 {similarity:.0%}），请勿重复发布")
+        self.product: Product = product
+        self.similarity: float = similarity
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """规范化（小写、标点空白合并为一个空格）后按字符取长度为 size 的片段"""
+    text = _SEPARATORS.sub(" ", text.lower()).strip()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash(shingle_set: Iterable[str], num_perm: int = DEFAULT_NUM_PERM) -> array:
+    """MinHash 签名：每个片段用一次 SHAKE-128 生成 num_perm 个 32 位哈希作为一行，
+    再按列取最小值。哈希行和按列取最小都在 C 层批量完成，不逐个排列做 Python 运算。"""
+    size = num_perm * 4
+    rows = [array("I", hashlib.shake_128(s.encode("utf-8")).digest(size)) for s in shingle_set]
+    if not rows:
+        return array("I", [_EMPTY]) * num_perm
+    if len(rows) == 1:
+        return rows[0]
+    return array("I", map(min, *rows))
+
+
+def similarity(sig_a: array, sig_b: array) -> float:
+    """两个签名相同位置相等的比例，即 Jaccard 相似度的估计"""
+    return sum(map(eq, sig_a, sig_b)) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """按名称和描述检测近似重复商品
+
+    签名切成若干带，每带的字节串作为桶键；只有至少一带完全相同的商品才是候选，
+    查询只需查 bands 个桶，不必与全部商品两两比较。
+    """
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 threshold: float = DEFAULT_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) 必须能被 bands ({bands}) 整除")
+        self.num_perm: int = num_perm
+        self.bands: int = bands
+        self.rows: int = num_perm // bands
+        self.threshold: float = threshold
+        self._products: Dict[EntityId, Product] = {}
+        self._signatures: Dict[EntityId, array] = {}
+        self._buckets: List[Dict[bytes, Set[EntityId]]] = [{} for _ in range(bands)]
+        # 批量载入的商品先挂起，由 build 在后台计算签名；查询时若仍有挂起的商品则就地补齐
+        self._pending: Dict[EntityId, Product] = {}
+        self._lock = threading.RLock()
+        self.comparisons: int = 0
+
+    def __len__(self):
+        return len(self._products) + len(self._pending)
+
+    def signature(self, name: str, description: str) -> array:
+        return minhash(shingles(f"{name} {description}"), self.num_perm)
+
+    def _band_keys(self, signature: array) -> List[bytes]:
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
+
+    def _index(self, product: Product, signature: array):
+        product_id = product.productId
+        if product_id in self._signatures:
+            self._unindex(product_id)
+        self._products[product_id] = product
+        self._signatures[product_id] = signature
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(key, set()).add(product_id)
+
+    def _unindex(self, product_id: EntityId):
+        signature = self._signatures.pop(product_id)
+        del self._products[product_id]
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            bucket = buckets[key]
+            bucket.discard(product_id)
+            if not bucket:
+                del buckets[key]
+
+    def _ensure(self):
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            for product in pending.values():
+                self._index(product, self.signature(product.name, product.description))
+
+    def add(self, product: Product, signature: Optional[array] = None):
+        """加入或重新索引商品；signature 可传入发布前检查时已算好的签名"""
+        if signature is None:
+            signature = self.signature(product.name, product.description)
+        with self._lock:
+            self._pending.pop(product.productId, None)
+            self._index(product, signature)
+
+    def add_many(self, products: Iterable[Product]):
+        with self._lock:
+            for product in products:
+                self._pending[product.productId] = product
+
+    def build(self, chunk_size: int = BUILD_CHUNK):
+        """为挂起的商品计算签名并入索引；签名在锁外分批计算，查询不必等整批完成"""
+        while True:
+            with self._lock:
+                chunk = list(islice(self._pending.values(), chunk_size))
+            if not chunk:
+                return
+            signed = [(product, self.signature(product.name, product.description)) for product in chunk]
+            with self._lock:
+                for product, signature in signed:
+                    # 计算期间被 remove 或经 add 重新索引的商品已不在挂起表中，跳过
+                    if self._pending.get(product.productId) is product:
+                        del self._pending[product.productId]
+                        self._index(product, signature)
+
+    def build_in_background(self) -> threading.Thread:
+        """批量载入（如种子数据）后调用，避免第一次发布时在界面线程上集中计算全部签名"""
+        thread = threading.Thread(target=self.build, name="dedup-build", daemon=True)
+        thread.start()
+        return thread
+
+    def remove(self, product_id: EntityId):
+        with self._lock:
+            self._pending.pop(product_id, None)
+            if product_id in self._signatures:
+                self._unindex(product_id)
+
+    def _candidates(self, signature: array) -> Set[EntityId]:
+        found: Set[EntityId] = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            bucket = buckets.get(key)
+            if bucket:
+                found |= bucket
+        return found
+
+    def _matches(self, signature: array, threshold: float) -> List[Tuple[Product, float]]:
+        results = []
+        for product_id in self._candidates(signature):
+            self.comparisons += 1
+            score = similarity(signature, self._signatures[product_id])
+            if score >= threshold:
+                results.append((self._products[product_id], score))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results
+
+    def query(self, name: str, description: str, threshold: Optional[float] = None,
+              signature: Optional[array] = None) -> List[Tuple[Product, float]]:
+        """与给定名称、描述近似重复的商品，按相似度降序"""
+        threshold = self.threshold if threshold is None else threshold
+        if signature is None:
+            signature = self.signature(name, description)
+        with self._lock:
+            self._ensure()
+            return self._matches(signature, threshold)
+
+    def _ensure_seller(self, seller_id: EntityId):
+        # 查重只关心同一卖家的商品：只为该卖家挂起的商品补算签名，不必等整个目录建完
+        own = [p for p in self._pending.values() if p.seller.userId == seller_id]
+        for product in own:
+            del self._pending[product.productId]
+            self._index(product, self.signature(product.name, product.description))
+
+    def check(self, seller_id: EntityId, name: str, description: str) -> array:
+        """发布前检查：同一卖家已有在售的近似重复商品时抛出 DuplicateListing，否则返回签名供 add 复用"""
+        signature = self.signature(name, description)
+        with self._lock:
+            self._ensure_seller(seller_id)
+            matches = self._matches(signature, self.threshold)
+        for product, score in matches:
+            if product.seller.userId == seller_id and product.status == ProductStatus.ON_SALE:
+                raise DuplicateListing(product, score)
+        return signature
+
+    def clusters(self, threshold: Optional[float] = None) -> List[List[Product]]:
+        """批量模式：把整个目录中的近似重复商品聚成簇（并查集），只返回包含两件及以上商品的簇"""
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            self._ensure()
+            parent: Dict[EntityId, EntityId] = {}
+
+            def find(x):
+                root = x
+                while root in parent:
+                    root = parent[root]
+                while x != root:
+                    parent[x], x = root, parent[x]
+                return root
+
+            signatures = self._signatures
+            for buckets in self._buckets:
+                for bucket in buckets.values():
+                    if len(bucket) < 2:
+                        continue
+                    members = list(bucket)
+                    for i, a in enumerate(members):
+                        for b in members[i + 1:]:
+                            root_a, root_b = find(a), find(b)
+                            if root_a == root_b:
+                                continue
+                            self.comparisons += 1
+                            if similarity(signatures[a], signatures[b]) >= threshold:
+                                parent[root_b] = root_a
+            groups: Dict[EntityId, List[Product]] = {}
+            for product_id in set(parent) | set(parent.values()):
+                groups.setdefault(find(product_id), []).append(self._products[product_id])
+        return list(groups.values())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"products": len(self), "buckets": sum(len(b) for b in self._buckets),
+                    "comparisons": self.comparisons}
@@ -0,0 +1,139 @@
+# facets.py
+import bisect
+from typing import Dict, List, Optional, Set, Tuple
+
+from ids import EntityId
+from models import Product, ProductStatus
+
+
+class FacetResult:
+    def __init__(self, product_ids: List[EntityId], category_counts: Dict[str, int],
+                 status_counts: Dict[ProductStatus, int]):
+        self.product_ids: List[EntityId] = product_ids
+        self.category_counts: Dict[str, int] = category_counts
+        self.status_counts: Dict[ProductStatus, int] = status_counts
+        self.products: List[Product] = []
+
+    @property
+    def total(self) -> int:
+        return len(self.product_ids)
+
+
+class FacetIndex:
+    """价格有序索引 + 分类/状态倒排集合；查询时按基数从小到大求交集"""
+    def __init__(self):
+        self._by_price: List[Tuple[float, EntityId]] = []
+        self._by_category: Dict[str, Set[EntityId]] = {}
+        self._by_status: Dict[ProductStatus, Set[EntityId]] = {}
+        # 记录入索引时的取值，更新时据此从旧位置删除
+        self._entries: Dict[EntityId, Tuple[float, str, ProductStatus]] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, product: Product):
+        if product.productId in self._entries:
+            self.remove(product.productId)
+        pid = product.productId
+        entry = (product.price, product.category.name, product.status)
+        self._entries[pid] = entry
+        bisect.insort(self._by_price, (entry[0], pid))
+        self._by_category.setdefault(entry[1], set()).add(pid)
+        self._by_status.setdefault(entry[2], set()).add(pid)
+
+    def add_many(self, products):
+        """批量载入时整体排序一次，避免逐条 insort"""
+        for product in products:
+            pid = product.productId
+            if pid in self._entries:
+                self.remove(pid)
+            entry = (product.price, product.category.name, product.status)
+            self._entries[pid] = entry
+            self._by_price.append((entry[0], pid))
+            self._by_category.setdefault(entry[1], set()).add(pid)
+            self._by_status.setdefault(entry[2], set()).add(pid)
+        self._by_price.sort()
+
+    def remove(self, product_id: EntityId):
+        entry = self._entries.pop(product_id, None)
+        if entry is None:
+            return
+        price, category, status = entry
+        i = bisect.bisect_left(self._by_price, (price, product_id))
+        if i < len(self._by_price) and self._by_price[i] == (price, product_id):
+            del self._by_price[i]
+        self._discard(self._by_category, category, product_id)
+        self._discard(self._by_status, status, product_id)
+
+    @staticmethod
+    def _discard(postings: dict, key, product_id: EntityId):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del postings[key]
+
+    def _price_bounds(self, price_min: Optional[float], price_max: Optional[float]) -> Tuple[int, int]:
+        lo = 0 if price_min is None else bisect.bisect_left(self._by_price, price_min, key=_price_of)
+        hi = len(self._by_price) if price_max is None else bisect.bisect_right(self._by_price, price_max, key=_price_of)
+        return lo, max(lo, hi)
+
+    def _match(self, category: Optional[str], status: Optional[ProductStatus],
+               price_min: Optional[float], price_max: Optional[float]) -> Set[EntityId]:
+        constraints = []
+        if category is not None:
+            constraints.append(self._by_category.get(category, _EMPTY))
+        if status is not None:
+            constraints.append(self._by_status.get(status, _EMPTY))
+        has_price = price_min is not None or price_max is not None
+        lo, hi = self._price_bounds(price_min, price_max)
+
+        if not constraints:
+            if has_price:
+                return {pid for _, pid in self._by_price[lo:hi]}
+            return set(self._entries)
+        constraints.sort(key=len)
+        smallest = constraints[0]
+        if has_price and hi - lo < len(smallest):
+            # 价格区间最窄：从区间出发，逐个检查其余集合
+            return {pid for _, pid in self._by_price[lo:hi] if all(pid in c for c in constraints)}
+        result = set(smallest)
+        for other in constraints[1:]:
+            result &= other
+            if not result:
+                return result
+        if has_price:
+            entries = self._entries
+            low = float("-inf") if price_min is None else price_min
+            high = float("inf") if price_max is None else price_max
+            result = {pid for pid in result if low <= entries[pid][0] <= high}
+        return result
+
+    def query(self, category: Optional[str] = None, status: Optional[ProductStatus] = None,
+              price_min: Optional[float] = None, price_max: Optional[float] = None,
+              sort_by_price: bool = True) -> FacetResult:
+        """返回匹配的商品 ID 及分面计数；某一维度的计数不受该维度自身过滤条件影响"""
+        matched = self._match(category, status, price_min, price_max)
+        entries = self._entries
+        category_base = matched if category is None else self._match(None, status, price_min, price_max)
+        status_base = matched if status is None else self._match(category, None, price_min, price_max)
+        category_counts: Dict[str, int] = {}
+        for pid in category_base:
+            name = entries[pid][1]
+            category_counts[name] = category_counts.get(name, 0) + 1
+        status_counts: Dict[ProductStatus, int] = {}
+        for pid in status_base:
+            st = entries[pid][2]
+            status_counts[st] = status_counts.get(st, 0) + 1
+        if sort_by_price:
+            ids = sorted(matched, key=lambda pid: (entries[pid][0], pid))
+        else:
+            ids = list(matched)
+        return FacetResult(ids, category_counts, status_counts)
+
+
+_EMPTY: Set[EntityId] = frozenset()
+
+
+def _price_of(entry: Tuple[float, EntityId]) -> float:
+    return entry[0]
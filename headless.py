@@ -0,0 +1,137 @@
+# headless.py
+"""不依赖 tkinter 的入口：测试、批处理和服务端直接使用 MarketplaceCore"""
+import argparse
+import time
+from typing import Callable, Optional
+
+from autocomplete import AutocompleteIndex
+from broker import BrokerClient
+from dedup import NearDuplicateIndex
+from events import EventBus
+from ids import SnowflakeIdGenerator, get_id_generator, set_id_generator
+from inbox import InboxIndex
+from query_cache import QueryCache
+from rate_limit import RateLimiter
+from recommend import SimilarProductIndex
+from seed_data import load_seed, prepopulate_demo, save_seed, generate_demo_dataset
+from snapshot import CatalogStore
+from services import IMService, NotificationService, ProductService, UserService
+
+
+class MarketplaceCore:
+    """服务容器；服务在第一次被访问时才创建并写入种子数据"""
+    def __init__(self, seed_path: Optional[str] = None, prepopulate: bool = True, broker_path: Optional[str] = None,
+                 dispatcher: Optional[Callable] = None):
+        self.seed_path: Optional[str] = seed_path
+        self.prepopulate: bool = prepopulate
+        # 本机消息代理的套接字路径；设置后 IMService 可以和其他进程的用户互发消息。
+        # 不同进程的用户 ID 各不相同，其他进程的在线用户以占位对象出现在聊天对象列表中
+        self.broker_path: Optional[str] = broker_path
+        # 见 IMService 的 dispatcher：GUI 传入后，其他进程发来的消息在主线程上存储
+        self.dispatcher: Optional[Callable] = dispatcher
+        self._services: Optional[dict] = None
+
+    def _ensure_services(self) -> dict:
+        if self._services is None:
+            router = None
+            if self.broker_path:
+                router = BrokerClient(self.broker_path).connect()
+                if isinstance(get_id_generator(), SnowflakeIdGenerator):
+                    # 代理为每个进程分配不同的节点号，多进程生成的 ID 不会冲突
+                    set_id_generator(SnowflakeIdGenerator(node_id=router.node_id))
+            rate_limiter = RateLimiter()
+            event_bus = EventBus()
+            user_service = UserService(rate_limiter=rate_limiter)
+            product_service = ProductService(rate_limiter=rate_limiter, recommender=SimilarProductIndex(),
+                                             autocomplete=AutocompleteIndex(), query_cache=QueryCache(),
+                                             event_bus=event_bus, snapshots=CatalogStore(),
+                                             dedup=NearDuplicateIndex())
+            notification_service = NotificationService()
+            im_service = IMService(notification_service, user_service, inbox=InboxIndex(),
+                                   rate_limiter=rate_limiter, event_bus=event_bus, router=router,
+                                   dispatcher=self.dispatcher)
+            event_bus.start()
+            self._services = {
+                "rate_limiter": rate_limiter,
+                "event_bus": event_bus,
+                "user": user_service,
+                "product": product_service,
+                "notification": notification_service,
+                "im": im_service,
+                "router": router,
+            }
+            if self.seed_path:
+                load_seed(user_service, product_service, self.seed_path)
+            elif self.prepopulate:
+                prepopulate_demo(user_service, product_service)
+        return self._services
+
+    @property
+    def started(self) -> bool:
+        return self._services is not None
+
+    def close(self):
+        """断开消息代理并投递完已排队的事件后停止事件总线线程；未创建服务时什么也不做"""
+        if self._services is None:
+            return
+        router = self._services["router"]
+        if router is not None:
+            router.close()
+        self._services["event_bus"].stop()
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return self._ensure_services()["rate_limiter"]
+
+    @property
+    def event_bus(self) -> EventBus:
+        return self._ensure_services()["event_bus"]
+
+    @property
+    def user_service(self) -> UserService:
+        return self._ensure_services()["user"]
+
+    @property
+    def product_service(self) -> ProductService:
+        return self._ensure_services()["product"]
+
+    @property
+    def notification_service(self) -> NotificationService:
+        return self._ensure_services()["notification"]
+
+    @property
+    def im_service(self) -> IMService:
+        return self._ensure_services()["im"]
+
+    @property
+    def router(self) -> Optional[BrokerClient]:
+        return self._ensure_services()["router"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="网络商场无界面入口")
+    parser.add_argument("--seed", help="从种子文件载入数据")
+    parser.add_argument("--build-seed", metavar="PATH", help="生成种子文件后退出")
+    parser.add_argument("--users", type=int, default=100, help="生成种子时的用户数")
+    parser.add_argument("--products", type=int, default=5000, help="生成种子时的商品数")
+    parser.add_argument("--broker", metavar="SOCKET", help="连接本机消息代理，与其他进程互发消息")
+    args = parser.parse_args(argv)
+
+    if args.build_seed:
+        core = MarketplaceCore(prepopulate=False)
+        generate_demo_dataset(core.user_service, core.product_service, args.users, args.products)
+        size = save_seed(core.user_service, core.product_service, args.build_seed)
+        core.close()
+        print(f"种子文件已生成: {args.build_seed} ({size} 字节)")
+        return core
+
+    start = time.perf_counter()
+    core = MarketplaceCore(seed_path=args.seed, broker_path=args.broker)
+    users = len(core.user_service.user_db)
+    products = len(core.product_service.product_db)
+    print(f"服务已就绪: {users} 个用户, {products} 件商品, 耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    return core
+
+
+if __name__ == "__main__":
+    main()
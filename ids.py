@@ -0,0 +1,93 @@
+# ids.py
+import threading
+import time
+import uuid
+from typing import Union
+
+# 实体 ID：默认是 64 位按时间递增的整数，兼容模式下为 uuid.UUID
+EntityId = Union[int, uuid.UUID]
+
+# 位布局：41 位毫秒时间戳 | 10 位节点号 | 12 位序列号
+TIMESTAMP_BITS = 41
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# 自定义纪元 2024-01-01 00:00:00 UTC，41 位毫秒可用约 69 年
+DEFAULT_EPOCH_MS = 1704067200000
+
+
+class SnowflakeIdGenerator:
+    """生成 64 位按时间递增的整数 ID，可直接作为字典键和排序键"""
+    def __init__(self, node_id: int = 0, epoch_ms: int = DEFAULT_EPOCH_MS, clock=time.time):
+        if not 0 <= node_id <= MAX_NODE:
+            raise ValueError(f"节点号必须在 0-{MAX_NODE} 之间")
+        self.node_id: int = node_id
+        self.epoch_ms: int = epoch_ms
+        self._clock = clock
+        self._last_ms: int = -1
+        self._sequence: int = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(self._clock() * 1000) - self.epoch_ms
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # 同一毫秒内或时钟回拨：沿用上次的时间戳继续递增，保证单调
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+
+
+class UUIDCompatIdGenerator:
+    """兼容模式：把时间有序的整数 ID 包装成 uuid.UUID，供依赖 UUID 类型的调用方使用"""
+    def __init__(self, node_id: int = 0, epoch_ms: int = DEFAULT_EPOCH_MS, clock=time.time):
+        self._inner = SnowflakeIdGenerator(node_id, epoch_ms, clock)
+
+    def next_id(self) -> uuid.UUID:
+        return uuid.UUID(int=self._inner.next_id())
+
+
+_generator = SnowflakeIdGenerator()
+
+
+def new_id() -> EntityId:
+    return _generator.next_id()
+
+
+def set_id_generator(generator):
+    """替换全局 ID 生成器，应在创建任何实体之前调用；返回原生成器"""
+    global _generator
+    previous = _generator
+    _generator = generator
+    return previous
+
+
+def get_id_generator():
+    return _generator
+
+
+def id_timestamp_ms(entity_id: EntityId, epoch_ms: int = DEFAULT_EPOCH_MS) -> int:
+    """从 ID 中取出生成时间（Unix 毫秒）"""
+    value = entity_id.int if isinstance(entity_id, uuid.UUID) else entity_id
+    return (value >> (NODE_BITS + SEQUENCE_BITS)) + epoch_ms
+
+
+def encode_id(entity_id: EntityId):
+    """序列化为 JSON 友好的值：整数保持整数，UUID 使用 32 位十六进制串"""
+    return entity_id.hex if isinstance(entity_id, uuid.UUID) else entity_id
+
+
+def decode_id(value) -> EntityId:
+    if isinstance(value, int):
+        return value
+    # 数据由本程序写出，跳过 uuid.UUID.__init__ 的格式校验
+    result = object.__new__(uuid.UUID)
+    object.__setattr__(result, "int", int(value, 16))
+    object.__setattr__(result, "is_safe", uuid.SafeUUID.unknown)
+    return result
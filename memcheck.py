@@ -0,0 +1,136 @@
+# memcheck.py
+import gc
+import linecache
+import os
+import sys
+import tracemalloc
+import warnings
+from typing import Callable, List, Optional
+
+DEFAULT_ITERATIONS = 300
+DEFAULT_WARMUP = 30
+TOP_LINES = 10
+
+# 统计时排除检查工具自身和标准库警告、导入机制产生的分配
+_IGNORED_FILES = (tracemalloc.__file__, warnings.__file__, linecache.__file__, os.path.abspath(__file__),
+                  "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+def open_fd_count() -> Optional[int]:
+    """当前进程打开的文件描述符数量；平台不支持时返回 None"""
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return None
+
+
+class MemoryUsage:
+    """一段操作重复执行后留存的内存和句柄"""
+    def __init__(self, name: str, iterations: int, retained_bytes: int, fds: Optional[int],
+                 unclosed_files: int, top: List[str]):
+        self.name: str = name
+        self.iterations: int = iterations
+        self.retained_bytes: int = retained_bytes
+        # 执行前后打开的描述符之差；平台不支持时为 None
+        self.fds: Optional[int] = fds
+        # 未关闭就被回收的文件对象（CPython 会在回收时关闭它们，描述符数量看不出来，只能靠 ResourceWarning 发现）
+        self.unclosed_files: int = unclosed_files
+        # 留存内存最多的源码行，按 "文件:行号: +字节 (块数)  源码" 格式
+        self.top: List[str] = top
+
+    @property
+    def bytes_per_op(self) -> float:
+        return self.retained_bytes / self.iterations
+
+    @property
+    def handles_per_op(self) -> float:
+        return (max(self.fds or 0, 0) + self.unclosed_files) / self.iterations
+
+    def summary(self) -> str:
+        lines = [f"{self.name}: {self.iterations} 次, 留存 {self.retained_bytes} 字节 ({self.bytes_per_op:.1f} 字节/次), "
+                 f"描述符 {'未知' if self.fds is None else f'{self.fds:+d}'}, 未关闭文件 {self.unclosed_files}"]
+        lines.extend("    " + line for line in self.top)
+        return "\n".join(lines)
+
+
+class MemoryBudgetExceeded(AssertionError):
+    def __init__(self, usage: MemoryUsage, reasons: List[str]):
+        super().__init__("; ".join(reasons) + "\n" + usage.summary())
+        self.usage: MemoryUsage = usage
+        self.reasons: List[str] = reasons
+
+
+def _format_top(diff, limit: int) -> List[str]:
+    lines = []
+    for stat in diff[:limit]:
+        if stat.size_diff <= 0:
+            break
+        frame = stat.traceback[0]
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        lines.append(f"{frame.filename}:{frame.lineno}: +{stat.size_diff} B ({stat.count_diff:+d} 块)  {source}")
+    return lines
+
+
+def measure(operation: Callable[[int], object], iterations: int = DEFAULT_ITERATIONS, warmup: int = DEFAULT_WARMUP,
+            name: Optional[str] = None, quiet: bool = True, top: int = TOP_LINES) -> MemoryUsage:
+    """先预热 warmup 次（填充惰性缓存、字典扩容等一次性开销），再在 tracemalloc 下执行 iterations 次，
+    统计垃圾回收后仍留存的内存、打开的描述符和未关闭的文件。operation 接收当前序号。"""
+    name = name or getattr(operation, "__name__", "operation")
+    stdout = sys.stdout
+    devnull = open(os.devnull, "w") if quiet else None
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        if quiet:
+            # 服务层大量 print，屏蔽后输出缓冲不会计入留存内存
+            sys.stdout = devnull
+        for i in range(warmup):
+            operation(i)
+        gc.collect()
+        if not was_tracing:
+            tracemalloc.start()
+        fds_before = open_fd_count()
+        before = tracemalloc.take_snapshot()
+        unclosed = [0]
+
+        def count_warning(message, category, *args, **kwargs):
+            # 只计数不保存，避免警告对象本身被算作留存内存
+            if issubclass(category, ResourceWarning) and "unclosed" in str(message):
+                unclosed[0] += 1
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("always", ResourceWarning)
+            warnings.showwarning = count_warning
+            for i in range(warmup, warmup + iterations):
+                operation(i)
+            gc.collect()
+        after = tracemalloc.take_snapshot()
+        fds_after = open_fd_count()
+    finally:
+        if not was_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        sys.stdout = stdout
+        if devnull is not None:
+            devnull.close()
+
+    filters = [tracemalloc.Filter(False, f) for f in _IGNORED_FILES]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    retained = sum(stat.size_diff for stat in diff)
+    fds = None if fds_before is None or fds_after is None else fds_after - fds_before
+    return MemoryUsage(name, iterations, retained, fds, unclosed[0], _format_top(diff, top))
+
+
+def check_budget(operation: Callable[[int], object], bytes_per_op: float, handles_per_op: float = 0.0,
+                 iterations: int = DEFAULT_ITERATIONS, warmup: int = DEFAULT_WARMUP,
+                 name: Optional[str] = None) -> MemoryUsage:
+    """测量 operation 并与预算比较，超出时抛出 MemoryBudgetExceeded，消息中列出留存最多的源码行"""
+    usage = measure(operation, iterations, warmup, name)
+    reasons = []
+    if usage.bytes_per_op > bytes_per_op:
+        reasons.append(f"每次留存 {usage.bytes_per_op:.1f} 字节，超出预算 {bytes_per_op:g} 字节")
+    if usage.handles_per_op > handles_per_op:
+        reasons.append(f"每次泄漏 {usage.handles_per_op:.3f} 个文件句柄，超出预算 {handles_per_op:g}")
+    if reasons:
+        raise MemoryBudgetExceeded(usage, reasons)
+    return usage
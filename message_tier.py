@@ -0,0 +1,139 @@
+# message_tier.py
+import json
+import lzma
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ids import EntityId, decode_id, encode_id
+from models import ContentType, Message, User, conversation_key
+
+# 每个压缩块最多包含的消息数
+DEFAULT_BLOCK_SIZE = 256
+
+_CODECS = {
+    "zlib": (lambda raw: zlib.compress(raw, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def restore_message(sender: User, receiver: User, message_id, content: str,
+                    content_type: str, sent_at: float, seq: int = 0) -> Message:
+    message = Message(sender=sender, receiver=receiver, content=content, content_type=ContentType(content_type))
+    message.messageId = decode_id(message_id)
+    message.sentAt = datetime.fromtimestamp(sent_at)
+    message.seq = seq
+    return message
+
+
+class ColdBlock:
+    # 块之间按 seq 排序；first_at / last_at 只作展示，时钟回拨时不保证有序
+    __slots__ = ("first_seq", "last_seq", "first_at", "last_at", "count", "payload")
+
+    def __init__(self, first_seq: int, last_seq: int, first_at: float, last_at: float, count: int, payload: bytes):
+        self.first_seq: int = first_seq
+        self.last_seq: int = last_seq
+        self.first_at: float = first_at
+        self.last_at: float = last_at
+        self.count: int = count
+        self.payload: bytes = payload
+
+
+class ColdMessageStore:
+    """冷消息层：超过 max_age 的消息按会话压缩成块，读取时解压并放入 LRU 缓存"""
+    def __init__(self, max_age: timedelta = timedelta(days=7), codec: str = "zlib",
+                 block_size: int = DEFAULT_BLOCK_SIZE, cache_blocks: int = 64):
+        if codec not in _CODECS:
+            raise ValueError(f"不支持的压缩算法: {codec}")
+        self.max_age: timedelta = max_age
+        self.codec: str = codec
+        self.block_size: int = block_size
+        self.cache_blocks: int = cache_blocks
+        self.blocks: Dict[Tuple[str, str], List[ColdBlock]] = {}
+        self.users: Dict[EntityId, User] = {}
+        self._cache: "OrderedDict[Tuple[Tuple[str, str], int], List[Message]]" = OrderedDict()
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+
+    def compact(self, messages: List[Message], now: Optional[datetime] = None) -> List[Message]:
+        """把过期消息移入压缩块，返回仍需留在内存中的热消息"""
+        cutoff = (now or datetime.now()) - self.max_age
+        hot: List[Message] = []
+        cold: Dict[Tuple[str, str], List[Message]] = {}
+        for msg in messages:
+            if msg.sentAt < cutoff:
+                cold.setdefault(conversation_key(msg.sender.userId, msg.receiver.userId), []).append(msg)
+            else:
+                hot.append(msg)
+        compress = _CODECS[self.codec][0]
+        for key, items in cold.items():
+            items.sort(key=lambda m: m.seq)
+            blocks = self.blocks.setdefault(key, [])
+            for start in range(0, len(items), self.block_size):
+                chunk = items[start:start + self.block_size]
+                rows = []
+                for m in chunk:
+                    self.users[m.sender.userId] = m.sender
+                    self.users[m.receiver.userId] = m.receiver
+                    rows.append([encode_id(m.messageId), encode_id(m.sender.userId),
+                                 encode_id(m.receiver.userId), m.content, m.contentType.value,
+                                 m.sentAt.timestamp(), m.seq])
+                payload = compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+                blocks.append(ColdBlock(rows[0][6], rows[-1][6], rows[0][5], rows[-1][5], len(rows), payload))
+            blocks.sort(key=lambda b: b.first_seq)
+            # 会话的块列表变化后，缓存里按下标存放的旧块全部作废
+            for cached in [k for k in self._cache if k[0] == key]:
+                del self._cache[cached]
+        return hot
+
+    def _load_block(self, key: Tuple[str, str], index: int) -> List[Message]:
+        cache_key = (key, index)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            self.cache_hits += 1
+            return cached
+        self.cache_misses += 1
+        messages = self._decode_block(self.blocks[key][index])
+        self._cache[cache_key] = messages
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return messages
+
+    def _decode_block(self, block: ColdBlock) -> List[Message]:
+        rows = json.loads(_CODECS[self.codec][1](block.payload))
+        users = self.users
+        return [
+            restore_message(users[decode_id(s)], users[decode_id(r)], mid, content, ct, ts, seq)
+            for mid, s, r, content, ct, ts, seq in rows
+        ]
+
+    def count(self, user_id_a: EntityId, user_id_b: EntityId) -> int:
+        return sum(b.count for b in self.blocks.get(conversation_key(user_id_a, user_id_b), []))
+
+    def history(self, user_id_a: EntityId, user_id_b: EntityId, limit: Optional[int] = None) -> List[Message]:
+        """按 seq 顺序返回会话的冷消息；指定 limit 时只解压覆盖最近 limit 条所需的块"""
+        key = conversation_key(user_id_a, user_id_b)
+        blocks = self.blocks.get(key, [])
+        collected: List[List[Message]] = []
+        total = 0
+        for index in range(len(blocks) - 1, -1, -1):
+            if limit is not None and total >= limit:
+                break
+            block_messages = self._load_block(key, index)
+            collected.append(block_messages)
+            total += len(block_messages)
+        result = [m for block in reversed(collected) for m in block]
+        if limit is not None:
+            result = result[-limit:] if limit else []
+        return result
+
+    def iter_messages(self) -> Iterator[Message]:
+        """顺序遍历全部冷消息，用于导出；逐块解压且不占用 LRU 缓存"""
+        for blocks in self.blocks.values():
+            for block in blocks:
+                yield from self._decode_block(block)
+
+    def compressed_bytes(self) -> int:
+        return sum(len(b.payload) for blocks in self.blocks.values() for b in blocks)
@@ -0,0 +1,47 @@
+# purge_job.py
+import threading
+from typing import Optional
+
+DEFAULT_INTERVAL_SECONDS = 60.0
+DEFAULT_BATCH_SIZE = 500
+
+
+class RemovedListingPurger:
+    """后台定期调用 ProductService.purge_removed，每轮最多清理 max_batches 批"""
+    def __init__(self, product_service, interval_seconds: float = DEFAULT_INTERVAL_SECONDS,
+                 batch_size: int = DEFAULT_BATCH_SIZE, max_batches: int = 10):
+        self.product_service = product_service
+        self.interval_seconds: float = interval_seconds
+        self.batch_size: int = batch_size
+        self.max_batches: int = max_batches
+        self.purged_total: int = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> int:
+        purged = 0
+        for _ in range(self.max_batches):
+            count = self.product_service.purge_removed(self.batch_size)
+            purged += count
+            if count < self.batch_size:
+                break
+        self.purged_total += purged
+        return purged
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.interval_seconds):
+                self.run_once()
+
+        self._thread = threading.Thread(target=run, name="removed-listing-purger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,125 @@
+# push_coalescer.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from ids import EntityId
+
+DEFAULT_WINDOW_SECONDS = 5.0
+# 每个接收者最多同时挂起的发送者数量，超出时最早的一组立即发出
+DEFAULT_MAX_PENDING_PER_RECEIVER = 32
+
+
+class _PendingPush:
+    __slots__ = ("sender_nickname", "count", "first_at", "last_content")
+
+    def __init__(self, sender_nickname: str, first_at: float):
+        self.sender_nickname: str = sender_nickname
+        self.count: int = 0
+        self.first_at: float = first_at
+        self.last_content: str = ""
+
+
+class PushCoalescer:
+    """把窗口期内同一发送者发给同一离线接收者的多条推送合并成一条"""
+    def __init__(self, notification_service, window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 max_pending_per_receiver: int = DEFAULT_MAX_PENDING_PER_RECEIVER,
+                 clock: Callable[[], float] = time.monotonic):
+        self.notification_service = notification_service
+        self.window_seconds: float = window_seconds
+        self.max_pending_per_receiver: int = max_pending_per_receiver
+        self._clock = clock
+        # 按首次到达时间排序，便于从头部取出到期项
+        self._pending: "OrderedDict[Tuple[EntityId, EntityId], _PendingPush]" = OrderedDict()
+        self._per_receiver: Dict[EntityId, "OrderedDict[EntityId, None]"] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.submitted: int = 0
+        self.pushes_sent: int = 0
+
+    def submit(self, receiver_id: EntityId, sender_id: EntityId, sender_nickname: str, content: str):
+        ready = []
+        with self._lock:
+            self.submitted += 1
+            key = (receiver_id, sender_id)
+            pending = self._pending.get(key)
+            if pending is None:
+                senders = self._per_receiver.setdefault(receiver_id, OrderedDict())
+                if len(senders) >= self.max_pending_per_receiver:
+                    ready.append(self._pop((receiver_id, next(iter(senders)))))
+                    senders = self._per_receiver.setdefault(receiver_id, OrderedDict())
+                pending = self._pending[key] = _PendingPush(sender_nickname, self._clock())
+                senders[sender_id] = None
+            pending.count += 1
+            pending.last_content = content
+        self._send(ready)
+
+    def _pop(self, key) -> Tuple[EntityId, _PendingPush]:
+        pending = self._pending.pop(key)
+        receiver_id, sender_id = key
+        senders = self._per_receiver[receiver_id]
+        del senders[sender_id]
+        if not senders:
+            del self._per_receiver[receiver_id]
+        return receiver_id, pending
+
+    @staticmethod
+    def format_push(pending: _PendingPush) -> str:
+        if pending.count == 1:
+            return f"您有来自 {pending.sender_nickname} 的一条新消息: {pending.last_content}"
+        return f"您有来自 {pending.sender_nickname} 的 {pending.count} 条新消息，最新: {pending.last_content}"
+
+    def _send(self, ready):
+        if not ready:
+            return
+        for receiver_id, pending in ready:
+            self.notification_service.trigger_push(receiver_id, self.format_push(pending))
+        # _send 可能同时在定时线程和调用方线程执行，计数放在锁内
+        with self._lock:
+            self.pushes_sent += len(ready)
+
+    def flush_due(self, now: Optional[float] = None) -> int:
+        """发出所有窗口已到期的合并推送，返回发出的条数"""
+        now = self._clock() if now is None else now
+        ready = []
+        with self._lock:
+            while self._pending:
+                key, pending = next(iter(self._pending.items()))
+                if now - pending.first_at < self.window_seconds:
+                    break
+                ready.append(self._pop(key))
+        self._send(ready)
+        return len(ready)
+
+    def flush_all(self) -> int:
+        with self._lock:
+            ready = [self._pop(key) for key in list(self._pending)]
+        self._send(ready)
+        return len(ready)
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def start(self, tick_seconds: Optional[float] = None):
+        """启动后台定时刷新线程"""
+        if self._thread is not None:
+            return
+        tick = tick_seconds or max(self.window_seconds / 4, 0.05)
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(tick):
+                self.flush_due()
+
+        self._thread = threading.Thread(target=run, name="push-coalescer", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush: bool = True):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush_all()
@@ -0,0 +1,77 @@
+# query_cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 60.0
+
+
+class QueryCache:
+    """查询结果缓存：LRU + TTL 淘汰，写入时记下依赖数据的版本号，版本变化后旧结果不再命中"""
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries: int = max_entries
+        self.ttl_seconds: float = ttl_seconds
+        self._clock = clock
+        # 键 -> (版本号, 过期时间, 结果)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.stale: int = 0
+        self.expired: int = 0
+        self.evictions: int = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, version) -> tuple:
+        """返回 (是否命中, 结果)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_version, expires_at, value = entry
+                if cached_version != version:
+                    self.stale += 1
+                    del self._entries[key]
+                elif expires_at <= self._clock():
+                    self.expired += 1
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, version, value):
+        with self._lock:
+            self._entries[key] = (version, self._clock() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, version, compute: Callable[[], Any]):
+        hit, value = self.get(key, version)
+        if hit:
+            return value
+        value = compute()
+        self.put(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "stale": self.stale, "expired": self.expired, "evictions": self.evictions,
+                "hit_rate": round(self.hit_rate, 4)}
@@ -1,9 +1,34 @@
-from models import User, Product, Message, Category, Favorite, Advertisement
-from typing import Dict, Optional, List
-import uuid
+from ids import EntityId
+from models import User, Product, Message, Category, Favorite, Advertisement, ProductStatus, conversation_key
+from typing import Dict, Optional, List, Tuple
+from tracing import NULL_TRACER
+from events import FavoriteAdded, MessageSent, ProductPublished, ProductRemoved, ProductUpdated
+import os
+import heapq
+import threading
+from operator import attrgetter
+from facets import FacetIndex, FacetResult
+from dedup import DuplicateListing
+
+def _attach_thumbnails(pipeline, source_path: str, target: dict):
+    """本地文件交给缩略图流水线处理，完成后把各规格路径写入 target"""
+    if pipeline is None or not os.path.isfile(source_path):
+        return None
+    future = pipeline.submit(source_path)
+
+    def done(f):
+        if f.exception() is None:
+            target.update(f.result())
+
+    future.add_done_callback(done)
+    return future
+
+def _live_products(records) -> List[Product]:
+    """快照记录换成实时商品对象；快照按分片存放，按 ID 排序使结果顺序稳定（雪花 ID 即发布顺序）"""
+    return [r.product for r in sorted(records, key=attrgetter("productId"))]
 
 class NotificationService:
-    def trigger_push(self, user_id: uuid.UUID, notification_content: str):
+    def trigger_push(self, user_id: EntityId, notification_content: str):
         print(f"\n[通知服务(Notify Svc)]: 正在准备向用户 {user_id} 发送推送...")
         #植入点，资源泄露，打开文件进行日志记录，但是忘记close，也未使用with语句。
         f = open("notification.log", "a", encoding="utf-8")
@@ -15,45 +40,228 @@ class IMService:
 
     _memory_leak_cache= [] #植入内存泄漏缓存，生命周期伴随程序整个运行过程
 
-    def __init__(self, notification_service: NotificationService, user_service: 'UserService'):
+    def __init__(self, notification_service: NotificationService, user_service: 'UserService', tracer=None,
+                 cold_store=None, message_log=None, inbox=None, push_coalescer=None, rate_limiter=None,
+                 event_bus=None, router=None, dispatcher=None):
         self.notification_service = notification_service
         self.user_service = user_service
         self.message_db: List[Message] = []
+        # 每个会话的热消息按序号排列，序号计数器独立保存，冷热迁移后继续递增
+        self.conversations: Dict[Tuple[str, str], List[Message]] = {}
+        self._last_seqs: Dict[Tuple[str, str], int] = {}
+        self._seq_lock = threading.Lock()
+        self.tracer = tracer or NULL_TRACER
+        self.cold_store = cold_store
+        self.message_log = message_log
+        self.inbox = inbox
+        self.push_coalescer = push_coalescer
+        self.rate_limiter = rate_limiter
+        self.event_bus = event_bus
+        if event_bus is not None:
+            # 在线检查和推送通知由订阅者异步完成，写路径只负责存储
+            event_bus.subscribe((MessageSent,), self._notify_batch, name="im-notify")
+        # 跨进程路由（broker.BrokerClient）：接收者在其他进程在线时经消息代理转发
+        self.router = router
+        self._remote_users: Dict[EntityId, User] = {}
+        # dispatcher(fn, *args) 把代理投递转交到拥有会话数据的线程（如 GUI 主线程）执行；
+        # 未设置时直接在代理读线程上存储，调用方需保证没有其他线程同时读写会话和收件箱
+        self.dispatcher = dispatcher
+        if router is not None:
+            router.on_deliver = self._on_router_deliver
 
-    def receive_message(self, sender: User, receiver_id: uuid.UUID, content: str) -> Optional[Message]:
-        
-        self._memory_leak_cache.append(content * 1000) #植入点，每次收取信息将内容复制1000倍到永不清理的列表中
+    def receive_message(self, sender: User, receiver_id: EntityId, content: str) -> Optional[Message]:
+        if self.rate_limiter is not None:
+            self.rate_limiter.check("send_message", sender.userId)
+        tracer = self.tracer
+        with tracer.trace("IMService.receive_message"):
+            with tracer.span("cache_append"):
+                self._memory_leak_cache.append(content * 1000) #植入点，每次收取信息将内容复制1000倍到永不清理的列表中
 
-        
-        receiver = self.user_service.find_user_by_id(receiver_id)
-        if not receiver: return None
+            with tracer.span("lookup_receiver"):
+                receiver = self.user_service.find_user_by_id(receiver_id)
+                remote = (self.router is not None and self.router.is_remote(receiver_id)
+                          and not (receiver and receiver.is_online))
+                if remote and not receiver:
+                    receiver = self._remote_user(receiver_id, self.router.nickname(receiver_id))
+            if not receiver: return None
+
+            with tracer.span("build_message"):
+                message = Message(sender=sender, receiver=receiver, content=content)
+            with tracer.span("store"):
+                self._store(message)
+            if self.inbox is not None:
+                with tracer.span("inbox"):
+                    self.inbox.record(message)
+
+            if remote:
+                # 本进程保留一份供发送者查看记录，通知由接收者所在进程完成
+                with tracer.span("route"):
+                    self.router.send(message)
+            elif self.event_bus is not None:
+                with tracer.span("publish_event"):
+                    self.event_bus.publish(MessageSent(message))
+            else:
+                self._notify(message)
+            return message
+
+    def _store(self, message: Message):
+        # 分配序号与写入放在同一把锁内，保证会话内存储顺序与序号一致
+        with self._seq_lock:
+            message.seq = self._next_seq(message.sender.userId, message.receiver.userId)
+            if self.message_log is not None:
+                self.message_log.append(message)
+            else:
+                self.message_db.append(message)
+                self._index_hot(message)
+        print(f"[IM服务]: 消息从 {message.sender.nickname} to {message.receiver.nickname} 已存储。")
+
+    def _remote_user(self, user_id: EntityId, nickname: Optional[str]) -> User:
+        """其他进程用户在本进程的占位对象，只用于消息的发送者、接收者字段"""
+        user = self._remote_users.get(user_id)
+        if user is None:
+            user = User("", "", "", nickname or str(user_id))
+            user.userId = user_id
+            self._remote_users[user_id] = user
+        return user
+
+    def remote_users(self) -> List[User]:
+        """在其他进程在线、本进程没有账号的用户（占位对象），供聊天对象列表使用"""
+        if self.router is None:
+            return []
+        return [self._remote_user(user_id, self.router.nickname(user_id))
+                for user_id in self.router.remote_user_ids()
+                if self.user_service.find_user_by_id(user_id) is None]
+
+    def _on_router_deliver(self, envelopes):
+        if self.dispatcher is not None:
+            self.dispatcher(self.deliver_remote, envelopes)
+        else:
+            self.deliver_remote(envelopes)
+
+    def deliver_remote(self, envelopes):
+        """消息代理投递来的消息：在本进程存储，再按接收者在线状态通知"""
+        for env in envelopes:
+            receiver = self.user_service.find_user_by_id(env.receiver_id)
+            if receiver is None:
+                continue
+            sender = (self.user_service.find_user_by_id(env.sender_id)
+                      or self._remote_user(env.sender_id, env.sender_nickname))
+            message = env.to_message(sender, receiver)
+            self._store(message)
+            if self.inbox is not None:
+                self.inbox.record(message)
+            if self.event_bus is not None:
+                self.event_bus.publish(MessageSent(message))
+            else:
+                self._notify(message)
+
+    def attach_session(self, user: User):
+        """用户在本进程登录后调用，其他进程发给他的消息会路由到这里"""
+        if self.router is not None:
+            self.router.announce([user])
 
-        message = Message(sender=sender, receiver=receiver, content=content)
-        self.message_db.append(message)
-        print(f"[IM服务]: 消息从 {sender.nickname} to {receiver.nickname} 已存储。")
+    def detach_session(self, user: User):
+        if self.router is not None:
+            self.router.withdraw([user])
 
-        if receiver.is_online:
+    def _notify(self, message: Message):
+        sender, receiver = message.sender, message.receiver
+        with self.tracer.span("presence_check"):
+            online = receiver.is_online
+        if online:
             print(f"[IM服务]: 用户 {receiver.nickname} 在线，模拟WebSocket推送。")
         else:
             print(f"[IM服务]: 用户 {receiver.nickname} 离线，触发推送通知。")
-            self.notification_service.trigger_push(
-                receiver.userId,
-                f"您有来自 {sender.nickname} 的一条新消息: {content}",
-            )
-        return message
+            with self.tracer.span("notify"):
+                if self.push_coalescer is not None:
+                    self.push_coalescer.submit(receiver.userId, sender.userId, sender.nickname, message.content)
+                else:
+                    self.notification_service.trigger_push(
+                        receiver.userId,
+                        f"您有来自 {sender.nickname} 的一条新消息: {message.content}",
+                    )
+
+    def _notify_batch(self, events):
+        for event in events:
+            self._notify(event.message)
         
-    def get_chat_history(self, user1: User, user2: User) -> List[Message]:
-        history = []
-        for msg in self.message_db:
-            is_involved = (msg.sender.userId == user1.userId and msg.receiver.userId == user2.userId) or \
-                          (msg.sender.userId == user2.userId and msg.receiver.userId == user1.userId)
-            if is_involved:
-                history.append(msg)
-        return sorted(history, key=lambda m: m.sentAt)
+    def _next_seq(self, user_id_a: EntityId, user_id_b: EntityId) -> int:
+        key = conversation_key(user_id_a, user_id_b)
+        last = self._last_seqs.get(key)
+        if last is None:
+            last = self.message_log.last_seq(user_id_a, user_id_b) if self.message_log is not None else 0
+        self._last_seqs[key] = last + 1
+        return last + 1
+
+    def _index_hot(self, message: Message):
+        key = conversation_key(message.sender.userId, message.receiver.userId)
+        self.conversations.setdefault(key, []).append(message)
+
+    def last_seq(self, user1: User, user2: User) -> int:
+        """会话当前的最大序号，0 表示还没有消息"""
+        key = conversation_key(user1.userId, user2.userId)
+        last = self._last_seqs.get(key)
+        if last is None and self.message_log is not None:
+            return self.message_log.last_seq(user1.userId, user2.userId)
+        return last or 0
+
+    def get_chat_history(self, user1: User, user2: User, limit: Optional[int] = None) -> List[Message]:
+        if self.message_log is not None:
+            return self.message_log.history(user1.userId, user2.userId, limit)
+        hot = self.conversations.get(conversation_key(user1.userId, user2.userId), [])
+        if limit is not None and len(hot) >= limit:
+            return hot[len(hot) - limit:]
+        if self.cold_store is None:
+            return list(hot)
+        # 热数据不够一页时才去解压冷数据块，两路都按序号有序，归并即可
+        remaining = None if limit is None else limit - len(hot)
+        cold = self.cold_store.history(user1.userId, user2.userId, remaining)
+        return list(heapq.merge(cold, hot, key=_by_seq))
+
+    def get_messages_since(self, user1: User, user2: User, after_seq: int) -> List[Message]:
+        """增量同步：返回序号大于 after_seq 的消息，只读取新增的部分"""
+        # 序号在会话内连续，新消息条数就是两者之差，可直接按 limit 取尾部
+        missing = self.last_seq(user1, user2) - after_seq
+        if missing <= 0:
+            return []
+        return [m for m in self.get_chat_history(user1, user2, missing) if m.seq > after_seq]
+
+    def get_inbox(self, user: User, offset: int = 0, limit: int = 20) -> list:
+        """按最近活跃排序的会话列表，耗时只与页大小有关"""
+        if self.inbox is None:
+            return []
+        return self.inbox.conversations(user.userId, offset, limit)
+
+    def mark_read(self, user: User, partner: User) -> int:
+        if self.inbox is None:
+            return 0
+        return self.inbox.mark_read(user.userId, partner.userId)
+
+    def compact_cold_messages(self, now=None) -> int:
+        """把超过保留期的消息压缩进冷存储，返回迁移的消息数"""
+        if self.cold_store is None:
+            return 0
+        before = len(self.message_db)
+        self.message_db = self.cold_store.compact(self.message_db, now)
+        self.conversations = {}
+        for message in self.message_db:
+            self._index_hot(message)
+        return before - len(self.message_db)
+
+    def iter_messages(self):
+        if self.message_log is not None:
+            yield from self.message_log.iter_messages()
+        if self.cold_store is not None:
+            yield from self.cold_store.iter_messages()
+        yield from self.message_db
+
+_by_seq = attrgetter("seq")
 
 class UserService:
-    def __init__(self):
+    def __init__(self, rate_limiter=None, thumbnail_pipeline=None):
         self.user_db: Dict[str, User] = {}
+        self.rate_limiter = rate_limiter
+        self.thumbnail_pipeline = thumbnail_pipeline
 
     def register(self, phone, email, password, nickname) -> Optional[User]:
         if email in self.user_db: return None
@@ -61,7 +269,23 @@ class UserService:
         self.user_db[email] = new_user
         return new_user
 
+    def register_many(self, rows) -> List[Optional[User]]:
+        """批量注册，rows 为 (phone, email, password, nickname) 序列；重复邮箱对应位置返回 None"""
+        results: List[Optional[User]] = []
+        pending: Dict[str, User] = {}
+        for phone, email, password, nickname in rows:
+            if email in self.user_db or email in pending:
+                results.append(None)
+                continue
+            new_user = User(phone, email, password, nickname)
+            pending[email] = new_user
+            results.append(new_user)
+        self.user_db.update(pending)
+        return results
+
     def login(self, email, password) -> Optional[User]:
+        if self.rate_limiter is not None:
+            self.rate_limiter.check("login", email)
         user = self.user_db.get(email)
         if user and user.verify_password(password):
             user.is_online = True
@@ -71,7 +295,7 @@ class UserService:
     def logout(self, user: User):
         if user: user.is_online = False
 
-    def find_user_by_id(self, user_id: uuid.UUID) -> Optional[User]:
+    def find_user_by_id(self, user_id: EntityId) -> Optional[User]:
         for user in self.user_db.values():
             if user.userId == user_id: return user
         return None
@@ -79,12 +303,40 @@ class UserService:
     def get_all_users(self) -> List[User]:
         return list(self.user_db.values())
 
+    def update_avatar(self, user: User, avatar_url: str):
+        user.update_profile(avatar_url=avatar_url)
+        user.avatarThumbnails = {}
+        return _attach_thumbnails(self.thumbnail_pipeline, avatar_url, user.avatarThumbnails)
+
 class ProductService:
-    def __init__(self):
-        self.product_db: Dict[uuid.UUID, Product] = {}
+    def __init__(self, rate_limiter=None, thumbnail_pipeline=None, recommender=None, autocomplete=None,
+                 query_cache=None, event_bus=None, snapshots=None, dedup=None):
+        self.product_db: Dict[EntityId, Product] = {}
         self.category_db: Dict[str, Category] = {}
         self.favorites_db: List[Favorite] = []
         self.advertisement_db: List[Advertisement] = []
+        self.rate_limiter = rate_limiter
+        self.thumbnail_pipeline = thumbnail_pipeline
+        self.recommender = recommender
+        self.autocomplete = autocomplete
+        self.query_cache = query_cache
+        self.snapshots = snapshots
+        # 近似重复检测（dedup.NearDuplicateIndex）需要在发布前同步判断，不走事件总线
+        self.dedup = dedup
+        # 结果缓存的版本号：整个目录一个、每个卖家一个，商品有任何变化时递增
+        self.catalog_version: int = 0
+        self._seller_versions: Dict[EntityId, int] = {}
+        # 目录写操作（发布、改状态、修改、批量载入、收藏、清理）互斥；清理任务在后台线程运行
+        self._lock = threading.RLock()
+        self.facet_index = FacetIndex()
+        # 按状态分区的主索引与卖家索引，默认搜索只遍历在售分区
+        self.status_partitions: Dict[ProductStatus, Dict[EntityId, Product]] = {s: {} for s in ProductStatus}
+        self.seller_index: Dict[EntityId, Dict[ProductStatus, Dict[EntityId, Product]]] = {}
+        self.event_bus = event_bus
+        if event_bus is not None:
+            # 主索引同步维护；推荐、补全等派生索引改由订阅者异步批量更新
+            event_bus.subscribe((ProductPublished, ProductUpdated, ProductRemoved), self._apply_catalog_events,
+                                name="catalog-indexes")
 
     def get_or_create_category(self, name: str) -> Category:
         if name not in self.category_db:
@@ -92,18 +344,279 @@ class ProductService:
         return self.category_db[name]
 
     def publish_product(self, seller, name, description, price, category_name) -> Product:
-        category = self.get_or_create_category(category_name)
-        product = Product(seller, name, description, price, category)
-        self.product_db[product.productId] = product
-        return product
+        if self.rate_limiter is not None:
+            self.rate_limiter.check("publish_product", seller.userId)
+        with self._lock:
+            signature = None
+            if self.dedup is not None:
+                signature = self.dedup.check(seller.userId, name, description)
+            category = self.get_or_create_category(category_name)
+            product = Product(seller, name, description, price, category)
+            product._owner = self
+            self.product_db[product.productId] = product
+            if self.dedup is not None:
+                self.dedup.add(product, signature)
+            self._partition_add(product)
+            self.facet_index.add(product)
+            self._touch(product)
+            self._emit(ProductPublished(product))
+            return product
+
+    def _emit(self, event):
+        self._emit_many([event])
+
+    def _emit_many(self, events):
+        """发布一批变更事件；没有事件总线时在当前线程直接更新派生索引"""
+        if self.event_bus is not None:
+            for event in events:
+                self.event_bus.publish(event)
+        else:
+            self._apply_catalog_events(events)
+
+    def _apply_catalog_events(self, events):
+        # 连续的批量发布事件合并成一次批量索引，单件发布走增量更新
+        bulk: List[Product] = []
+        for event in events:
+            if isinstance(event, ProductPublished) and event.bulk:
+                bulk.append(event.product)
+                continue
+            self._index_bulk(bulk)
+            bulk = []
+            product = event.product
+            if isinstance(event, ProductPublished):
+                if self.recommender is not None:
+                    self.recommender.add(product)
+                if self.autocomplete is not None:
+                    self.autocomplete.add_product(product)
+                continue
+            if isinstance(event, ProductRemoved):
+                if self.recommender is not None:
+                    self.recommender.remove(product.productId)
+                if self.autocomplete is not None:
+                    self.autocomplete.remove_product(product)
+                continue
+            if self.recommender is not None and ("name" in event.fields or "description" in event.fields):
+                self.recommender.add(product)
+            if self.autocomplete is not None and event.old_name is not None:
+                self.autocomplete.rename_product(product, event.old_name)
+        self._index_bulk(bulk)
+
+    def _index_bulk(self, products: List[Product]):
+        if not products:
+            return
+        if self.recommender is not None:
+            self.recommender.add_many(products)
+        if self.autocomplete is not None:
+            self.autocomplete.add_products(products)
+
+    def add_product_image(self, product: Product, image_url: str):
+        """添加商品图片；本地图片会异步生成缩略图，返回 ProductImage"""
+        image = product.add_image(image_url)
+        _attach_thumbnails(self.thumbnail_pipeline, image_url, image.thumbnails)
+        return image
+
+    def _touch(self, product: Product):
+        # 先提交快照再递增版本：读者拿到新版本号时一定能读到新数据，缓存不会把旧结果记在新版本下
+        if self.snapshots is not None:
+            self.snapshots.upsert(product)
+        self._bump_versions(product)
+
+    def _bump_versions(self, product: Product):
+        self.catalog_version += 1
+        seller_id = product.seller.userId
+        self._seller_versions[seller_id] = self._seller_versions.get(seller_id, 0) + 1
+
+    def catalog_snapshot(self):
+        """当前目录的只读快照；长时间遍历（导出、统计）应使用快照而不是 product_db"""
+        return self.snapshots.snapshot() if self.snapshots is not None else None
+
+    def _cached(self, key, version, compute) -> list:
+        if self.query_cache is None:
+            return compute()
+        # 返回副本，调用方修改列表不会污染缓存
+        return list(self.query_cache.get_or_compute(key, version, compute))
+
+    def _partition_add(self, product: Product):
+        self.status_partitions[product.status][product.productId] = product
+        by_status = self.seller_index.get(product.seller.userId)
+        if by_status is None:
+            by_status = self.seller_index[product.seller.userId] = {s: {} for s in ProductStatus}
+        by_status[product.status][product.productId] = product
+
+    def _partition_remove(self, product: Product):
+        self.status_partitions[product.status].pop(product.productId, None)
+        by_status = self.seller_index.get(product.seller.userId)
+        if by_status is not None:
+            by_status[product.status].pop(product.productId, None)
+
+    def _set_status(self, product: Product, status: ProductStatus, allowed_from) -> bool:
+        with self._lock:
+            if product.productId not in self.product_db or product.status not in allowed_from:
+                return False
+            self._partition_remove(product)
+            product.status = status
+            self._partition_add(product)
+            self.facet_index.add(product)
+            self._touch(product)
+            self._emit(ProductUpdated(product, ("status",)))
+            return True
+
+    def mark_sold(self, product: Product) -> bool:
+        return self._set_status(product, ProductStatus.SOLD_OUT, (ProductStatus.ON_SALE,))
+
+    def remove_product(self, product: Product) -> bool:
+        """下架商品；数据留在已下架分区，由 purge_removed 分批清理"""
+        return self._set_status(product, ProductStatus.REMOVED, (ProductStatus.ON_SALE, ProductStatus.SOLD_OUT))
+
+    def relist_product(self, product: Product) -> bool:
+        return self._set_status(product, ProductStatus.ON_SALE, (ProductStatus.SOLD_OUT, ProductStatus.REMOVED))
+
+    def purge_removed(self, batch_size: int = 500) -> int:
+        """从内存中彻底清除最多 batch_size 个已下架商品及其收藏，返回清除数量"""
+        with self._lock:
+            removed = self.status_partitions[ProductStatus.REMOVED]
+            batch = []
+            for product in removed.values():
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                return 0
+            purged_ids = set()
+            for product in batch:
+                self._partition_remove(product)
+                self.facet_index.remove(product.productId)
+                if self.snapshots is not None:
+                    self.snapshots.remove(product.productId)
+                self._bump_versions(product)
+                if self.dedup is not None:
+                    self.dedup.remove(product.productId)
+                del self.product_db[product.productId]
+                product._owner = None
+                purged_ids.add(product.productId)
+            # 原地过滤，其他持有 favorites_db 引用的代码看到的也是同一个列表
+            self.favorites_db[:] = [fav for fav in self.favorites_db if fav.product.productId not in purged_ids]
+            self._emit_many([ProductRemoved(product) for product in batch])
+            return len(batch)
+
+    def update_product(self, product: Product, name: str = None, description: str = None, price: float = None):
+        """修改商品信息并同步索引"""
+        with self._lock:
+            old_name = product.name
+            product._apply_update(name, description, price)
+            self.facet_index.add(product)
+            if self.dedup is not None and (name or description):
+                self.dedup.add(product)
+            self._touch(product)
+            fields = tuple(f for f, value in (("name", name), ("description", description), ("price", price)) if value)
+            self._emit(ProductUpdated(product, fields, old_name if product.name != old_name else None))
+
+    def publish_products_bulk(self, items) -> List[Optional[Product]]:
+        """批量发布，items 为 (seller, name, description, price, category_name) 序列；
+        与该卖家在售商品（含本批已发布的）近似重复的条目不发布，对应位置返回 None"""
+        categories: Dict[str, Category] = {}
+        results: List[Optional[Product]] = []
+        with self._lock:
+            for seller, name, description, price, category_name in items:
+                signature = None
+                if self.dedup is not None:
+                    try:
+                        signature = self.dedup.check(seller.userId, name, description)
+                    except DuplicateListing:
+                        results.append(None)
+                        continue
+                category = categories.get(category_name)
+                if category is None:
+                    category = categories[category_name] = self.get_or_create_category(category_name)
+                product = Product(seller, name, description, price, category)
+                if self.dedup is not None:
+                    # 立即入索引，本批后面的条目也会与它比较
+                    self.dedup.add(product, signature)
+                results.append(product)
+            self._insert_products([p for p in results if p is not None])
+        return results
+
+    def load_products(self, products) -> List[Product]:
+        """批量载入已构造好的商品（种子数据还原），不做重复检查；查重签名在后台线程计算"""
+        with self._lock:
+            products = self._insert_products(products)
+            if self.dedup is not None:
+                self.dedup.add_many(products)
+                self.dedup.build_in_background()
+            return products
+
+    def _insert_products(self, products) -> List[Product]:
+        # 调用方已持有 self._lock
+        products = list(products)
+        self.product_db.update((p.productId, p) for p in products)
+        for product in products:
+            product._owner = self
+            self._partition_add(product)
+        self.facet_index.add_many(products)
+        if self.snapshots is not None:
+            self.snapshots.upsert_many(products)
+        # 与 _touch 相同，快照提交后才递增版本
+        for product in products:
+            self._bump_versions(product)
+        # 查重索引由调用方同步维护（发布前要用它检查）；推荐、补全等派生索引交给事件订阅者
+        self._emit_many([ProductPublished(product, bulk=True) for product in products])
+        return products
+
+    def browse(self, category: str = None, status=None, price_min: float = None,
+               price_max: float = None) -> FacetResult:
+        """分面浏览：按分类、状态和价格区间过滤，并返回各分面的计数"""
+        with self._lock:
+            result = self.facet_index.query(category, status, price_min, price_max)
+            result.products = [self.product_db[pid] for pid in result.product_ids]
+        return result
+
+    def facet_counts(self) -> Tuple[Dict[str, int], Dict[ProductStatus, int]]:
+        """整个目录按分类、状态的商品数；配置快照时直接取快照维护的计数"""
+        snapshot = self.catalog_snapshot()
+        if snapshot is not None:
+            return snapshot.facet_counts()
+        with self._lock:
+            result = self.facet_index.query(sort_by_price=False)
+        return result.category_counts, result.status_counts
     
-    def find_product_by_id(self, product_id: uuid.UUID) -> Optional[Product]:
+    def get_similar_products(self, product: Product, k: int = 5) -> List[Product]:
+        """商品详情页的相似商品；未配置推荐引擎时返回空列表"""
+        if self.recommender is None:
+            return []
+        return self.recommender.similar(product.productId, k)
+
+    def find_duplicate_clusters(self, threshold: float = None) -> List[List[Product]]:
+        """批量扫描整个目录，返回近似重复商品的簇；未配置检测器时返回空列表"""
+        if self.dedup is None:
+            return []
+        return self.dedup.clusters(threshold)
+
+    def suggest(self, prefix: str, n: int = 8) -> List[str]:
+        """搜索框自动补全：商品名、分类和热门搜索词"""
+        if self.autocomplete is None or not prefix:
+            return []
+        return self.autocomplete.complete(prefix, n)
+
+    def find_product_by_id(self, product_id: EntityId) -> Optional[Product]:
         return self.product_db.get(product_id)
 
-    def get_products_by_seller(self, seller: User) -> List[Product]:
-        return [p for p in self.product_db.values() if p.seller.userId == seller.userId]
+    def get_products_by_seller(self, seller: User, statuses=None) -> List[Product]:
+        key = ("seller", seller.userId, tuple(statuses) if statuses else None)
+        return self._cached(key, self._seller_versions.get(seller.userId, 0),
+                            lambda: self._products_by_seller(seller, statuses))
 
-    def search_products(self, query: str) -> List[Product]:
+    def _products_by_seller(self, seller: User, statuses=None) -> List[Product]:
+        # 卖家列表始终读卖家索引（快照没有按卖家分区）；清理任务在后台线程删除商品，读取时同样持锁
+        with self._lock:
+            by_status = self.seller_index.get(seller.userId)
+            if by_status is None:
+                return []
+            result = []
+            for status in (statuses or ProductStatus):
+                result.extend(by_status[status].values())
+        return result
+
+    def search_products(self, query: str, include_unavailable: bool = False) -> List[Product]:
         #植入点，使用eval，如果用户输入了恶意代码，会导致程序崩溃
         #为了让工具检测到，我们植入一个危险的eval
         if query and len(query) >= 3:
@@ -115,27 +628,69 @@ class ProductService:
             # 抛出一个看起来很严重的系统错误
             raise SystemError("Fatal Exception: Memory Access Violation (模拟内存访问违规)")
         
-        if not query: return list(self.product_db.values())
-        query = query.lower()
+        query = query.lower() if query else ""
+        results = self._cached(("search", query, include_unavailable), self.catalog_version,
+                               lambda: self._search(query, include_unavailable))
+        if query and results and self.autocomplete is not None:
+            # 只记录有结果的搜索词，避免无效输入进入补全
+            self.autocomplete.record_query(query)
+        return results
+
+    def _search(self, query: str, include_unavailable: bool) -> List[Product]:
+        snapshot = self.catalog_snapshot()
+        if snapshot is not None:
+            # 在固定版本快照的在售分区上遍历，其他线程同时写入或清理也不影响本次搜索
+            return _live_products(snapshot.search(query, include_unavailable))
+        # 持锁只复制候选列表，匹配在锁外进行，后台清理不会在遍历中途改动字典
+        with self._lock:
+            source = self.product_db if include_unavailable else self.status_partitions[ProductStatus.ON_SALE]
+            candidates = list(source.values())
+        if not query: return candidates
         results = []
-        for product in self.product_db.values():
+        for product in candidates:
             if query in product.name.lower() or query in product.description.lower():
                 results.append(product)
         return results
 
     def add_to_favorites(self, user: User, product: Product):
-        for fav in self.favorites_db:
-            if fav.user.userId == user.userId and fav.product.productId == product.productId:
-                return
-        favorite = Favorite(user, product)
-        self.favorites_db.append(favorite)
+        with self._lock:
+            for fav in self.favorites_db:
+                if fav.user.userId == user.userId and fav.product.productId == product.productId:
+                    return
+            favorite = Favorite(user, product)
+            self.favorites_db.append(favorite)
+            if self.event_bus is not None:
+                self.event_bus.publish(FavoriteAdded(favorite))
+
+    def add_favorites_bulk(self, pairs) -> int:
+        """批量收藏 (user, product)，只扫描一次现有收藏；返回新增数量"""
+        with self._lock:
+            existing = {(fav.user.userId, fav.product.productId) for fav in self.favorites_db}
+            added = []
+            for user, product in pairs:
+                key = (user.userId, product.productId)
+                if key in existing:
+                    continue
+                existing.add(key)
+                added.append(Favorite(user, product))
+            self.favorites_db.extend(added)
+            if self.event_bus is not None:
+                for favorite in added:
+                    self.event_bus.publish(FavoriteAdded(favorite))
+            return len(added)
 
     def get_user_favorites(self, user: User) -> List[Product]:
-        return [fav.product for fav in self.favorites_db if fav.user.userId == user.userId]
+        with self._lock:
+            return [fav.product for fav in self.favorites_db if fav.user.userId == user.userId]
         
     def add_advertisement(self, title, image_url, target_url, position):
         ad = Advertisement(title, image_url, target_url, position)
         self.advertisement_db.append(ad)
 
     def get_advertisements_by_position(self, position: str) -> List[Advertisement]:
-        return [ad for ad in self.advertisement_db if ad.position == position]
+        # 广告只会追加，列表长度即可作为版本号
+        return self._cached(("ads", position), len(self.advertisement_db),
+                            lambda: [ad for ad in self.advertisement_db if ad.position == position])
+
+    def cache_stats(self) -> dict:
+        return self.query_cache.stats() if self.query_cache is not None else {}
@@ -0,0 +1,194 @@
+# autocomplete.py
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_TOP_N = 8
+# 各来源的权重：商品名每件商品计 1，分类按商品数累计，用户搜索词每次搜索计 QUERY_WEIGHT
+NAME_WEIGHT = 1.0
+CATEGORY_WEIGHT = 1.0
+QUERY_WEIGHT = 2.0
+MAX_TERM_LENGTH = 40
+
+
+class _TrieNode:
+    __slots__ = ("children", "term", "weight", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # 以该节点结尾的词（展示用的原始写法）及其权重，weight 为 0 表示不是词尾
+        self.term: str = ""
+        self.weight: float = 0.0
+        # 子树中权重最高的 top_n 个词：[(-权重, 词)]，升序排列
+        self.top: List[Tuple[float, str]] = []
+
+
+class AutocompleteIndex:
+    """搜索框自动补全：字符前缀树，每个节点预存子树内权重最高的 N 个补全，查询只需走完前缀"""
+    def __init__(self, top_n: int = DEFAULT_TOP_N):
+        self.top_n: int = top_n
+        self._root = _TrieNode()
+        self._weights: Dict[str, float] = {}
+        # 小写键 -> 首次出现时的原始写法，补全结果按原写法展示
+        self._display: Dict[str, str] = {}
+        # 批量载入的权重先累计，第一次查询时再整体建树
+        self._pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._weights) + len(self._pending)
+
+    @staticmethod
+    def _key(term: str) -> str:
+        return " ".join(term.lower().split())[:MAX_TERM_LENGTH]
+
+    def add(self, term: str, weight: float = 1.0):
+        """增加（weight 为负时减少）某个词的权重，权重降到 0 时移除"""
+        key = self._key(term)
+        if not key:
+            return
+        with self._lock:
+            self._display.setdefault(key, term.strip()[:MAX_TERM_LENGTH])
+            if self._pending:
+                self._pending[key] = self._pending.get(key, 0.0) + weight
+                return
+            self._update(key, weight)
+
+    def add_many(self, terms: Iterable[Tuple[str, float]]):
+        with self._lock:
+            for term, weight in terms:
+                key = self._key(term)
+                if key:
+                    self._display.setdefault(key, term.strip()[:MAX_TERM_LENGTH])
+                    self._pending[key] = self._pending.get(key, 0.0) + weight
+
+    def record_query(self, query: str):
+        self.add(query, QUERY_WEIGHT)
+
+    def add_product(self, product):
+        self.add(product.name, NAME_WEIGHT)
+        self.add(product.category.name, CATEGORY_WEIGHT)
+
+    def remove_product(self, product):
+        self.add(product.name, -NAME_WEIGHT)
+        self.add(product.category.name, -CATEGORY_WEIGHT)
+
+    def rename_product(self, product, old_name: str):
+        self.add(old_name, -NAME_WEIGHT)
+        self.add(product.name, NAME_WEIGHT)
+
+    def add_products(self, products):
+        terms = []
+        for product in products:
+            terms.append((product.name, NAME_WEIGHT))
+            terms.append((product.category.name, CATEGORY_WEIGHT))
+        self.add_many(terms)
+
+    def _update(self, key: str, delta: float):
+        old = self._weights.get(key, 0.0)
+        new = old + delta
+        if new <= 0:
+            new = 0.0
+            self._weights.pop(key, None)
+        else:
+            self._weights[key] = new
+        path = [self._root]
+        node = self._root
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None:
+                if new == 0.0:
+                    self._display.pop(key, None)
+                    return
+                child = node.children[ch] = _TrieNode()
+            node = child
+            path.append(node)
+        display = self._display[key]
+        node.term = display
+        node.weight = new
+        entry = (-new, display)
+        if new >= old:
+            # 权重只增不减：沿路径把该词插入或上移即可
+            for n in path:
+                top = [item for item in n.top if item[1] != display]
+                if len(top) < self.top_n or entry < top[-1]:
+                    top.append(entry)
+                    top.sort()
+                    n.top = top[:self.top_n]
+        else:
+            # 权重下降或被删除：子树里原本排不进前 N 的词可能补上来，自底向上重算
+            for n in reversed(path):
+                self._recompute(n)
+            if new == 0.0:
+                self._display.pop(key, None)
+                self._prune(key, path)
+
+    def _recompute(self, node: _TrieNode):
+        candidates = []
+        if node.weight > 0:
+            candidates.append((-node.weight, node.term))
+        for child in node.children.values():
+            candidates.extend(child.top)
+        candidates.sort()
+        node.top = candidates[:self.top_n]
+
+    def _node_for(self, key: str):
+        node = self._root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def _prune(self, key: str, path: List[_TrieNode]):
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.children or node.weight > 0:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+    def build(self):
+        """把挂起的批量权重并入后整体重建前缀树，每个节点的 top 自底向上计算一次"""
+        with self._lock:
+            self._build_locked()
+
+    def _build_locked(self):
+        for key, delta in self._pending.items():
+            weight = self._weights.get(key, 0.0) + delta
+            if weight > 0:
+                self._weights[key] = weight
+            else:
+                self._weights.pop(key, None)
+                self._display.pop(key, None)
+        self._pending.clear()
+        root = _TrieNode()
+        for key, weight in self._weights.items():
+            node = root
+            for ch in key:
+                child = node.children.get(ch)
+                if child is None:
+                    child = node.children[ch] = _TrieNode()
+                node = child
+            node.term = self._display[key]
+            node.weight = weight
+        # 迭代后序遍历，子节点的 top 都算好后再合并到父节点，避免长商品名导致递归过深
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                self._recompute(node)
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children.values())
+        self._root = root
+
+    def complete(self, prefix: str, n: Optional[int] = None) -> List[str]:
+        """返回以 prefix 开头、权重最高的至多 n 个补全"""
+        n = self.top_n if n is None else min(n, self.top_n)
+        key = self._key(prefix)
+        with self._lock:
+            if self._pending:
+                self._build_locked()
+            node = self._node_for(key)
+            if node is None:
+                return []
+            return [display for _, display in node.top[:n]]
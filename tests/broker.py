@@ -0,0 +1,511 @@
+# broker.py
+"""本机聊天消息代理：多个进程的 IMService 通过 Unix 域套接字互相投递消息
+
+帧格式: 4 字节大端长度（不含自身）+ 1 字节帧类型 + 负载。
+ID 为 1 字节类型（0 整数 / 1 UUID）+ 8 或 16 字节；字符串为长度前缀 + UTF-8。
+
+用法: python broker.py [--socket PATH]
+"""
+import argparse
+import os
+import socket
+import struct
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from ids import MAX_NODE, EntityId
+from models import ContentType, Message, User
+
+DEFAULT_SOCKET_PATH = "/tmp/sproj-chat.sock"
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_IN_FLIGHT = 16
+
+# 帧类型
+HELLO, WELCOME, ANNOUNCE, WITHDRAW, SEND, ACK, DELIVER = range(1, 8)
+
+_HEADER = struct.Struct(">IB")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_I64 = struct.Struct(">q")
+_F64 = struct.Struct(">d")
+_ACK = struct.Struct(">III")
+_CONTENT_TYPES = list(ContentType)
+
+
+class RemoteEnvelope(NamedTuple):
+    """跨进程传递的一条消息"""
+    message_id: EntityId
+    sender_id: EntityId
+    receiver_id: EntityId
+    sender_nickname: str
+    content: str
+    content_type: ContentType
+    sent_at: float
+
+    @classmethod
+    def of(cls, message: Message) -> "RemoteEnvelope":
+        return cls(message.messageId, message.sender.userId, message.receiver.userId, message.sender.nickname,
+                   message.content, message.contentType, message.sentAt.timestamp())
+
+    def to_message(self, sender: User, receiver: User) -> Message:
+        message = Message(sender=sender, receiver=receiver, content=self.content, content_type=self.content_type)
+        message.messageId = self.message_id
+        message.sentAt = datetime.fromtimestamp(self.sent_at)
+        return message
+
+
+# --- 编解码 ---
+
+def _put_id(out: bytearray, entity_id: EntityId):
+    if isinstance(entity_id, uuid.UUID):
+        out += b"\x01"
+        out += entity_id.bytes
+    else:
+        out += b"\x00"
+        out += _I64.pack(entity_id)
+
+
+def _get_id(data: memoryview, offset: int) -> Tuple[EntityId, int]:
+    if data[offset] == 1:
+        return uuid.UUID(bytes=bytes(data[offset + 1:offset + 17])), offset + 17
+    return _I64.unpack_from(data, offset + 1)[0], offset + 9
+
+
+def _put_str(out: bytearray, value: str, length: struct.Struct = _U16):
+    raw = value.encode("utf-8")
+    out += length.pack(len(raw))
+    out += raw
+
+
+def _get_str(data: memoryview, offset: int, length: struct.Struct = _U16) -> Tuple[str, int]:
+    size = length.unpack_from(data, offset)[0]
+    offset += length.size
+    return str(data[offset:offset + size], "utf-8"), offset + size
+
+
+def _put_envelope(out: bytearray, env: RemoteEnvelope):
+    _put_id(out, env.message_id)
+    _put_id(out, env.sender_id)
+    _put_id(out, env.receiver_id)
+    _put_str(out, env.sender_nickname)
+    _put_str(out, env.content, _U32)
+    out.append(_CONTENT_TYPES.index(env.content_type))
+    out += _F64.pack(env.sent_at)
+
+
+def _get_envelope(data: memoryview, offset: int) -> Tuple[RemoteEnvelope, int]:
+    message_id, offset = _get_id(data, offset)
+    sender_id, offset = _get_id(data, offset)
+    receiver_id, offset = _get_id(data, offset)
+    nickname, offset = _get_str(data, offset)
+    content, offset = _get_str(data, offset, _U32)
+    content_type = _CONTENT_TYPES[data[offset]]
+    sent_at = _F64.unpack_from(data, offset + 1)[0]
+    return RemoteEnvelope(message_id, sender_id, receiver_id, nickname, content, content_type, sent_at), offset + 9
+
+
+def encode_envelopes(envelopes: List[RemoteEnvelope]) -> bytes:
+    out = bytearray(_U32.pack(len(envelopes)))
+    for env in envelopes:
+        _put_envelope(out, env)
+    return bytes(out)
+
+
+def decode_envelopes(data: memoryview, offset: int = 0) -> List[RemoteEnvelope]:
+    count = _U32.unpack_from(data, offset)[0]
+    offset += 4
+    envelopes = []
+    for _ in range(count):
+        env, offset = _get_envelope(data, offset)
+        envelopes.append(env)
+    return envelopes
+
+
+def _encode_directory(entries: Iterable[Tuple[EntityId, str]]) -> bytes:
+    entries = list(entries)
+    out = bytearray(_U32.pack(len(entries)))
+    for user_id, nickname in entries:
+        _put_id(out, user_id)
+        _put_str(out, nickname)
+    return bytes(out)
+
+
+def _decode_directory(data: memoryview) -> List[Tuple[EntityId, str]]:
+    count = _U32.unpack_from(data, 0)[0]
+    offset = 4
+    entries = []
+    for _ in range(count):
+        user_id, offset = _get_id(data, offset)
+        nickname, offset = _get_str(data, offset)
+        entries.append((user_id, nickname))
+    return entries
+
+
+def _frame(frame_type: int, payload: bytes = b"") -> bytes:
+    return _HEADER.pack(len(payload) + 1, frame_type) + payload
+
+
+def _read_frame(rfile) -> Optional[Tuple[int, memoryview]]:
+    header = rfile.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    size, frame_type = _HEADER.unpack(header)
+    payload = rfile.read(size - 1)
+    if len(payload) < size - 1:
+        return None
+    return frame_type, memoryview(payload)
+
+
+# --- 代理 ---
+
+class _Connection:
+    def __init__(self, sock: socket.socket, node_id: int):
+        self.sock: socket.socket = sock
+        self.node_id: int = node_id
+        self.name: str = ""
+        self.users: Set[EntityId] = set()
+        self._send_lock = threading.Lock()
+
+    def send(self, data: bytes):
+        with self._send_lock:
+            self.sock.sendall(data)
+
+
+class ChatBroker:
+    """消息代理：维护 用户 -> 所在进程 的目录，把 SEND 批次按接收者分组转发，再回 ACK
+
+    每个连接分配一个节点号（1..MAX_NODE），客户端用它初始化雪花 ID 生成器，避免多进程 ID 冲突。
+    """
+    def __init__(self, path: str = DEFAULT_SOCKET_PATH):
+        self.path: str = path
+        self._server: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._connections: Dict[int, _Connection] = {}
+        self._owners: Dict[EntityId, _Connection] = {}
+        self._nicknames: Dict[EntityId, str] = {}
+        self._next_node: int = 1
+        self._threads: List[threading.Thread] = []
+        self.routed: int = 0
+        self.undeliverable: int = 0
+
+    def start(self) -> "ChatBroker":
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        thread = threading.Thread(target=self._accept_loop, name="broker-accept", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+        print(f"[消息代理]: 监听 {self.path}")
+        return self
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._threads[0].join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        try:
+            # 关闭前先 shutdown，唤醒阻塞在 accept 上的线程
+            server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        server.close()
+        with self._lock:
+            connections = list(self._connections.values())
+        for conn in connections:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.sock.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _accept_loop(self):
+        while self._server is not None:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                node_id = self._next_node
+                self._next_node = self._next_node % MAX_NODE + 1
+                conn = self._connections[node_id] = _Connection(sock, node_id)
+            thread = threading.Thread(target=self._serve, args=(conn,), name=f"broker-conn-{node_id}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _broadcast(self, origin: _Connection, data: bytes):
+        with self._lock:
+            others = [c for c in self._connections.values() if c is not origin]
+        for conn in others:
+            try:
+                conn.send(data)
+            except OSError:
+                pass
+
+    def _serve(self, conn: _Connection):
+        rfile = conn.sock.makefile("rb")
+        try:
+            while True:
+                frame = _read_frame(rfile)
+                if frame is None:
+                    break
+                frame_type, payload = frame
+                if frame_type == SEND:
+                    self._route(conn, payload)
+                elif frame_type == ANNOUNCE:
+                    entries = _decode_directory(payload)
+                    with self._lock:
+                        for user_id, nickname in entries:
+                            self._owners[user_id] = conn
+                            self._nicknames[user_id] = nickname
+                            conn.users.add(user_id)
+                    self._broadcast(conn, _frame(ANNOUNCE, bytes(payload)))
+                elif frame_type == WITHDRAW:
+                    self._withdraw(conn, [user_id for user_id, _ in _decode_directory(payload)])
+                elif frame_type == HELLO:
+                    conn.name = str(payload, "utf-8")
+                    with self._lock:
+                        snapshot = _encode_directory((u, self._nicknames[u]) for u in self._owners)
+                    conn.send(_frame(WELCOME, _U16.pack(conn.node_id)) + _frame(ANNOUNCE, snapshot))
+        except OSError:
+            pass
+        finally:
+            rfile.close()
+            with self._lock:
+                self._connections.pop(conn.node_id, None)
+            self._withdraw(conn, list(conn.users))
+            conn.sock.close()
+
+    def _withdraw(self, conn: _Connection, user_ids: List[EntityId]):
+        removed = []
+        with self._lock:
+            for user_id in user_ids:
+                conn.users.discard(user_id)
+                if self._owners.get(user_id) is conn:
+                    del self._owners[user_id]
+                    removed.append((user_id, self._nicknames.pop(user_id, "")))
+        if removed:
+            self._broadcast(conn, _frame(WITHDRAW, _encode_directory(removed)))
+
+    def _route(self, conn: _Connection, payload: memoryview):
+        batch_id = _U32.unpack_from(payload, 0)[0]
+        envelopes = decode_envelopes(payload, 4)
+        by_target: Dict[_Connection, List[RemoteEnvelope]] = {}
+        failed = 0
+        with self._lock:
+            for env in envelopes:
+                target = self._owners.get(env.receiver_id)
+                if target is None or target is conn:
+                    failed += 1
+                else:
+                    by_target.setdefault(target, []).append(env)
+        delivered = 0
+        for target, batch in by_target.items():
+            try:
+                target.send(_frame(DELIVER, encode_envelopes(batch)))
+                delivered += len(batch)
+            except OSError:
+                failed += len(batch)
+        self.routed += delivered
+        self.undeliverable += failed
+        conn.send(_frame(ACK, _ACK.pack(batch_id, delivered, failed)))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"connections": len(self._connections), "users": len(self._owners),
+                    "routed": self.routed, "undeliverable": self.undeliverable}
+
+
+# --- 客户端 ---
+
+class BrokerClient:
+    """IMService 的跨进程路由：发送的消息进入发件队列，写线程把积压的消息合并成一个 SEND 批次，
+    不等上一批 ACK 就继续发送（最多 max_in_flight 批在途）；读线程处理 ACK、目录更新和投递"""
+    def __init__(self, path: str = DEFAULT_SOCKET_PATH, name: str = "", batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.path: str = path
+        self.name: str = name or f"pid-{os.getpid()}"
+        self.batch_size: int = batch_size
+        self.node_id: Optional[int] = None
+        # 收到其他进程投递的消息时调用，参数为 RemoteEnvelope 列表
+        self.on_deliver: Optional[Callable[[List[RemoteEnvelope]], None]] = None
+        self._sock: Optional[socket.socket] = None
+        self._send_lock = threading.Lock()
+        self._directory: Dict[EntityId, str] = {}
+        self._local: Set[EntityId] = set()
+        self._outbox: deque = deque()
+        self._cond = threading.Condition()
+        self._window = threading.BoundedSemaphore(max_in_flight)
+        self._in_flight: Dict[int, int] = {}
+        self._next_batch: int = 0
+        self._unacked: int = 0
+        self._closing: bool = False
+        self._welcome = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.sent: int = 0
+        self.batches: int = 0
+        self.delivered: int = 0
+        self.failed: int = 0
+        self.received: int = 0
+
+    def connect(self, timeout: float = 5.0) -> "BrokerClient":
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+        for target, name in ((self._read_loop, "reader"), (self._write_loop, "writer")):
+            thread = threading.Thread(target=target, name=f"broker-client-{name}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        self._send(_frame(HELLO, self.name.encode("utf-8")))
+        if not self._welcome.wait(timeout):
+            raise TimeoutError(f"消息代理 {self.path} 未响应")
+        return self
+
+    def close(self):
+        if self._sock is None:
+            return
+        self.flush(timeout=5.0)
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._sock.close()
+        self._sock = None
+
+    def _send(self, data: bytes):
+        # 调用方线程（目录）和写线程（批次）共用一个套接字，整帧写入时互斥
+        with self._send_lock:
+            self._sock.sendall(data)
+
+    # 目录
+    def announce(self, users: Iterable[User]):
+        """声明这些用户在本进程在线，其他进程发给他们的消息会投递到这里"""
+        entries = [(u.userId, u.nickname) for u in users]
+        self._local.update(user_id for user_id, _ in entries)
+        self._send(_frame(ANNOUNCE, _encode_directory(entries)))
+
+    def withdraw(self, users: Iterable[User]):
+        entries = [(u.userId, u.nickname) for u in users]
+        self._local.difference_update(user_id for user_id, _ in entries)
+        self._send(_frame(WITHDRAW, _encode_directory(entries)))
+
+    def is_remote(self, user_id: EntityId) -> bool:
+        return user_id in self._directory and user_id not in self._local
+
+    def nickname(self, user_id: EntityId) -> Optional[str]:
+        return self._directory.get(user_id)
+
+    def remote_user_ids(self) -> List[EntityId]:
+        return [user_id for user_id in list(self._directory) if user_id not in self._local]
+
+    # 发送
+    def send(self, message: Message):
+        envelope = RemoteEnvelope.of(message)
+        with self._cond:
+            self._outbox.append(envelope)
+            self._unacked += 1
+            self.sent += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已发送的消息全部收到 ACK"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unacked == 0 or self._sock is None, timeout)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._outbox or self._closing)
+                if self._closing:
+                    return
+                count = min(len(self._outbox), self.batch_size)
+                batch = [self._outbox.popleft() for _ in range(count)]
+            # 在途批次达到上限时在这里等待 ACK，形成背压
+            self._window.acquire()
+            with self._cond:
+                batch_id = self._next_batch = (self._next_batch + 1) & 0xFFFFFFFF
+                self._in_flight[batch_id] = count
+                self.batches += 1
+            try:
+                self._send(_frame(SEND, _U32.pack(batch_id) + encode_envelopes(batch)))
+            except OSError:
+                # 未确认的消息由读线程在连接断开时统一记为失败
+                self._window.release()
+                return
+
+    def _read_loop(self):
+        rfile = self._sock.makefile("rb")
+        try:
+            while True:
+                frame = _read_frame(rfile)
+                if frame is None:
+                    break
+                frame_type, payload = frame
+                if frame_type == ACK:
+                    batch_id, delivered, failed = _ACK.unpack_from(payload, 0)
+                    with self._cond:
+                        self._in_flight.pop(batch_id, None)
+                        self.delivered += delivered
+                        self.failed += failed
+                        self._unacked -= delivered + failed
+                        self._cond.notify_all()
+                    self._window.release()
+                elif frame_type == DELIVER:
+                    envelopes = decode_envelopes(payload)
+                    self.received += len(envelopes)
+                    if self.on_deliver is not None:
+                        self.on_deliver(envelopes)
+                elif frame_type == ANNOUNCE:
+                    self._directory.update(_decode_directory(payload))
+                elif frame_type == WITHDRAW:
+                    for user_id, _ in _decode_directory(payload):
+                        self._directory.pop(user_id, None)
+                elif frame_type == WELCOME:
+                    self.node_id = _U16.unpack_from(payload, 0)[0]
+                    self._welcome.set()
+        except OSError:
+            pass
+        finally:
+            rfile.close()
+            with self._cond:
+                # 连接断开后未确认和未发出的消息记为失败，避免 flush 永远等待
+                self._outbox.clear()
+                self.failed += self._unacked
+                self._unacked = 0
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {"sent": self.sent, "batches": self.batches, "delivered": self.delivered,
+                "failed": self.failed, "received": self.received, "in_flight": len(self._in_flight)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本机聊天消息代理")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix 域套接字路径")
+    args = parser.parse_args(argv)
+    ChatBroker(args.socket).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# events.py
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from models import Favorite, Message, Product, conversation_key
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_LANES = 1
+
+_STOP = object()
+
+
+class ChangeEvent:
+    """服务写操作产生的变更事件；key 相同的事件按发布顺序投递"""
+    __slots__ = ("emitted_ns",)
+
+    def __init__(self):
+        self.emitted_ns: int = time.perf_counter_ns()
+
+    @property
+    def key(self):
+        raise NotImplementedError
+
+
+class ProductPublished(ChangeEvent):
+    __slots__ = ("product", "bulk")
+
+    def __init__(self, product: Product, bulk: bool = False):
+        super().__init__()
+        self.product: Product = product
+        # 来自批量发布或种子载入；订阅者可以攒成一批再建索引
+        self.bulk: bool = bulk
+
+    @property
+    def key(self):
+        return self.product.productId
+
+
+class ProductUpdated(ChangeEvent):
+    __slots__ = ("product", "fields", "old_name")
+
+    def __init__(self, product: Product, fields: Tuple[str, ...], old_name: Optional[str] = None):
+        super().__init__()
+        self.product: Product = product
+        self.fields: Tuple[str, ...] = fields
+        # 改名前的名称，供需要撤销旧词条的索引使用
+        self.old_name: Optional[str] = old_name
+
+    @property
+    def key(self):
+        return self.product.productId
+
+
+class ProductRemoved(ChangeEvent):
+    """商品从目录中彻底清除（不是下架，下架是 ProductUpdated 的状态变化）"""
+    __slots__ = ("product",)
+
+    def __init__(self, product: Product):
+        super().__init__()
+        self.product: Product = product
+
+    @property
+    def key(self):
+        return self.product.productId
+
+
+class MessageSent(ChangeEvent):
+    __slots__ = ("message",)
+
+    def __init__(self, message: Message):
+        super().__init__()
+        self.message: Message = message
+
+    @property
+    def key(self):
+        return conversation_key(self.message.sender.userId, self.message.receiver.userId)
+
+
+class FavoriteAdded(ChangeEvent):
+    __slots__ = ("favorite",)
+
+    def __init__(self, favorite: Favorite):
+        super().__init__()
+        self.favorite: Favorite = favorite
+
+    @property
+    def key(self):
+        return self.favorite.user.userId
+
+
+class Subscription:
+    """一个订阅者：事件按 key 哈希分到若干通道，每个通道一个线程顺序批量投递"""
+    def __init__(self, name: str, event_types: Tuple[Type[ChangeEvent], ...],
+                 handler: Callable[[List[ChangeEvent]], None], batch_size: int, lanes: int):
+        self.name: str = name
+        self.event_types: Tuple[Type[ChangeEvent], ...] = event_types
+        self.handler = handler
+        self.batch_size: int = batch_size
+        self.lanes: List[queue.Queue] = [queue.Queue() for _ in range(lanes)]
+        self.threads: List[threading.Thread] = []
+        self.delivered: int = 0
+        self.batches: int = 0
+        self.errors: int = 0
+
+    def lane_for(self, event: ChangeEvent) -> queue.Queue:
+        if len(self.lanes) == 1:
+            return self.lanes[0]
+        return self.lanes[hash(event.key) % len(self.lanes)]
+
+    def deliver(self, batch: List[ChangeEvent]):
+        try:
+            self.handler(batch)
+        except Exception as e:
+            # 单个订阅者出错不影响写路径和其他订阅者
+            self.errors += 1
+            print(f"[事件总线]: 订阅者 {self.name} 处理失败: {e!r}")
+        self.delivered += len(batch)
+        self.batches += 1
+
+
+class EventBus:
+    """进程内变更事件总线：发布只做入队，派生工作（索引、通知、指标）由订阅者异步批量完成
+
+    未调用 start 时事件只会排队，可用 drain 在当前线程同步投递，便于测试和离线处理。
+    """
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size: int = batch_size
+        self.subscriptions: List[Subscription] = []
+        self._by_type: Dict[type, List[Subscription]] = {}
+        self._started: bool = False
+        self.published: int = 0
+
+    def subscribe(self, event_types: Sequence[Type[ChangeEvent]], handler: Callable[[List[ChangeEvent]], None],
+                  name: Optional[str] = None, batch_size: Optional[int] = None,
+                  lanes: int = DEFAULT_LANES) -> Subscription:
+        subscription = Subscription(name or getattr(handler, "__qualname__", "subscriber"), tuple(event_types),
+                                    handler, batch_size or self.batch_size, lanes)
+        self.subscriptions.append(subscription)
+        self._by_type.clear()
+        if self._started:
+            self._start_workers(subscription)
+        return subscription
+
+    def _subscribers_for(self, event_type: type) -> List[Subscription]:
+        subs = self._by_type.get(event_type)
+        if subs is None:
+            subs = self._by_type[event_type] = [s for s in self.subscriptions if issubclass(event_type, s.event_types)]
+        return subs
+
+    def publish(self, event: ChangeEvent):
+        self.published += 1
+        for subscription in self._subscribers_for(type(event)):
+            subscription.lane_for(event).put(event)
+
+    def _start_workers(self, subscription: Subscription):
+        for index, lane in enumerate(subscription.lanes):
+            thread = threading.Thread(target=self._run_lane, args=(subscription, lane),
+                                      name=f"event-{subscription.name}-{index}", daemon=True)
+            subscription.threads.append(thread)
+            thread.start()
+
+    def _run_lane(self, subscription: Subscription, lane: queue.Queue):
+        while True:
+            first = lane.get()
+            if first is _STOP:
+                lane.task_done()
+                return
+            batch = [first]
+            stop = False
+            while len(batch) < subscription.batch_size:
+                try:
+                    item = lane.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            subscription.deliver(batch)
+            for _ in batch:
+                lane.task_done()
+            if stop:
+                lane.task_done()
+                return
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for subscription in self.subscriptions:
+            self._start_workers(subscription)
+
+    def flush(self):
+        """等待已发布的事件全部投递完毕（需已 start）"""
+        for subscription in self.subscriptions:
+            for lane in subscription.lanes:
+                lane.join()
+
+    def drain(self) -> int:
+        """未启动后台线程时，在当前线程同步投递所有排队事件，返回投递数量"""
+        delivered = 0
+        for subscription in self.subscriptions:
+            for lane in subscription.lanes:
+                batch = []
+                while True:
+                    try:
+                        batch.append(lane.get_nowait())
+                    except queue.Empty:
+                        break
+                    lane.task_done()
+                for start in range(0, len(batch), subscription.batch_size):
+                    subscription.deliver(batch[start:start + subscription.batch_size])
+                delivered += len(batch)
+        return delivered
+
+    def stop(self):
+        """投递完已排队的事件后停止后台线程"""
+        if not self._started:
+            return
+        for subscription in self.subscriptions:
+            for lane in subscription.lanes:
+                lane.put(_STOP)
+            for thread in subscription.threads:
+                thread.join()
+            subscription.threads = []
+        self._started = False
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {s.name: {"delivered": s.delivered, "batches": s.batches, "errors": s.errors,
+                         "pending": sum(lane.qsize() for lane in s.lanes)}
+                for s in self.subscriptions}
+
+
+def metrics_subscriber(registry) -> Callable[[List[ChangeEvent]], None]:
+    """订阅者：把事件从发布到被处理的延迟按事件类型记入 MetricsRegistry"""
+    def handle(batch: Iterable[ChangeEvent]):
+        now = time.perf_counter_ns()
+        for event in batch:
+            registry.record(registry.stats_for("events", type(event).__name__), now - event.emitted_ns)
+    return handle
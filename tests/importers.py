@@ -0,0 +1,146 @@
+# importers.py
+import csv
+import json
+import math
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 每批提交的行数，内存占用只与批大小有关，与文件大小无关
+DEFAULT_BATCH_SIZE = 1000
+# 最多保留的错误明细条数，超出部分只计数
+MAX_ERROR_DETAILS = 1000
+
+USER_FIELDS = ("phone", "email", "password", "nickname")
+PRODUCT_FIELDS = ("seller_email", "name", "description", "price", "category")
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows_read: int = 0
+        self.imported: int = 0
+        self.failed: int = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    def add_error(self, line_no: int, reason: str):
+        self.failed += 1
+        if len(self.errors) < MAX_ERROR_DETAILS:
+            self.errors.append((line_no, reason))
+
+    def __repr__(self):
+        return f"ImportReport(read={self.rows_read}, imported={self.imported}, failed={self.failed})"
+
+
+def iter_csv_rows(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """逐行读取带表头的 CSV，返回 (行号, 字段字典)"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def iter_jsonl_rows(path: str) -> Iterator[Tuple[int, object]]:
+    """逐行读取 JSONL；无法解析的行以异常对象代替字典返回"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+
+
+def iter_rows(path: str):
+    if path.endswith(".jsonl") or path.endswith(".ndjson"):
+        return iter_jsonl_rows(path)
+    return iter_csv_rows(path)
+
+
+def _check_fields(row, fields) -> Optional[str]:
+    if isinstance(row, Exception):
+        return f"JSON 解析失败: {row}"
+    if not isinstance(row, dict):
+        return "行内容不是对象"
+    # 只有缺失（None）或空白才算缺少；JSONL 中的 0、False 是合法取值
+    missing = [name for name in fields if row.get(name) is None or not str(row[name]).strip()]
+    if missing:
+        return f"缺少字段: {', '.join(missing)}"
+    return None
+
+
+def _run_batches(rows, parse_row, flush_batch, batch_size, progress) -> ImportReport:
+    report = ImportReport()
+    batch = []
+    for line_no, row in rows:
+        report.rows_read += 1
+        try:
+            batch.append((line_no, parse_row(row)))
+        except ValueError as e:
+            report.add_error(line_no, str(e))
+        if len(batch) >= batch_size:
+            flush_batch(batch, report)
+            batch = []
+            if progress:
+                progress(report)
+    if batch:
+        flush_batch(batch, report)
+    if progress:
+        progress(report)
+    return report
+
+
+def import_users(rows, user_service, batch_size: int = DEFAULT_BATCH_SIZE,
+                 progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+    def parse_row(row):
+        error = _check_fields(row, USER_FIELDS)
+        if error:
+            raise ValueError(error)
+        return tuple(str(row[name]).strip() for name in USER_FIELDS)
+
+    def flush_batch(batch, report):
+        users = user_service.register_many([values for _, values in batch])
+        for (line_no, values), user in zip(batch, users):
+            if user is None:
+                report.add_error(line_no, f"邮箱已注册: {values[1]}")
+            else:
+                report.imported += 1
+
+    return _run_batches(rows, parse_row, flush_batch, batch_size, progress)
+
+
+def import_products(rows, product_service, user_service, batch_size: int = DEFAULT_BATCH_SIZE,
+                    progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+    def parse_row(row):
+        error = _check_fields(row, PRODUCT_FIELDS)
+        if error:
+            raise ValueError(error)
+        seller = user_service.user_db.get(str(row["seller_email"]).strip())
+        if seller is None:
+            raise ValueError(f"卖家不存在: {row['seller_email']}")
+        try:
+            price = float(row["price"])
+        except (TypeError, ValueError):
+            raise ValueError(f"价格无效: {row['price']}")
+        # nan 会打乱价格有序索引，inf 也不是有效价格
+        if not math.isfinite(price) or price < 0:
+            raise ValueError(f"价格无效: {row['price']}")
+        return (seller, str(row["name"]).strip(), str(row["description"]).strip(), price,
+                str(row["category"]).strip())
+
+    def flush_batch(batch, report):
+        products = product_service.publish_products_bulk([values for _, values in batch])
+        for (line_no, values), product in zip(batch, products):
+            if product is None:
+                report.add_error(line_no, f"与该卖家在售商品重复: {values[1]}")
+            else:
+                report.imported += 1
+
+    return _run_batches(rows, parse_row, flush_batch, batch_size, progress)
+
+
+def import_users_file(path: str, user_service, **kwargs) -> ImportReport:
+    return import_users(iter_rows(path), user_service, **kwargs)
+
+
+def import_products_file(path: str, product_service, user_service, **kwargs) -> ImportReport:
+    return import_products(iter_rows(path), product_service, user_service, **kwargs)
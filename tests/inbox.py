@@ -0,0 +1,79 @@
+# inbox.py
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List
+
+from ids import EntityId
+from models import Message, User
+
+PREVIEW_LENGTH = 30
+
+
+class InboxEntry:
+    __slots__ = ("partner", "last_preview", "last_sender_id", "last_at", "unread")
+
+    def __init__(self, partner: User):
+        self.partner: User = partner
+        self.last_preview: str = ""
+        self.last_sender_id = None
+        self.last_at: datetime = None
+        self.unread: int = 0
+
+
+class InboxIndex:
+    """按用户维护会话列表：最近活跃的会话排在最前，附带最后一条消息预览与未读数"""
+    def __init__(self, preview_length: int = PREVIEW_LENGTH):
+        self.preview_length: int = preview_length
+        # 每个用户一个 OrderedDict，末尾为最近活跃的会话
+        self._inboxes: Dict[EntityId, "OrderedDict[EntityId, InboxEntry]"] = {}
+        self._unread_totals: Dict[EntityId, int] = {}
+
+    def _touch(self, owner_id: EntityId, partner: User, message: Message) -> InboxEntry:
+        inbox = self._inboxes.setdefault(owner_id, OrderedDict())
+        entry = inbox.get(partner.userId)
+        if entry is None:
+            entry = inbox[partner.userId] = InboxEntry(partner)
+        else:
+            inbox.move_to_end(partner.userId)
+        content = message.content
+        entry.last_preview = content if len(content) <= self.preview_length else content[:self.preview_length] + "…"
+        entry.last_sender_id = message.sender.userId
+        entry.last_at = message.sentAt
+        return entry
+
+    def record(self, message: Message):
+        """在 receive_message 中调用，O(1) 更新收发双方的会话列表"""
+        sender, receiver = message.sender, message.receiver
+        self._touch(sender.userId, receiver, message)
+        if sender.userId == receiver.userId:
+            return
+        entry = self._touch(receiver.userId, sender, message)
+        entry.unread += 1
+        self._unread_totals[receiver.userId] = self._unread_totals.get(receiver.userId, 0) + 1
+
+    def conversations(self, user_id: EntityId, offset: int = 0, limit: int = 20) -> List[InboxEntry]:
+        inbox = self._inboxes.get(user_id)
+        if not inbox:
+            return []
+        return list(islice(reversed(inbox.values()), offset, offset + limit))
+
+    def mark_read(self, user_id: EntityId, partner_id: EntityId) -> int:
+        """清零某个会话的未读数，返回清除的条数"""
+        entry = self._inboxes.get(user_id, {}).get(partner_id)
+        if entry is None or not entry.unread:
+            return 0
+        cleared = entry.unread
+        entry.unread = 0
+        self._unread_totals[user_id] -= cleared
+        return cleared
+
+    def unread(self, user_id: EntityId, partner_id: EntityId) -> int:
+        entry = self._inboxes.get(user_id, {}).get(partner_id)
+        return entry.unread if entry else 0
+
+    def total_unread(self, user_id: EntityId) -> int:
+        return self._unread_totals.get(user_id, 0)
+
+    def conversation_count(self, user_id: EntityId) -> int:
+        return len(self._inboxes.get(user_id, ()))
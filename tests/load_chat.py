@@ -0,0 +1,239 @@
+# load_chat.py
+"""IMService 聊天压测：模拟 N 个并发客户端按设定速率收发消息，统计吞吐、延迟分位数、通知量和内存增长
+
+用法: python load_chat.py [--clients N] [--seconds S] [--rate R] [--skew Z] [--online 0.5]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from metrics import LatencyHistogram
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ChatLoadConfig:
+    def __init__(self, clients: int = 200, seconds: float = 10.0, rate_per_client: float = 5.0,
+                 history_ratio: float = 0.2, skew: float = 1.1, online_ratio: float = 0.5,
+                 history_limit: int = 20, sample_interval: float = 1.0, trace_memory: bool = False,
+                 seed: Optional[int] = 0):
+        self.clients: int = clients
+        self.seconds: float = seconds
+        # 每个客户端每秒发起的操作数；0 表示不限速，尽可能快地发送
+        self.rate_per_client: float = rate_per_client
+        # 操作中读取聊天记录所占比例，其余为发送消息
+        self.history_ratio: float = history_ratio
+        # 接收者按 Zipf 分布挑选，skew 越大会话越集中在少数热门用户上
+        self.skew: float = skew
+        self.online_ratio: float = online_ratio
+        self.history_limit: int = history_limit
+        self.sample_interval: float = sample_interval
+        self.trace_memory: bool = trace_memory
+        self.seed: Optional[int] = seed
+
+
+class CountingNotificationService:
+    """只计数的通知服务，避免压测被通知日志的文件 I/O 主导"""
+    def __init__(self):
+        self.pushes: int = 0
+        self._lock = threading.Lock()
+
+    def trigger_push(self, user_id, notification_content: str):
+        with self._lock:
+            self.pushes += 1
+
+
+class ChatLoadReport:
+    def __init__(self, config: ChatLoadConfig, elapsed: float, send: LatencyHistogram,
+                 history: LatencyHistogram, failures: int, notifications: int, samples: List[Dict[str, float]]):
+        self.config: ChatLoadConfig = config
+        self.elapsed: float = elapsed
+        self.send: LatencyHistogram = send
+        self.history: LatencyHistogram = history
+        self.failures: int = failures
+        self.notifications: int = notifications
+        # 按时间采样的 (秒, 累计操作数, 内存 MB, 累计通知数)
+        self.samples: List[Dict[str, float]] = samples
+
+    @property
+    def operations(self) -> int:
+        return self.send.total + self.history.total
+
+    @property
+    def throughput(self) -> float:
+        return self.operations / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        c = self.config
+        lines = [f"{c.clients} 个客户端, 每客户端 {c.rate_per_client:g} 次/秒, 偏斜 {c.skew:g}, "
+                 f"在线比例 {c.online_ratio:g}, 持续 {self.elapsed:.1f} 秒",
+                 f"吞吐: {self.throughput:.1f} 次/秒 (发送 {self.send.total}, 读取记录 {self.history.total}, "
+                 f"失败 {self.failures})"]
+        for name, hist in (("发送", self.send), ("读取记录", self.history)):
+            if hist.total:
+                lines.append(f"{name}延迟: p50 {hist.percentile(50) / 1e6:.3f} ms  p95 {hist.percentile(95) / 1e6:.3f} ms"
+                             f"  p99 {hist.percentile(99) / 1e6:.3f} ms  max {hist.max_ns / 1e6:.3f} ms")
+        lines.append(f"推送通知: {self.notifications} 条")
+        lines.append("   时间(s)      操作数    内存(MB)      通知数")
+        for s in self.samples:
+            lines.append(f"{s['t']:10.1f}{s['ops']:12.0f}{s['memory_mb']:12.1f}{s['notifications']:12.0f}")
+        return "\n".join(lines)
+
+
+def _process_memory_mb() -> Optional[float]:
+    """进程常驻内存；平台都不支持（Windows）时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # 非 Linux 平台退回到峰值常驻内存；ru_maxrss 在 macOS 上以字节计，其他平台以 KB 计
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1e6 if sys.platform == "darwin" else maxrss / 1e3
+
+
+def _memory_mb(trace_memory: bool) -> float:
+    if trace_memory:
+        return tracemalloc.get_traced_memory()[0] / 1e6
+    return _process_memory_mb()
+
+
+def _zipf_cum_weights(n: int, skew: float) -> List[float]:
+    total = 0.0
+    cum = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** skew
+        cum.append(total)
+    return cum
+
+
+def run_chat_load(config: ChatLoadConfig, im_service=None, user_service=None,
+                  notification_service=None) -> ChatLoadReport:
+    """启动 config.clients 个线程压测 IMService；未传入服务时新建一套只计数通知的服务"""
+    from services import IMService, UserService
+    if user_service is None:
+        user_service = UserService()
+    if im_service is None:
+        notification_service = notification_service or CountingNotificationService()
+        im_service = IMService(notification_service, user_service)
+    rng = random.Random(config.seed)
+    users = user_service.register_many(
+        (f"load{i}", f"load{i}@load.test", "x", f"压测用户{i}") for i in range(config.clients))
+    users = [u for u in users if u is not None]
+    for user in users:
+        user.is_online = rng.random() < config.online_ratio
+    # 热门用户顺序随机打乱，避免总是编号最小的用户最热
+    popular = users[:]
+    rng.shuffle(popular)
+    cum_weights = _zipf_cum_weights(len(popular), config.skew)
+
+    # 取不到进程内存的平台改用 tracemalloc 统计 Python 堆
+    trace_memory = config.trace_memory or _process_memory_mb() is None
+    if trace_memory:
+        tracemalloc.start()
+    start_event = threading.Event()
+    stop_event = threading.Event()
+    lock = threading.Lock()
+    send_total, history_total = LatencyHistogram(), LatencyHistogram()
+    counters = {"ops": 0, "failures": 0}
+
+    def client(index: int):
+        me = users[index]
+        local_rng = random.Random(None if config.seed is None else config.seed + index + 1)
+        send_hist, history_hist = LatencyHistogram(), LatencyHistogram()
+        failures = 0
+        interval = 1.0 / config.rate_per_client if config.rate_per_client > 0 else 0.0
+        start_event.wait()
+        # 开环调度：按计划时刻发起，延迟从计划时刻算起，服务变慢时排队时间也会计入
+        next_at = time.perf_counter() + local_rng.random() * interval
+        while not stop_event.is_set():
+            if interval:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                scheduled = next_at
+                next_at += interval
+            else:
+                scheduled = time.perf_counter()
+            partner = local_rng.choices(popular, cum_weights=cum_weights)[0]
+            if partner is me:
+                partner = popular[0] if popular[0] is not me else popular[-1]
+            try:
+                if local_rng.random() < config.history_ratio:
+                    im_service.get_chat_history(me, partner, config.history_limit)
+                    history_hist.record(int((time.perf_counter() - scheduled) * 1e9))
+                else:
+                    im_service.receive_message(me, partner.userId, f"压测消息 {local_rng.random():.6f}")
+                    send_hist.record(int((time.perf_counter() - scheduled) * 1e9))
+            except Exception:
+                failures += 1
+            with lock:
+                counters["ops"] += 1
+        with lock:
+            send_total.merge(send_hist)
+            history_total.merge(history_hist)
+            counters["failures"] += failures
+
+    def pushes() -> int:
+        return getattr(im_service.notification_service, "pushes", 0)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(len(users))]
+    for t in threads:
+        t.start()
+    samples = []
+    begin = time.perf_counter()
+    start_event.set()
+    samples.append({"t": 0.0, "ops": 0, "memory_mb": _memory_mb(trace_memory), "notifications": pushes()})
+    while True:
+        remaining = config.seconds - (time.perf_counter() - begin)
+        if remaining <= 0:
+            break
+        time.sleep(min(config.sample_interval, remaining))
+        samples.append({"t": time.perf_counter() - begin, "ops": counters["ops"],
+                        "memory_mb": _memory_mb(trace_memory), "notifications": pushes()})
+    stop_event.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - begin
+    if trace_memory:
+        tracemalloc.stop()
+    return ChatLoadReport(config, elapsed, send_total, history_total, counters["failures"], pushes(), samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IMService 并发聊天压测")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, default=5.0, help="每个客户端每秒操作数，0 为不限速")
+    parser.add_argument("--history-ratio", type=float, default=0.2)
+    parser.add_argument("--skew", type=float, default=1.1, help="接收者 Zipf 分布指数")
+    parser.add_argument("--online", type=float, default=0.5, help="在线用户比例")
+    parser.add_argument("--interval", type=float, default=1.0, help="内存采样间隔（秒）")
+    parser.add_argument("--tracemalloc", action="store_true", help="用 tracemalloc 统计 Python 堆而不是进程内存")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, HERE)
+    config = ChatLoadConfig(clients=args.clients, seconds=args.seconds, rate_per_client=args.rate,
+                            history_ratio=args.history_ratio, skew=args.skew, online_ratio=args.online,
+                            sample_interval=args.interval, trace_memory=args.tracemalloc)
+    # IMService 每条消息都会打印日志，压测期间屏蔽标准输出
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        report = run_chat_load(config)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
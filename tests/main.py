@@ -1,63 +1,100 @@
 import tkinter as tk
 from tkinter import messagebox, ttk, simpledialog
-from services import UserService, ProductService, IMService, NotificationService
+from headless import MarketplaceCore
 from models import User, Product
+from dedup import DuplicateListing
+from rate_limit import RateLimitExceeded
 from typing import Optional
+import queue
 import uuid
 
 LARGE_FONT = ("Verdana", 12)
 NORMAL_FONT = ("Verdana", 10)
+UI_POLL_MS = 50
 
 class MarketplaceApp(tk.Tk):
     """主应用控制器"""
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, seed_path: Optional[str] = None, broker_path: Optional[str] = None, **kwargs):
         tk.Tk.__init__(self, *args, **kwargs)
         self.title("网络商场系统")
         self.geometry("800x600")
 
-        self.user_service = UserService()
-        self.product_service = ProductService()
-        self.notification_service = NotificationService()
-        self.im_service = IMService(self.notification_service, self.user_service)
+        # 后台线程（消息代理）要执行的回调排队后由主线程轮询执行，tkinter 和服务数据都只在主线程访问
+        self._ui_calls = queue.Queue()
+        # 服务与种子数据在第一次使用时才创建，窗口可以先显示出来
+        self.core = MarketplaceCore(seed_path=seed_path, broker_path=broker_path, dispatcher=self.call_soon)
         self.current_user: Optional[User] = None
-        self._prepopulate_data()
 
-        container = tk.Frame(self)
-        container.pack(side="top", fill="both", expand=True)
-        container.grid_rowconfigure(0, weight=1)
-        container.grid_columnconfigure(0, weight=1)
+        self.container = tk.Frame(self)
+        self.container.pack(side="top", fill="both", expand=True)
+        self.container.grid_rowconfigure(0, weight=1)
+        self.container.grid_columnconfigure(0, weight=1)
 
+        # 页面按需创建
         self.frames = {}
-        for F in (LoginRegisterPage, MainPage):
-            frame = F(container, self)
-            self.frames[F] = frame
-            frame.grid(row=0, column=0, sticky="nsew")
-
         self.show_frame(LoginRegisterPage)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(UI_POLL_MS, self._run_ui_calls)
+
+    def call_soon(self, fn, *args):
+        """可在任意线程调用：fn(*args) 会在主线程上执行"""
+        self._ui_calls.put((fn, args))
+
+    def _run_ui_calls(self):
+        while True:
+            try:
+                fn, args = self._ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            fn(*args)
+        self.after(UI_POLL_MS, self._run_ui_calls)
+
+    def on_close(self):
+        # 先停掉事件总线和代理连接，排队中的通知不会随进程退出丢失
+        self.core.close()
+        self.destroy()
+
+    @property
+    def user_service(self):
+        return self.core.user_service
+
+    @property
+    def product_service(self):
+        return self.core.product_service
+
+    @property
+    def notification_service(self):
+        return self.core.notification_service
+
+    @property
+    def im_service(self):
+        return self.core.im_service
 
     def show_frame(self, cont):
-        frame = self.frames[cont]
+        frame = self.frames.get(cont)
+        if frame is None:
+            frame = self.frames[cont] = cont(self.container, self)
+            frame.grid(row=0, column=0, sticky="nsew")
         frame.tkraise()
         if cont == MainPage and self.current_user:
              self.frames[MainPage].refresh()
 
-    def _prepopulate_data(self):
-        seller = self.user_service.register("13800138000", "seller@test.com", "123", "卖家小王")
-        buyer = self.user_service.register("13900139000", "buyer@test.com", "123", "买家小李")
-        self.product_service.publish_product(seller, "二手iPhone 15", "9成新，512GB，功能完好", 5000.0, "手机")
-        self.product_service.publish_product(seller, "机械键盘", "青轴，带RGB灯效", 350.0, "电脑配件")
-        self.product_service.publish_product(buyer, "闲置图书《代码大全》", "几乎全新，只翻过几次", 50.0, "图书")
-        self.product_service.add_advertisement("双十一大促", "", "", "homepage_banner")
-
     def login(self, email, password):
-        user = self.user_service.login(email, password)
+        try:
+            user = self.user_service.login(email, password)
+        except RateLimitExceeded as e:
+            messagebox.showerror("登录失败", str(e))
+            return
         if user:
             self.current_user = user
+            self.im_service.attach_session(user)
             self.show_frame(MainPage)
         else:
             messagebox.showerror("登录失败", "邮箱或密码错误")
     
     def logout(self):
+        if self.current_user:
+            self.im_service.detach_session(self.current_user)
         self.user_service.logout(self.current_user)
         self.current_user = None
         self.show_frame(LoginRegisterPage)
@@ -133,14 +170,38 @@ class MainPage(tk.Frame):
         search_frame = tk.Frame(self.content_frame)
         self.search_entry = tk.Entry(search_frame, font=NORMAL_FONT, width=50)
         self.search_entry.pack(side="left", padx=5)
+        self.search_entry.bind("<KeyRelease>", self.update_suggestions)
         ttk.Button(search_frame, text="搜索", command=self.perform_search).pack(side="left")
         search_frame.pack(pady=10)
 
+        # 自动补全候选，有候选时才显示在搜索框下方
+        self.suggestion_listbox = tk.Listbox(self.content_frame, font=NORMAL_FONT, height=5)
+        self.suggestion_listbox.bind("<<ListboxSelect>>", self.apply_suggestion)
+
         self.product_listbox = tk.Listbox(self.content_frame, font=NORMAL_FONT)
         self.product_listbox.pack(fill="both", expand=True)
         self.product_listbox.bind('<Double-1>', self.show_product_details)
         self.perform_search() 
 
+    def update_suggestions(self, event=None):
+        suggestions = self.controller.product_service.suggest(self.search_entry.get(), n=5)
+        self.suggestion_listbox.delete(0, tk.END)
+        for text in suggestions:
+            self.suggestion_listbox.insert(tk.END, text)
+        if suggestions:
+            self.suggestion_listbox.pack(fill="x", padx=5, before=self.product_listbox)
+        else:
+            self.suggestion_listbox.pack_forget()
+
+    def apply_suggestion(self, event=None):
+        selection = self.suggestion_listbox.curselection()
+        if not selection:
+            return
+        self.search_entry.delete(0, tk.END)
+        self.search_entry.insert(0, self.suggestion_listbox.get(selection[0]))
+        self.suggestion_listbox.pack_forget()
+        self.perform_search()
+
     def perform_search(self):
         query = self.search_entry.get()
         results = self.controller.product_service.search_products(query)
@@ -155,7 +216,10 @@ class MainPage(tk.Frame):
         selected_text = self.product_listbox.get(self.product_listbox.curselection())
         product = self.product_data[selected_text]
 
-        if messagebox.askyesno("商品详情", f"名称: {product.name}\n描述: {product.description}\n\n是否收藏该商品?"):
+        similar = self.controller.product_service.get_similar_products(product, k=5)
+        similar_text = "、".join(p.name for p in similar) or "暂无"
+        if messagebox.askyesno("商品详情", f"名称: {product.name}\n描述: {product.description}\n"
+                                           f"相似商品: {similar_text}\n\n是否收藏该商品?"):
             self.controller.product_service.add_to_favorites(self.controller.current_user, product)
             messagebox.showinfo("成功", "商品已添加到您的收藏夹!")
 
@@ -182,9 +246,13 @@ class MainPage(tk.Frame):
         price = float(self.entries["价格:"].get())
         cat = self.entries["分类:"].get()
         if name and desc and price and cat:
-            self.controller.product_service.publish_product(
-                self.controller.current_user, name, desc, price, cat
-            )
+            try:
+                self.controller.product_service.publish_product(
+                    self.controller.current_user, name, desc, price, cat
+                )
+            except (RateLimitExceeded, DuplicateListing) as e:
+                messagebox.showerror("错误", str(e))
+                return
             messagebox.showinfo("成功", "商品发布成功！")
             self.show_my_products() # 跳转到我的商品页面
         else:
@@ -218,12 +286,26 @@ class MainPage(tk.Frame):
         user_list_frame = tk.Frame(chat_frame)
         tk.Label(user_list_frame, text="选择聊天对象:").pack()
         self.user_listbox = tk.Listbox(user_list_frame)
-        all_users = self.controller.user_service.get_all_users()
         self.chat_user_data = {}
-        for u in all_users:
-            if u.userId != self.controller.current_user.userId:
+        current = self.controller.current_user
+        # 先按最近活跃列出已有会话（带未读数），再列出尚未聊过的用户
+        for entry in self.controller.im_service.get_inbox(current, limit=50):
+            if entry.partner.userId == current.userId:
+                continue
+            display_text = entry.partner.nickname + (f" ({entry.unread}条未读)" if entry.unread else "")
+            self.user_listbox.insert(tk.END, display_text)
+            self.chat_user_data[display_text] = entry.partner
+        listed = {u.userId for u in self.chat_user_data.values()}
+        for u in self.controller.user_service.get_all_users():
+            if u.userId != current.userId and u.userId not in listed:
                 self.user_listbox.insert(tk.END, u.nickname)
                 self.chat_user_data[u.nickname] = u
+        # 其他窗口进程登录的用户（经消息代理）；昵称可能与本进程用户相同，加后缀区分
+        for u in self.controller.im_service.remote_users():
+            if u.userId not in listed:
+                display_text = f"{u.nickname} (其他窗口)"
+                self.user_listbox.insert(tk.END, display_text)
+                self.chat_user_data[display_text] = u
         self.user_listbox.bind("<<ListboxSelect>>", self.load_chat_history)
         self.user_listbox.pack(fill="y", expand=True)
         user_list_frame.pack(side="left", fill="y", padx=5)
@@ -249,6 +331,7 @@ class MainPage(tk.Frame):
         self.current_chat_partner = target_user 
         
         history = self.controller.im_service.get_chat_history(self.controller.current_user, target_user)
+        self.controller.im_service.mark_read(self.controller.current_user, target_user)
         
         self.chat_history.config(state='normal')
         self.chat_history.delete('1.0', tk.END)
@@ -261,7 +344,11 @@ class MainPage(tk.Frame):
         content = self.chat_input.get()
         if not content or not self.current_chat_partner: return
         
-        msg = self.controller.im_service.receive_message(self.controller.current_user, self.current_chat_partner.userId, content)
+        try:
+            msg = self.controller.im_service.receive_message(self.controller.current_user, self.current_chat_partner.userId, content)
+        except RateLimitExceeded as e:
+            messagebox.showerror("发送失败", str(e))
+            return
         if msg:
             self.chat_history.config(state='normal')
             self.chat_history.insert(tk.END, f"{msg.sender.nickname} ({msg.sentAt.strftime('%H:%M:%S')}):\n{msg.content}\n\n")
@@ -286,5 +373,9 @@ class MainPage(tk.Frame):
         ttk.Button(self.content_frame, text="修改昵称", command=update_nickname).pack(pady=20)
 
 if __name__ == "__main__":
-    app = MarketplaceApp()
+    import os
+    import sys
+    # 设置 SPROJ_BROKER 为消息代理套接字路径后，多个窗口进程之间可以互发消息
+    app = MarketplaceApp(seed_path=sys.argv[1] if len(sys.argv) > 1 else None,
+                         broker_path=os.environ.get("SPROJ_BROKER"))
     app.mainloop()
\ No newline at end of file
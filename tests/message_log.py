@@ -0,0 +1,224 @@
+# message_log.py
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from message_tier import restore_message
+from ids import EntityId, decode_id, encode_id
+from models import Message, User, conversation_key
+
+_LEN = struct.Struct("<I")
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".log"
+# 同时保持映射的段数上限；每个映射占用一个文件描述符，多年的日段不能全部映射
+DEFAULT_MAX_OPEN_MAPS = 32
+
+
+class _Segment:
+    __slots__ = ("start", "path", "size", "map", "map_size")
+
+    def __init__(self, start: int, path: str, size: int = 0):
+        self.start: int = start
+        self.path: str = path
+        self.size: int = size
+        self.map: Optional[mmap.mmap] = None
+        self.map_size: int = 0
+
+    def view(self) -> mmap.mmap:
+        """返回覆盖当前文件长度的只读映射，文件追加后重新映射"""
+        if self.map is None or self.map_size < self.size:
+            self.close()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.map_size = self.size
+        return self.map
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.map_size = 0
+
+
+class SegmentedMessageLog:
+    """按时间切分的磁盘消息日志；每个会话只在内存中保留 (段起点, 偏移) 索引"""
+    def __init__(self, directory: str, segment_seconds: int = 86400,
+                 retention: Optional[timedelta] = None,
+                 user_resolver: Optional[Callable[[EntityId], Optional[User]]] = None,
+                 max_open_maps: int = DEFAULT_MAX_OPEN_MAPS):
+        self.directory: str = directory
+        self.segment_seconds: int = segment_seconds
+        self.retention: Optional[timedelta] = retention
+        self.user_resolver = user_resolver
+        self.segments: Dict[int, _Segment] = {}
+        self._order: deque = deque()
+        # 已映射的段按最近使用排序，超出上限时关闭最久未用的映射
+        self.max_open_maps: int = max_open_maps
+        self._mapped: "OrderedDict[int, _Segment]" = OrderedDict()
+        self.index: Dict[Tuple[str, str], deque] = {}
+        self._last_seqs: Dict[Tuple[str, str], int] = {}
+        self._users: Dict[EntityId, User] = {}
+        self._writer = None
+        self._writer_start: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    def _segment_path(self, start: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{start}{SEGMENT_SUFFIX}")
+
+    def _load_existing(self):
+        starts = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                starts.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        for start in sorted(starts):
+            path = self._segment_path(start)
+            segment = _Segment(start, path, os.path.getsize(path))
+            self.segments[start] = segment
+            self._order.append(start)
+            if segment.size:
+                self._index_segment(segment)
+
+    def _index_segment(self, segment: _Segment):
+        # 启动时顺序读一遍并立即关闭文件，不为每个段保留映射和描述符
+        offset = 0
+        with open(segment.path, "rb") as f:
+            while offset + _LEN.size <= segment.size:
+                length = _LEN.unpack(f.read(_LEN.size))[0]
+                row = json.loads(f.read(length))
+                key = conversation_key(decode_id(row[1]), decode_id(row[2]))
+                self.index.setdefault(key, deque()).append((segment.start, offset))
+                # 早期记录没有序号字段
+                if len(row) > 6:
+                    self._last_seqs[key] = max(self._last_seqs.get(key, 0), row[6])
+                offset += _LEN.size + length
+
+    def _view(self, segment: _Segment) -> mmap.mmap:
+        view = segment.view()
+        self._mapped[segment.start] = segment
+        self._mapped.move_to_end(segment.start)
+        while len(self._mapped) > self.max_open_maps:
+            self._mapped.popitem(last=False)[1].close()
+        return view
+
+    def _writer_for(self, start: int):
+        if self._writer_start != start:
+            if self._writer is not None:
+                self._writer.close()
+            if start not in self.segments:
+                self.segments[start] = _Segment(start, self._segment_path(start))
+                self._order.append(start)
+                if len(self._order) > 1 and self._order[-2] > start:
+                    # 时钟回拨时写入了更早的段，重新排序以保证过期删除从最旧段开始
+                    self._order = deque(sorted(self._order))
+            self._writer = open(self.segments[start].path, "ab")
+            self._writer_start = start
+        return self._writer
+
+    def append(self, message: Message):
+        ts = message.sentAt.timestamp()
+        start = int(ts // self.segment_seconds) * self.segment_seconds
+        self._users[message.sender.userId] = message.sender
+        self._users[message.receiver.userId] = message.receiver
+        payload = json.dumps([encode_id(message.messageId), encode_id(message.sender.userId),
+                              encode_id(message.receiver.userId), message.content, message.contentType.value, ts,
+                              message.seq], ensure_ascii=False).encode("utf-8")
+        writer = self._writer_for(start)
+        segment = self.segments[start]
+        offset = segment.size
+        writer.write(_LEN.pack(len(payload)) + payload)
+        writer.flush()
+        segment.size += _LEN.size + len(payload)
+        key = conversation_key(message.sender.userId, message.receiver.userId)
+        self.index.setdefault(key, deque()).append((start, offset))
+        self._last_seqs[key] = max(self._last_seqs.get(key, 0), message.seq)
+
+    def last_seq(self, user_id_a: EntityId, user_id_b: EntityId) -> int:
+        """会话已写入的最大序号，重启后 IMService 据此继续编号"""
+        return self._last_seqs.get(conversation_key(user_id_a, user_id_b), 0)
+
+    def _user(self, user_id: EntityId) -> Optional[User]:
+        user = self._users.get(user_id)
+        if user is None and self.user_resolver is not None:
+            user = self.user_resolver(user_id)
+            if user is not None:
+                self._users[user_id] = user
+        return user
+
+    def _read(self, start: int, offset: int) -> Optional[Message]:
+        segment = self.segments.get(start)
+        if segment is None:
+            return None
+        view = self._view(segment)
+        length = _LEN.unpack_from(view, offset)[0]
+        mid, s, r, content, ct, ts, *rest = json.loads(view[offset + _LEN.size:offset + _LEN.size + length])
+        sender, receiver = self._user(decode_id(s)), self._user(decode_id(r))
+        if sender is None or receiver is None:
+            return None
+        return restore_message(sender, receiver, mid, content, ct, ts, rest[0] if rest else 0)
+
+    def history(self, user_id_a: EntityId, user_id_b: EntityId, limit: Optional[int] = None) -> List[Message]:
+        """通过 mmap 只读取最近 limit 条记录，不加载整段文件"""
+        entries = self.index.get(conversation_key(user_id_a, user_id_b))
+        if not entries:
+            return []
+        # 过期段被删除后，索引头部的失效项在读取时顺带清理
+        while entries and entries[0][0] not in self.segments:
+            entries.popleft()
+        if limit is None:
+            selected = list(entries)
+        else:
+            selected = list(islice(reversed(entries), limit))
+            selected.reverse()
+        messages = []
+        for start, offset in selected:
+            message = self._read(start, offset)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """按保留期删除整段文件，每段 O(1)，返回删除的段数"""
+        if self.retention is None:
+            return 0
+        cutoff = (now or datetime.now()) - self.retention
+        cutoff_ts = cutoff.timestamp()
+        removed = 0
+        while self._order and self._order[0] + self.segment_seconds <= cutoff_ts:
+            start = self._order.popleft()
+            segment = self.segments.pop(start)
+            self._mapped.pop(start, None)
+            segment.close()
+            if self._writer_start == start:
+                self._writer.close()
+                self._writer = None
+                self._writer_start = None
+            os.remove(segment.path)
+            removed += 1
+        return removed
+
+    def iter_messages(self) -> Iterator[Message]:
+        for start in list(self._order):
+            segment = self.segments[start]
+            offset = 0
+            while offset + _LEN.size <= segment.size:
+                # 每条都重新取映射：生成器暂停期间其他读取可能已把本段的映射关闭
+                length = _LEN.unpack_from(self._view(segment), offset)[0]
+                message = self._read(start, offset)
+                if message is not None:
+                    yield message
+                offset += _LEN.size + length
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._writer_start = None
+        for segment in self.segments.values():
+            segment.close()
+        self._mapped.clear()
@@ -0,0 +1,212 @@
+# metrics.py
+import functools
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# HDR 风格分桶：每个 2 的幂区间再细分为 2**SUB_BUCKET_BITS 个线性子桶，相对误差约 1/16
+SUB_BUCKET_BITS = 4
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+# Prometheus 导出时使用的固定桶边界（秒）
+DEFAULT_EXPORT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _bucket_index(value: int) -> int:
+    if value < SUB_BUCKET_COUNT:
+        return value
+    exponent = value.bit_length() - 1
+    sub = (value >> (exponent - SUB_BUCKET_BITS)) - SUB_BUCKET_COUNT
+    return (exponent - SUB_BUCKET_BITS + 1) * SUB_BUCKET_COUNT + sub
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """返回桶覆盖的 [下界, 上界) 区间（纳秒）"""
+    if index < SUB_BUCKET_COUNT:
+        return index, index + 1
+    exponent = index // SUB_BUCKET_COUNT + SUB_BUCKET_BITS - 1
+    sub = index % SUB_BUCKET_COUNT
+    shift = exponent - SUB_BUCKET_BITS
+    lower = (SUB_BUCKET_COUNT + sub) << shift
+    return lower, lower + (1 << shift)
+
+
+class LatencyHistogram:
+    """对数-线性分桶的延迟直方图，单位纳秒，只保存非空桶"""
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total: int = 0
+        self.sum_ns: int = 0
+        self.max_ns: int = 0
+
+    def record(self, value_ns: int):
+        if value_ns < 0:
+            value_ns = 0
+        index = _bucket_index(value_ns)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum_ns += value_ns
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+
+    def merge(self, other: "LatencyHistogram"):
+        """把另一个直方图的计数并入本直方图（各线程分别记录、最后汇总）"""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_ns += other.sum_ns
+        if other.max_ns > self.max_ns:
+            self.max_ns = other.max_ns
+
+    def percentile(self, p: float) -> int:
+        """返回第 p 百分位（0-100）所在桶的上界，空直方图返回 0"""
+        if not self.total:
+            return 0
+        rank = max(1, int(self.total * p / 100.0 + 0.999999))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_bucket_bounds(index)[1] - 1, self.max_ns)
+        return self.max_ns
+
+    def cumulative_counts(self, bounds_ns: List[int]) -> List[int]:
+        """按给定上界（纳秒）统计累计计数，用于 Prometheus 的 le 桶"""
+        result = [0] * len(bounds_ns)
+        for index, count in self.counts.items():
+            upper = _bucket_bounds(index)[1] - 1
+            for i, bound in enumerate(bounds_ns):
+                if upper <= bound:
+                    result[i] += count
+        return result
+
+
+class MethodStats:
+    def __init__(self, service: str, method: str):
+        self.service: str = service
+        self.method: str = method
+        self.calls: int = 0
+        self.errors: int = 0
+        self.histogram = LatencyHistogram()
+
+
+class MetricsRegistry:
+    """收集各服务公共方法的调用次数、错误次数与延迟分布"""
+    def __init__(self, enabled: bool = True):
+        self.enabled: bool = enabled
+        self._stats: Dict[Tuple[str, str], MethodStats] = {}
+        self._lock = threading.Lock()
+
+    def stats_for(self, service: str, method: str) -> MethodStats:
+        key = (service, method)
+        stats = self._stats.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(key, MethodStats(service, method))
+        return stats
+
+    def record(self, stats: MethodStats, elapsed_ns: int, failed: bool = False):
+        with self._lock:
+            stats.calls += 1
+            if failed:
+                stats.errors += 1
+            stats.histogram.record(elapsed_ns)
+
+    def all_stats(self) -> List[MethodStats]:
+        with self._lock:
+            return sorted(self._stats.values(), key=lambda s: (s.service, s.method))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot_text(self) -> str:
+        lines = [f"{'service.method':<48}{'calls':>8}{'errors':>8}{'p50(us)':>10}{'p99(us)':>10}{'max(us)':>10}"]
+        for s in self.all_stats():
+            h = s.histogram
+            lines.append(
+                f"{s.service + '.' + s.method:<48}{s.calls:>8}{s.errors:>8}"
+                f"{h.percentile(50) / 1000:>10.1f}{h.percentile(99) / 1000:>10.1f}{h.max_ns / 1000:>10.1f}"
+            )
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix: str = "marketplace", buckets=DEFAULT_EXPORT_BUCKETS) -> str:
+        bounds_ns = [int(b * 1e9) for b in buckets]
+        out = [
+            f"# HELP {prefix}_calls_total Total service method calls.",
+            f"# TYPE {prefix}_calls_total counter",
+        ]
+        stats = self.all_stats()
+        for s in stats:
+            out.append(f'{prefix}_calls_total{{service="{s.service}",method="{s.method}"}} {s.calls}')
+        out.append(f"# HELP {prefix}_errors_total Service method calls that raised.")
+        out.append(f"# TYPE {prefix}_errors_total counter")
+        for s in stats:
+            out.append(f'{prefix}_errors_total{{service="{s.service}",method="{s.method}"}} {s.errors}')
+        out.append(f"# HELP {prefix}_latency_seconds Service method latency.")
+        out.append(f"# TYPE {prefix}_latency_seconds histogram")
+        for s in stats:
+            labels = f'service="{s.service}",method="{s.method}"'
+            for bound, count in zip(buckets, s.histogram.cumulative_counts(bounds_ns)):
+                out.append(f'{prefix}_latency_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            out.append(f'{prefix}_latency_seconds_bucket{{{labels},le="+Inf"}} {s.histogram.total}')
+            out.append(f"{prefix}_latency_seconds_sum{{{labels}}} {s.histogram.sum_ns / 1e9:.9f}")
+            out.append(f"{prefix}_latency_seconds_count{{{labels}}} {s.histogram.total}")
+        return "\n".join(out) + "\n"
+
+
+def _public_methods(service) -> List[str]:
+    names = []
+    for name in dir(type(service)):
+        if name.startswith("_"):
+            continue
+        if callable(getattr(type(service), name, None)):
+            names.append(name)
+    return names
+
+
+def instrument(service, registry: MetricsRegistry, name: Optional[str] = None):
+    """在实例上包装全部公共方法；未调用 instrument 的服务没有任何额外开销"""
+    service_name = name or type(service).__name__
+    perf = time.perf_counter_ns
+    wrapped = []
+    for method_name in _public_methods(service):
+        func = getattr(service, method_name)
+        stats = registry.stats_for(service_name, method_name)
+
+        def make_wrapper(func=func, stats=stats):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not registry.enabled:
+                    return func(*args, **kwargs)
+                start = perf()
+                failed = True
+                try:
+                    result = func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    registry.record(stats, perf() - start, failed)
+            return wrapper
+
+        setattr(service, method_name, make_wrapper())
+        wrapped.append(method_name)
+    service._instrumented_methods = wrapped
+    return service
+
+
+def uninstrument(service):
+    for method_name in getattr(service, "_instrumented_methods", []):
+        service.__dict__.pop(method_name, None)
+    service.__dict__.pop("_instrumented_methods", None)
+    return service
+
+
+def instrument_services(*services, registry: Optional[MetricsRegistry] = None) -> MetricsRegistry:
+    registry = registry or MetricsRegistry()
+    for service in services:
+        instrument(service, registry)
+    return registry
@@ -1,11 +1,18 @@
 # models.py
-import uuid
 from datetime import datetime
 from enum import Enum
+from weakref import WeakSet
+
+from ids import EntityId, new_id
 
 def simple_hash(password: str) -> str:
     return f"hashed_{password}"
 
+def conversation_key(user_id_a: EntityId, user_id_b: EntityId) -> tuple:
+    """两个用户之间会话的无序键"""
+    a, b = str(user_id_a), str(user_id_b)
+    return (a, b) if a <= b else (b, a)
+
 class ProductStatus(Enum):
     ON_SALE = "ON_SALE"
     SOLD_OUT = "SOLD_OUT"
@@ -17,29 +24,36 @@ class ContentType(Enum):
 
 class Permission:
     def __init__(self, permission_key: str):
-        self.permissionId: uuid.UUID = uuid.uuid4()
+        self.permissionId: EntityId = new_id()
         self.permissionKey: str = permission_key 
 
 class Role:
     #植入点，可变默认参数，列表[]在函数定义的时候被创建一次，所有使用默认参数的Role实例将共享同一个permission列表
     def __init__(self, role_name: str, permissions=[]):
-        self.roleId: uuid.UUID = uuid.uuid4()
+        self.roleId: EntityId = new_id()
         self.roleName: str = role_name 
         #self.permissions: list[Permission] = []
         self.permissions = permissions
+        # 权限位掩码缓存（由 authz 计算）和持有该角色的管理员，新增权限时一并失效
+        self._permission_mask = None
+        self._holders: WeakSet = WeakSet()
 
     def add_permission(self, permission: Permission):
         if permission not in self.permissions:
             self.permissions.append(permission)
+            self._permission_mask = None
+            for admin in self._holders:
+                admin._permission_mask = None
 
 class User:
     def __init__(self, phone: str, email: str, password: str, nickname: str):
-        self.userId: uuid.UUID = uuid.uuid4()
+        self.userId: EntityId = new_id()
         self.phone: str = phone
         self.email: str = email
         self.passwordHash: str = simple_hash(password)
         self.nickname: str = nickname
         self.avatarUrl: str = "default_avatar.png"
+        self.avatarThumbnails: dict[str, str] = {}
         self.is_online: bool = False 
 
     def verify_password(self, password: str) -> bool:
@@ -54,29 +68,40 @@ class User:
 
 class AdminUser:
     def __init__(self, username: str, password: str):
-        self.adminId: uuid.UUID = uuid.uuid4()
+        self.adminId: EntityId = new_id()
         self.username: str = username
         self.passwordHash: str = simple_hash(password)
         self.roles: list[Role] = []
+        self._permission_mask = None
 
     def assign_role(self, role: Role):
         if role not in self.roles:
             self.roles.append(role)
+            role._holders.add(self)
+            self._permission_mask = None
 
 class Category:
-    def __init__(self, name: str, parent_id: uuid.UUID = None):
-        self.categoryId: uuid.UUID = uuid.uuid4()
+    def __init__(self, name: str, parent_id: EntityId = None):
+        self.categoryId: EntityId = new_id()
         self.name: str = name
-        self.parentId: uuid.UUID = parent_id 
+        self.parentId: EntityId = parent_id 
 
 class ProductImage:
     def __init__(self, image_url: str):
-        self.imageId: uuid.UUID = uuid.uuid4()
+        self.imageId: EntityId = new_id()
         self.imageUrl: str = image_url
+        self.thumbnails: dict[str, str] = {} # 规格名 -> 缩略图路径，由缩略图流水线异步填充
+
+    def thumbnail(self, size: str) -> str:
+        """返回指定规格的缩略图，尚未生成时退回原图"""
+        return self.thumbnails.get(size, self.imageUrl)
 
 class Product:
+    # 所属的 ProductService（发布或载入时设置）；update 经它修改，索引和缓存版本随之更新
+    _owner = None
+
     def __init__(self, seller: User, name: str, description: str, price: float, category: Category):
-        self.productId: uuid.UUID = uuid.uuid4()
+        self.productId: EntityId = new_id()
         self.seller: User = seller 
         self.name: str = name
         self.description: str = description
@@ -85,11 +110,18 @@ class Product:
         self.category: Category = category
         self.images: list[ProductImage] = []
 
-    def add_image(self, image_url: str):
+    def add_image(self, image_url: str) -> ProductImage:
         image = ProductImage(image_url)
         self.images.append(image)
+        return image
 
     def update(self, name: str = None, description: str = None, price: float = None):
+        if self._owner is not None:
+            self._owner.update_product(self, name=name, description=description, price=price)
+            return
+        self._apply_update(name, description, price)
+
+    def _apply_update(self, name: str = None, description: str = None, price: float = None):
         if name:
             self.name = name
         if description:
@@ -106,16 +138,18 @@ class Favorite:
 
 class Message:
     def __init__(self, sender: User, receiver: User, content: str, content_type: ContentType = ContentType.TEXT):
-        self.messageId: uuid.UUID = uuid.uuid4()
+        self.messageId: EntityId = new_id()
         self.sender: User = sender
         self.receiver: User = receiver
         self.content: str = content
         self.sentAt: datetime = datetime.now()
         self.contentType: ContentType = content_type
+        # 会话内单调递增的序号，由 IMService.receive_message 分配
+        self.seq: int = 0
 
 class Advertisement:
     def __init__(self, title: str, image_url: str, target_url: str, position: str):
-        self.adId: uuid.UUID = uuid.uuid4()
+        self.adId: EntityId = new_id()
         self.title: str = title
         self.imageUrl: str = image_url
         self.targetUrl: str = target_url
@@ -0,0 +1,94 @@
+# rate_limit.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, operation: str, key: Hashable, retry_after: float):
+        super().__init__(f"操作 {operation} 过于频繁，请 {retry_after:.1f} 秒后重试")
+        self.operation: str = operation
+        self.key = key
+        self.retry_after: float = retry_after
+
+
+class RatePolicy:
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate: float = rate_per_second
+        self.burst: float = burst
+
+    @property
+    def refill_seconds(self) -> float:
+        """令牌桶从空到满所需的时间"""
+        return self.burst / self.rate
+
+
+# 默认策略：(每秒补充令牌数, 桶容量)
+DEFAULT_POLICIES: Dict[str, RatePolicy] = {
+    "send_message": RatePolicy(5.0, 20),
+    "publish_product": RatePolicy(0.2, 5),
+    "login": RatePolicy(0.1, 5),
+}
+
+# 每次检查时顺带淘汰的最多空闲键数，摊销 O(1)
+_EVICT_PER_CALL = 2
+
+
+class RateLimiter:
+    """按 (操作, 键) 维护令牌桶；每个活跃键只占用 [令牌数, 上次刷新时间] 两个数"""
+    def __init__(self, policies: Optional[Dict[str, RatePolicy]] = None,
+                 clock: Callable[[], float] = time.monotonic, idle_seconds: Optional[float] = None):
+        self.policies: Dict[str, RatePolicy] = dict(DEFAULT_POLICIES if policies is None else policies)
+        self._clock = clock
+        # 空闲超过此时间的桶必定已经补满，删除后与重新创建等价
+        self.idle_seconds: float = idle_seconds if idle_seconds is not None else max(
+            [p.refill_seconds for p in self.policies.values()] or [0.0])
+        self._buckets: "OrderedDict[Tuple[str, Hashable], list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected: int = 0
+
+    def set_policy(self, operation: str, policy: RatePolicy):
+        with self._lock:
+            self.policies[operation] = policy
+            self.idle_seconds = max(self.idle_seconds, policy.refill_seconds)
+
+    def try_acquire(self, operation: str, key: Hashable, cost: float = 1.0) -> float:
+        """成功返回 0，被拒绝时返回需要等待的秒数"""
+        policy = self.policies.get(operation)
+        if policy is None:
+            return 0.0
+        now = self._clock()
+        bucket_key = (operation, key)
+        with self._lock:
+            self._evict_idle(now)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = [policy.burst, now]
+            else:
+                self._buckets.move_to_end(bucket_key)
+                bucket[0] = min(policy.burst, bucket[0] + (now - bucket[1]) * policy.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            self.rejected += 1
+            return (cost - bucket[0]) / policy.rate
+
+    def check(self, operation: str, key: Hashable, cost: float = 1.0):
+        """超出限额时抛出 RateLimitExceeded"""
+        retry_after = self.try_acquire(operation, key, cost)
+        if retry_after:
+            raise RateLimitExceeded(operation, key, retry_after)
+
+    def _evict_idle(self, now: float):
+        for _ in range(_EVICT_PER_CALL):
+            if not self._buckets:
+                return
+            oldest_key, oldest = next(iter(self._buckets.items()))
+            if now - oldest[1] < self.idle_seconds:
+                return
+            del self._buckets[oldest_key]
+
+    def active_keys(self) -> int:
+        return len(self._buckets)
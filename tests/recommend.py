@@ -0,0 +1,226 @@
+# recommend.py
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ids import EntityId
+from models import Product, ProductStatus
+
+DEFAULT_TOP_K = 5
+DEFAULT_REBUILD_SECONDS = 600.0
+# 商品名比描述更能代表商品，词频按该倍数计入
+NAME_WEIGHT = 2
+# 商品数不少于 MAX_DF_MIN_PRODUCTS 时，出现在超过 MAX_DF_RATIO 比例商品中的词
+# （如“二手”“包邮”）区分度很低，打分时跳过，避免遍历过长的倒排表
+MAX_DF_RATIO = 0.5
+MAX_DF_MIN_PRODUCTS = 100
+# 批量预计算时每批处理的商品数，批与批之间释放锁
+PRECOMPUTE_BATCH = 256
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """字母数字按词切分；中日韩文字之间没有空格，按相邻两字切分，单独一个字时保留单字"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run[0] < "\u3040" or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def product_terms(product: Product) -> Counter:
+    counts = Counter(tokenize(product.description))
+    for token in tokenize(product.name):
+        counts[token] += NAME_WEIGHT
+    return counts
+
+
+class SimilarProductIndex:
+    """基于名称和描述 TF-IDF 余弦相似度的相似商品推荐
+
+    向量以稀疏字典存放，并维护 词 -> {商品: 权重} 的倒排表，
+    查询时只与共享词项的商品做点积，相当于稀疏矩阵乘以查询向量。
+    新发布的商品用当前 IDF 增量入库，rebuild 按最新 IDF 全量重算并批量预计算各商品的 top-k。
+    """
+    def __init__(self, top_k: int = DEFAULT_TOP_K, rebuild_seconds: float = DEFAULT_REBUILD_SECONDS):
+        self.top_k: int = top_k
+        self.rebuild_seconds: float = rebuild_seconds
+        self.rebuilds: int = 0
+        self._products: Dict[EntityId, Product] = {}
+        self._terms: Dict[EntityId, Counter] = {}
+        self._df: Counter = Counter()
+        self._vectors: Dict[EntityId, Dict[str, float]] = {}
+        self._postings: Dict[str, Dict[EntityId, float]] = {}
+        # 预计算结果：商品 -> [(相似度, 商品 ID)]，按相似度降序
+        self._similar: Dict[EntityId, List[Tuple[float, EntityId]]] = {}
+        # 批量载入的商品先挂起，第一次查询时再统一向量化，不拖慢启动
+        self._pending: Dict[EntityId, Product] = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self):
+        return len(self._products) + len(self._pending)
+
+    def _idf(self, term: str) -> float:
+        return math.log((1 + len(self._products)) / (1 + self._df[term])) + 1.0
+
+    def _vectorize(self, counts: Counter) -> Dict[str, float]:
+        vector = {term: (1.0 + math.log(tf)) * self._idf(term) for term, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        if norm:
+            for term in vector:
+                vector[term] /= norm
+        return vector
+
+    def _index_terms(self, product: Product):
+        pid = product.productId
+        if pid in self._products:
+            self._drop(pid)
+        counts = product_terms(product)
+        self._products[pid] = product
+        self._terms[pid] = counts
+        self._df.update(counts.keys())
+
+    def _post(self, pid: EntityId):
+        vector = self._vectorize(self._terms[pid])
+        self._vectors[pid] = vector
+        for term, weight in vector.items():
+            self._postings.setdefault(term, {})[pid] = weight
+
+    def _drop(self, pid: EntityId):
+        self._products.pop(pid, None)
+        self._similar.pop(pid, None)
+        counts = self._terms.pop(pid, None)
+        if counts is not None:
+            self._df.subtract(counts.keys())
+        for term in self._vectors.pop(pid, {}):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(pid, None)
+                if not posting:
+                    del self._postings[term]
+
+    def add(self, product: Product):
+        """发布或修改商品时增量更新；新商品也会补进已预计算的相似列表"""
+        with self._lock:
+            if self._pending:
+                self._pending[product.productId] = product
+                return
+            self._index_terms(product)
+            self._post(product.productId)
+            limit = self._cache_size()
+            for score, other in self._score(product.productId, limit):
+                cached = self._similar.get(other)
+                if cached is None or (len(cached) >= limit and score <= cached[-1][0]):
+                    continue
+                cached = [item for item in cached if item[1] != product.productId]
+                cached.append((score, product.productId))
+                cached.sort(reverse=True)
+                self._similar[other] = cached[:limit]
+
+    def add_many(self, products: Iterable[Product]):
+        with self._lock:
+            for product in products:
+                self._pending[product.productId] = product
+
+    def remove(self, product_id: EntityId):
+        with self._lock:
+            self._pending.pop(product_id, None)
+            self._drop(product_id)
+
+    def rebuild(self, precompute: bool = False):
+        """按最新 IDF 重算全部向量；precompute 时顺带批量算出每个商品的 top-k"""
+        with self._lock:
+            for product in self._pending.values():
+                self._index_terms(product)
+            self._pending.clear()
+            self._df = +self._df
+            self._vectors.clear()
+            self._postings.clear()
+            self._similar.clear()
+            for pid in self._products:
+                self._post(pid)
+            self.rebuilds += 1
+            product_ids = list(self._products)
+        if precompute:
+            self.precompute(product_ids)
+
+    def precompute(self, product_ids: Optional[Iterable[EntityId]] = None):
+        """分批算出并缓存各商品的 top-k；整轮耗时较长，查询和发布只需等待当前这一批"""
+        if product_ids is None:
+            with self._lock:
+                product_ids = list(self._products)
+        product_ids = list(product_ids)
+        limit = self._cache_size()
+        for start in range(0, len(product_ids), PRECOMPUTE_BATCH):
+            with self._lock:
+                for pid in product_ids[start:start + PRECOMPUTE_BATCH]:
+                    if pid in self._vectors:
+                        self._similar[pid] = self._score(pid, limit)
+
+    def _cache_size(self) -> int:
+        # 多留一些候选，过滤掉已售出、已下架的商品后仍能凑满 top_k
+        return self.top_k * 2
+
+    def _score(self, pid: EntityId, limit: int) -> List[Tuple[float, EntityId]]:
+        total = len(self._products)
+        max_df = int(total * MAX_DF_RATIO) if total >= MAX_DF_MIN_PRODUCTS else total
+        df = self._df
+        postings = self._postings
+        scores: Dict[EntityId, float] = {}
+        for term, weight in self._vectors[pid].items():
+            if df[term] > max_df:
+                continue
+            for other, other_weight in postings[term].items():
+                scores[other] = scores.get(other, 0.0) + weight * other_weight
+        scores.pop(pid, None)
+        return heapq.nlargest(limit, ((score, other) for other, score in scores.items()),
+                              key=lambda item: item[0])
+
+    def similar(self, product_id: EntityId, k: Optional[int] = None) -> List[Product]:
+        """返回最相似的 k 个在售商品，按相似度降序"""
+        k = self.top_k if k is None else k
+        with self._lock:
+            if self._pending:
+                self.rebuild()
+            if product_id not in self._products:
+                return []
+            cached = self._similar.get(product_id)
+            if cached is None or k > self.top_k:
+                cached = self._score(product_id, max(k * 2, self._cache_size()))
+                if k <= self.top_k:
+                    self._similar[product_id] = cached
+            results = []
+            for _, other in cached:
+                product = self._products.get(other)
+                if product is not None and product.status == ProductStatus.ON_SALE:
+                    results.append(product)
+                    if len(results) >= k:
+                        break
+            return results
+
+    def start(self):
+        """后台定期全量重建，修正增量更新带来的 IDF 漂移"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.rebuild_seconds):
+                self.rebuild(precompute=True)
+
+        self._thread = threading.Thread(target=run, name="similar-product-rebuild", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,131 @@
+# snapshot.py
+import threading
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from ids import EntityId
+from models import Product, ProductStatus
+
+# 分片数：每次写入只复制一个分片（约 n / SHARD_COUNT 项）和一个长度为 SHARD_COUNT 的元组
+SHARD_COUNT = 64
+
+
+class ProductVersion(NamedTuple):
+    """某一版本下商品的不可变副本；product 指向实时对象，仅用于收藏、下单等后续写操作"""
+    productId: EntityId
+    sellerId: EntityId
+    sellerNickname: str
+    name: str
+    description: str
+    price: float
+    category: str
+    status: ProductStatus
+    product: Product
+
+    @classmethod
+    def of(cls, product: Product) -> "ProductVersion":
+        return cls(product.productId, product.seller.userId, product.seller.nickname, product.name,
+                   product.description, product.price, product.category.name, product.status, product)
+
+
+def _count(counts: dict, key, delta: int):
+    value = counts.get(key, 0) + delta
+    if value:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+
+
+class CatalogSnapshot:
+    """某一时刻的商品目录，创建后不再改变；读者持有它即可无锁遍历
+
+    在售商品另存一份同样分片的分区，分类、状态计数随写入维护，搜索和分面计数不需要扫描整个目录
+    """
+    __slots__ = ("version", "_shards", "_on_sale", "_size", "_category_counts", "_status_counts")
+
+    def __init__(self, version: int, shards: Tuple[Dict[EntityId, ProductVersion], ...],
+                 on_sale: Tuple[Dict[EntityId, ProductVersion], ...], size: int,
+                 category_counts: Dict[str, int], status_counts: Dict[ProductStatus, int]):
+        self.version: int = version
+        self._shards = shards
+        self._on_sale = on_sale
+        self._size: int = size
+        self._category_counts = category_counts
+        self._status_counts = status_counts
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self) -> Iterator[ProductVersion]:
+        return chain.from_iterable(shard.values() for shard in self._shards)
+
+    def get(self, product_id: EntityId) -> Optional[ProductVersion]:
+        return self._shards[hash(product_id) % len(self._shards)].get(product_id)
+
+    def search(self, query: str, include_unavailable: bool = False) -> List[ProductVersion]:
+        query = query.lower() if query else ""
+        shards = self._shards if include_unavailable else self._on_sale
+        records = chain.from_iterable(shard.values() for shard in shards)
+        if not query:
+            return list(records)
+        return [r for r in records if query in r.name.lower() or query in r.description.lower()]
+
+    def facet_counts(self) -> Tuple[Dict[str, int], Dict[ProductStatus, int]]:
+        return dict(self._category_counts), dict(self._status_counts)
+
+
+class CatalogStore:
+    """写时复制的商品目录：写者串行生成新版本，读者通过 snapshot() 取得当前版本"""
+    def __init__(self, shard_count: int = SHARD_COUNT):
+        self._shard_count: int = shard_count
+        self._lock = threading.Lock()
+        empty = tuple({} for _ in range(shard_count))
+        self._current = CatalogSnapshot(0, empty, empty, 0, {}, {})
+
+    def snapshot(self) -> CatalogSnapshot:
+        # 读取一个属性是原子操作，读者不需要加锁
+        return self._current
+
+    def _commit(self, changes: Iterable[Tuple[EntityId, Optional[ProductVersion]]]):
+        with self._lock:
+            current = self._current
+            tables = {"all": list(current._shards), "on_sale": list(current._on_sale)}
+            categories, statuses = dict(current._category_counts), dict(current._status_counts)
+            copied = set()
+
+            def writable(name: str, index: int) -> dict:
+                # 同一分片在一次提交中只复制一次
+                if (name, index) not in copied:
+                    tables[name][index] = dict(tables[name][index])
+                    copied.add((name, index))
+                return tables[name][index]
+
+            size = current._size
+            for product_id, record in changes:
+                index = hash(product_id) % self._shard_count
+                shard = writable("all", index)
+                old = shard.pop(product_id, None)
+                if old is not None:
+                    size -= 1
+                    _count(categories, old.category, -1)
+                    _count(statuses, old.status, -1)
+                    if old.status == ProductStatus.ON_SALE:
+                        del writable("on_sale", index)[product_id]
+                if record is not None:
+                    shard[product_id] = record
+                    size += 1
+                    _count(categories, record.category, 1)
+                    _count(statuses, record.status, 1)
+                    if record.status == ProductStatus.ON_SALE:
+                        writable("on_sale", index)[product_id] = record
+            self._current = CatalogSnapshot(current.version + 1, tuple(tables["all"]), tuple(tables["on_sale"]),
+                                            size, categories, statuses)
+
+    def upsert(self, product: Product):
+        self._commit(((product.productId, ProductVersion.of(product)),))
+
+    def upsert_many(self, products: Iterable[Product]):
+        self._commit((p.productId, ProductVersion.of(p)) for p in products)
+
+    def remove(self, product_id: EntityId):
+        self._commit(((product_id, None),))
@@ -1,6 +1,6 @@
 import pytest
 from services import UserService, ProductService, IMService, NotificationService
-from models import User
+from models import User, Message
 import uuid
 
 # --- 子功能 1: UserService 测试 ---
@@ -194,3 +194,1375 @@ def test_advertisement_add_and_filter(product_service):
     side_ads = product_service.get_advertisements_by_position("side")
     assert len(home_ads) == 2
     assert len(side_ads) == 1
+
+# --- 子功能 3: 服务方法指标采集测试 ---
+
+def test_metrics_histogram_percentiles():
+    from metrics import LatencyHistogram
+    h = LatencyHistogram()
+    for v in range(1, 1001):
+        h.record(v * 1000)
+    assert h.total == 1000
+    # HDR 分桶相对误差不超过 1/16
+    assert abs(h.percentile(50) - 500_000) <= 500_000 / 16
+    assert abs(h.percentile(99) - 990_000) <= 990_000 / 16
+    assert h.percentile(100) == 1_000_000
+
+def test_metrics_instrument_counts_calls_and_errors(tmp_path, monkeypatch):
+    from metrics import instrument_services, uninstrument
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    p_svc = ProductService()
+    registry = instrument_services(u_svc, p_svc)
+
+    user = u_svc.register("1", "m@test.com", "1", "M")
+    u_svc.login("m@test.com", "1")
+    u_svc.login("m@test.com", "bad")
+    stats = {(s.service, s.method): s for s in registry.all_stats()}
+    assert stats[("UserService", "login")].calls == 2
+    assert stats[("UserService", "register")].calls == 1
+
+    with pytest.raises(TypeError):
+        p_svc.publish_product(user)
+    assert stats[("ProductService", "publish_product")].errors == 1
+
+    text = registry.to_prometheus()
+    assert 'marketplace_calls_total{service="UserService",method="login"} 2' in text
+    assert 'le="+Inf"' in text
+    assert "UserService.login" in registry.snapshot_text()
+
+    uninstrument(u_svc)
+    u_svc.login("m@test.com", "1")
+    assert stats[("UserService", "login")].calls == 2
+
+def test_metrics_disabled_registry_records_nothing():
+    from metrics import MetricsRegistry, instrument
+    registry = MetricsRegistry(enabled=False)
+    u_svc = instrument(UserService(), registry)
+    u_svc.register("1", "off@test.com", "1", "Off")
+    assert all(s.calls == 0 for s in registry.all_stats())
+
+# --- 子功能 4: 消息发送链路追踪测试 ---
+
+def test_tracing_records_stage_spans(tmp_path, monkeypatch):
+    from tracing import Tracer
+    monkeypatch.chdir(tmp_path)
+    tracer = Tracer(sample_rate=1.0, slow_threshold_ms=0)
+    u_svc = UserService()
+    im_svc = IMService(NotificationService(), u_svc, tracer=tracer)
+    sender = u_svc.register("1", "t_s@test.com", "1", "Sender")
+    receiver = u_svc.register("2", "t_r@test.com", "1", "Receiver")
+
+    im_svc.receive_message(sender, receiver.userId, "traced")
+    traces = tracer.recent_slow()
+    assert len(traces) == 1
+    root = traces[0]
+    assert root.name == "IMService.receive_message"
+    stages = [c.name for c in root.children]
+    assert stages == ["cache_append", "lookup_receiver", "build_message", "store", "presence_check", "notify"]
+    assert all(c.duration_ns <= root.duration_ns for c in root.children)
+    assert "notify" in tracer.dump()
+
+def test_tracing_sampling_and_ring_buffer():
+    from tracing import Tracer
+    tracer = Tracer(sample_rate=0.5, slow_threshold_ms=0, capacity=3, rng=iter([0.9, 0.1] * 10).__next__)
+    for i in range(10):
+        with tracer.trace(f"op{i}"):
+            with tracer.span("stage"):
+                pass
+    assert tracer.sampled_count == 5
+    assert [t.name for t in tracer.recent_slow()] == ["op5", "op7", "op9"]
+
+# --- 子功能 5: 批量导入测试 ---
+
+def test_register_many_skips_duplicates(user_service):
+    user_service.register("0", "old@test.com", "1", "Old")
+    users = user_service.register_many([
+        ("1", "a@bulk.com", "1", "A"),
+        ("2", "old@test.com", "1", "Dup"),
+        ("3", "a@bulk.com", "1", "A2"),
+        ("4", "b@bulk.com", "1", "B"),
+    ])
+    assert [u.nickname if u else None for u in users] == ["A", None, None, "B"]
+    assert len(user_service.get_all_users()) == 3
+
+def test_publish_products_bulk_and_favorites_bulk(product_service, sample_user):
+    products = product_service.publish_products_bulk([
+        (sample_user, "P1", "D1", 1.0, "Cat"),
+        (sample_user, "P2", "D2", 2.0, "Cat"),
+    ])
+    assert len(products) == 2
+    assert products[0].category is products[1].category
+    assert len(product_service.product_db) == 2
+
+    added = product_service.add_favorites_bulk([(sample_user, products[0]), (sample_user, products[0]),
+                                                (sample_user, products[1])])
+    assert added == 2
+    assert product_service.add_favorites_bulk([(sample_user, products[1])]) == 0
+    assert len(product_service.get_user_favorites(sample_user)) == 2
+
+def test_import_csv_and_jsonl_report_row_errors(tmp_path):
+    from importers import import_users_file, import_products_file
+    users_csv = tmp_path / "users.csv"
+    users_csv.write_text(
+        "phone,email,password,nickname\n"
+        "1,s@imp.com,1,Seller\n"
+        "2,,1,NoEmail\n"
+        "3,s@imp.com,1,Dup\n",
+        encoding="utf-8",
+    )
+    u_svc = UserService()
+    report = import_users_file(str(users_csv), u_svc, batch_size=2)
+    assert (report.rows_read, report.imported, report.failed) == (3, 1, 2)
+    assert [line for line, _ in report.errors] == [3, 4]
+
+    products_jsonl = tmp_path / "products.jsonl"
+    products_jsonl.write_text(
+        '{"seller_email": "s@imp.com", "name": "Lamp", "description": "Desk", "price": "12.5", "category": "Home"}\n'
+        '{"seller_email": "x@imp.com", "name": "Ghost", "description": "?", "price": 1, "category": "Home"}\n'
+        'not json\n'
+        '{"seller_email": "s@imp.com", "name": "Pen", "description": "Blue", "price": "abc", "category": "Office"}\n',
+        encoding="utf-8",
+    )
+    p_svc = ProductService()
+    progress = []
+    report = import_products_file(str(products_jsonl), p_svc, u_svc, batch_size=1, progress=progress.append)
+    assert (report.rows_read, report.imported, report.failed) == (4, 1, 3)
+    assert progress
+    assert [p.name for p in p_svc.product_db.values()] == ["Lamp"]
+
+def test_import_products_accepts_zero_and_rejects_non_finite_prices():
+    from importers import import_products
+    u_svc = UserService()
+    u_svc.register("1", "z@imp.com", "1", "Seller")
+    rows = [(i + 1, {"seller_email": "z@imp.com", "name": f"Item{i}", "description": "D", "price": price,
+                     "category": "C"}) for i, price in enumerate([0, "nan", "inf", float("-inf"), " ", None])]
+    p_svc = ProductService()
+    report = import_products(rows, p_svc, u_svc)
+    assert (report.imported, report.failed) == (1, 5)
+    assert [reason for _, reason in report.errors] == ["价格无效: nan", "价格无效: inf", "价格无效: -inf",
+                                                       "缺少字段: price", "缺少字段: price"]
+    assert [p.price for p in p_svc.browse(price_min=0, price_max=10).products] == [0.0]
+
+# --- 子功能 6: 列式导出测试 ---
+
+def test_columnar_export_products_with_price_pushdown(tmp_path, product_service, sample_user):
+    from columnar import export_products, ColumnarReader
+    for i in range(100):
+        product_service.publish_product(sample_user, f"Item{i}", f"D{i}", float(i), "Cat")
+    path = str(tmp_path / "products.col")
+    assert export_products(product_service, path, chunk_rows=10) == 100
+
+    reader = ColumnarReader(path)
+    rows = list(reader.scan(columns=["name", "price"], where={"price": (25, 34.5)}))
+    assert [r["price"] for r in rows] == [float(i) for i in range(25, 35)]
+    assert set(rows[0]) == {"name", "price"}
+    assert reader.chunks_scanned == 2
+    assert reader.chunks_skipped == 8
+
+def test_columnar_export_messages_and_favorites(tmp_path, monkeypatch):
+    from columnar import export_messages, export_favorites, ColumnarReader
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    p_svc = ProductService()
+    im_svc = IMService(NotificationService(), u_svc)
+    a = u_svc.register("1", "col_a@test.com", "1", "A")
+    b = u_svc.register("2", "col_b@test.com", "1", "B")
+    u_svc.login("col_b@test.com", "1")
+    im_svc.receive_message(a, b.userId, "你好")
+    im_svc.receive_message(b, a.userId, "hi")
+    p_svc.add_to_favorites(a, p_svc.publish_product(b, "X", "Y", 1.0, "C"))
+
+    assert export_messages(im_svc, str(tmp_path / "m.col")) == 2
+    assert export_favorites(p_svc, str(tmp_path / "f.col")) == 1
+    contents = [r["content"] for r in ColumnarReader(str(tmp_path / "m.col")).scan(columns=["content"])]
+    assert contents == ["你好", "hi"]
+    favs = list(ColumnarReader(str(tmp_path / "f.col")).scan())
+    assert favs[0]["user_id"] == str(a.userId)
+
+# --- 子功能 7: 冷消息压缩分层测试 ---
+
+def test_cold_tier_compacts_and_pages_history(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from message_tier import ColdMessageStore
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    store = ColdMessageStore(max_age=timedelta(hours=1), codec="lzma", block_size=4, cache_blocks=2)
+    im_svc = IMService(NotificationService(), u_svc, cold_store=store)
+    a = u_svc.register("1", "cold_a@test.com", "1", "A")
+    b = u_svc.register("2", "cold_b@test.com", "1", "B")
+    c = u_svc.register("3", "cold_c@test.com", "1", "C")
+    u_svc.login("cold_a@test.com", "1")
+    u_svc.login("cold_b@test.com", "1")
+    for i in range(10):
+        im_svc.receive_message(a, b.userId, f"old{i}")
+    im_svc.receive_message(a, c.userId, "other")
+    original_ids = [m.messageId for m in im_svc.message_db[:10]]
+
+    moved = im_svc.compact_cold_messages(now=datetime.now() + timedelta(hours=2))
+    assert moved == 11
+    assert im_svc.message_db == []
+    assert store.count(a.userId, b.userId) == 10
+
+    im_svc.receive_message(b, a.userId, "new")
+    page = im_svc.get_chat_history(a, b, limit=3)
+    assert [m.content for m in page] == ["old8", "old9", "new"]
+    assert store.cache_misses == 1
+
+    full = im_svc.get_chat_history(b, a)
+    assert [m.messageId for m in full[:10]] == original_ids
+    assert full[-1].content == "new"
+    assert full[0].sender is a
+    assert len(list(im_svc.iter_messages())) == 12
+
+# --- 子功能 8: 分段磁盘消息日志测试 ---
+
+def test_segmented_log_backs_im_history(tmp_path, monkeypatch):
+    from message_log import SegmentedMessageLog
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    log = SegmentedMessageLog(str(tmp_path / "log"), user_resolver=u_svc.find_user_by_id)
+    im_svc = IMService(NotificationService(), u_svc, message_log=log)
+    a = u_svc.register("1", "log_a@test.com", "1", "A")
+    b = u_svc.register("2", "log_b@test.com", "1", "B")
+    u_svc.login("log_b@test.com", "1")
+    im_svc.receive_message(a, b.userId, "m0")
+    im_svc.receive_message(b, a.userId, "m1")
+    assert im_svc.message_db == []
+    assert [m.content for m in im_svc.get_chat_history(a, b)] == ["m0", "m1"]
+    assert [m.content for m in im_svc.get_chat_history(a, b, limit=1)] == ["m1"]
+    log.close()
+
+def test_segmented_log_reopen_and_expire_segments(tmp_path):
+    from datetime import datetime, timedelta
+    from message_log import SegmentedMessageLog
+    a = User("1", "seg_a@test.com", "1", "A")
+    b = User("2", "seg_b@test.com", "1", "B")
+    users = {a.userId: a, b.userId: b}
+    log = SegmentedMessageLog(str(tmp_path), segment_seconds=3600, retention=timedelta(hours=2))
+    base = datetime(2024, 1, 1, 8, 0, 0)
+    for i in range(6):
+        m = Message(a, b, f"m{i}")
+        m.sentAt = base + timedelta(hours=i)
+        log.append(m)
+    assert len(log.segments) == 6
+    page = log.history(b.userId, a.userId, limit=2)
+    assert [m.content for m in page] == ["m4", "m5"]
+    assert page[0].sender is a
+    log.close()
+
+    reopened = SegmentedMessageLog(str(tmp_path), segment_seconds=3600,
+                                   retention=timedelta(hours=2), user_resolver=users.get)
+    assert [m.content for m in reopened.history(a.userId, b.userId)] == [f"m{i}" for i in range(6)]
+    # 保留 2 小时：12:00 之前结束的 8~11 点四个段整段删除
+    assert reopened.expire(now=base + timedelta(hours=6)) == 4
+    assert len(list(tmp_path.iterdir())) == 2
+    assert [m.content for m in reopened.history(a.userId, b.userId)] == ["m4", "m5"]
+    reopened.close()
+
+def test_segmented_log_keeps_few_segment_maps_open(tmp_path):
+    from datetime import datetime, timedelta
+    from memcheck import open_fd_count
+    from message_log import SegmentedMessageLog
+    a = User("1", "fd_a@test.com", "1", "A")
+    b = User("2", "fd_b@test.com", "1", "B")
+    log = SegmentedMessageLog(str(tmp_path), segment_seconds=3600)
+    base = datetime(2024, 1, 1)
+    for i in range(60):
+        m = Message(a, b, f"m{i}")
+        m.sentAt = base + timedelta(hours=i)
+        log.append(m)
+    log.close()
+
+    before = open_fd_count()
+    reopened = SegmentedMessageLog(str(tmp_path), segment_seconds=3600, user_resolver={a.userId: a, b.userId: b}.get,
+                                   max_open_maps=4)
+    # 启动时只顺序读取重建索引，不保留映射
+    assert not reopened._mapped
+    assert [m.content for m in reopened.history(a.userId, b.userId)] == [f"m{i}" for i in range(60)]
+    assert len(reopened._mapped) == 4
+    assert len(list(reopened.iter_messages())) == 60
+    if before is not None:
+        assert open_fd_count() - before <= 4
+    reopened.close()
+
+# --- 子功能 9: 会话收件箱测试 ---
+
+def test_inbox_orders_by_activity_and_counts_unread(tmp_path, monkeypatch):
+    from inbox import InboxIndex
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    im_svc = IMService(NotificationService(), u_svc, inbox=InboxIndex(preview_length=5))
+    me = u_svc.register("1", "in_me@test.com", "1", "Me")
+    a = u_svc.register("2", "in_a@test.com", "1", "A")
+    b = u_svc.register("3", "in_b@test.com", "1", "B")
+    u_svc.login("in_me@test.com", "1")
+    u_svc.login("in_a@test.com", "1")
+    u_svc.login("in_b@test.com", "1")
+
+    im_svc.receive_message(a, me.userId, "hello there")
+    im_svc.receive_message(b, me.userId, "hi")
+    im_svc.receive_message(a, me.userId, "again")
+
+    entries = im_svc.get_inbox(me)
+    assert [e.partner.nickname for e in entries] == ["A", "B"]
+    assert [e.unread for e in entries] == [2, 1]
+    assert im_svc.inbox.total_unread(me.userId) == 3
+    assert [e.partner.nickname for e in im_svc.get_inbox(me, offset=1, limit=1)] == ["B"]
+
+    im_svc.receive_message(me, b.userId, "reply that is long")
+    entries = im_svc.get_inbox(me)
+    assert entries[0].partner is b
+    assert entries[0].last_preview == "reply…"
+    assert entries[0].unread == 1
+    assert im_svc.get_inbox(b)[0].unread == 1
+
+    assert im_svc.mark_read(me, a) == 2
+    assert im_svc.inbox.unread(me.userId, a.userId) == 0
+    assert im_svc.inbox.total_unread(me.userId) == 1
+
+# --- 子功能 10: 离线推送合并测试 ---
+
+class RecordingNotificationService:
+    def __init__(self):
+        self.pushes = []
+
+    def trigger_push(self, user_id, notification_content):
+        self.pushes.append((user_id, notification_content))
+
+def test_push_coalescer_collapses_offline_burst():
+    from push_coalescer import PushCoalescer
+    now = [100.0]
+    n_svc = RecordingNotificationService()
+    coalescer = PushCoalescer(n_svc, window_seconds=5.0, clock=lambda: now[0])
+    u_svc = UserService()
+    im_svc = IMService(n_svc, u_svc, push_coalescer=coalescer)
+    sender = u_svc.register("1", "co_s@test.com", "1", "Sender")
+    receiver = u_svc.register("2", "co_r@test.com", "1", "Receiver")
+
+    for i in range(10):
+        im_svc.receive_message(sender, receiver.userId, f"msg{i}")
+    assert n_svc.pushes == []
+    assert coalescer.flush_due() == 0
+
+    now[0] += 5.0
+    assert coalescer.flush_due() == 1
+    assert n_svc.pushes == [(receiver.userId, "您有来自 Sender 的 10 条新消息，最新: msg9")]
+
+    im_svc.receive_message(sender, receiver.userId, "single")
+    coalescer.flush_all()
+    assert n_svc.pushes[-1][1] == "您有来自 Sender 的一条新消息: single"
+    assert (coalescer.submitted, coalescer.pushes_sent) == (11, 2)
+
+def test_push_coalescer_bounds_pending_per_receiver():
+    from push_coalescer import PushCoalescer
+    n_svc = RecordingNotificationService()
+    coalescer = PushCoalescer(n_svc, window_seconds=60, max_pending_per_receiver=2, clock=lambda: 0.0)
+    receiver_id = uuid.uuid4()
+    senders = [uuid.uuid4() for _ in range(3)]
+    for i, sender_id in enumerate(senders):
+        coalescer.submit(receiver_id, sender_id, f"S{i}", "x")
+    # 第三个发送者到来时，最早挂起的 S0 被立即发出
+    assert [content for _, content in n_svc.pushes] == ["您有来自 S0 的一条新消息: x"]
+    assert coalescer.pending_count() == 2
+
+def test_push_coalescer_timer_thread_flushes():
+    import time
+    from push_coalescer import PushCoalescer
+    n_svc = RecordingNotificationService()
+    coalescer = PushCoalescer(n_svc, window_seconds=0.01)
+    coalescer.start(tick_seconds=0.01)
+    coalescer.submit(uuid.uuid4(), uuid.uuid4(), "S", "x")
+    deadline = time.time() + 2
+    while not n_svc.pushes and time.time() < deadline:
+        time.sleep(0.01)
+    coalescer.stop()
+    assert len(n_svc.pushes) == 1
+
+# --- 子功能 11: 令牌桶限流测试 ---
+
+def test_rate_limiter_rejects_without_touching_state(tmp_path, monkeypatch):
+    from rate_limit import RateLimiter, RatePolicy, RateLimitExceeded
+    monkeypatch.chdir(tmp_path)
+    now = [0.0]
+    limiter = RateLimiter({"send_message": RatePolicy(1.0, 2), "login": RatePolicy(1.0, 1),
+                           "publish_product": RatePolicy(1.0, 1)}, clock=lambda: now[0])
+    u_svc = UserService(rate_limiter=limiter)
+    p_svc = ProductService(rate_limiter=limiter)
+    im_svc = IMService(NotificationService(), u_svc, rate_limiter=limiter)
+    a = u_svc.register("1", "rl_a@test.com", "1", "A")
+    b = u_svc.register("2", "rl_b@test.com", "1", "B")
+    u_svc.login("rl_b@test.com", "1")
+
+    im_svc.receive_message(a, b.userId, "1")
+    im_svc.receive_message(a, b.userId, "2")
+    with pytest.raises(RateLimitExceeded) as exc:
+        im_svc.receive_message(a, b.userId, "3")
+    assert exc.value.retry_after == pytest.approx(1.0)
+    assert len(im_svc.message_db) == 2
+    # 其他用户的令牌桶互不影响
+    im_svc.receive_message(b, a.userId, "from b")
+
+    now[0] += 1.0
+    im_svc.receive_message(a, b.userId, "3")
+    assert len(im_svc.message_db) == 4
+
+    p_svc.publish_product(a, "P", "D", 1.0, "C")
+    with pytest.raises(RateLimitExceeded):
+        p_svc.publish_product(a, "P2", "D", 1.0, "C")
+    assert len(p_svc.product_db) == 1
+    u_svc.login("rl_b@test.com", "1")
+    with pytest.raises(RateLimitExceeded):
+        u_svc.login("rl_b@test.com", "1")
+
+def test_rate_limiter_evicts_idle_keys():
+    from rate_limit import RateLimiter, RatePolicy
+    now = [0.0]
+    limiter = RateLimiter({"op": RatePolicy(1.0, 5)}, clock=lambda: now[0])
+    assert limiter.idle_seconds == 5.0
+    for key in range(4):
+        assert limiter.try_acquire("op", key) == 0
+    assert limiter.try_acquire("unlimited", "k") == 0
+    assert limiter.active_keys() == 4
+    now[0] += 10
+    limiter.try_acquire("op", "new")
+    limiter.try_acquire("op", "new")
+    assert limiter.active_keys() == 1
+
+# --- 子功能 12: 无界面启动与种子数据测试 ---
+
+def test_headless_import_does_not_load_tkinter():
+    import os
+    import subprocess
+    import sys
+    code = "import sys, headless; headless.MarketplaceCore().product_service; print('tkinter' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "False"
+
+def test_headless_core_builds_services_lazily():
+    from headless import MarketplaceCore
+    core = MarketplaceCore()
+    assert not core.started
+    assert len(core.product_service.product_db) == 3
+    assert core.started
+    assert core.im_service.user_service is core.user_service
+    core.close()
+
+def test_seed_file_round_trip(tmp_path):
+    from headless import MarketplaceCore
+    from seed_data import generate_demo_dataset, save_seed
+    source = MarketplaceCore(prepopulate=False)
+    generate_demo_dataset(source.user_service, source.product_service, users=5, products=50)
+    buyer = source.user_service.user_db["user1@seed.com"]
+    product = next(iter(source.product_service.product_db.values()))
+    source.product_service.add_to_favorites(buyer, product)
+    path = str(tmp_path / "seed.bin")
+    save_seed(source.user_service, source.product_service, path)
+
+    core = MarketplaceCore(seed_path=path)
+    p_svc = core.product_service
+    assert len(p_svc.product_db) == 50
+    restored = p_svc.find_product_by_id(product.productId)
+    assert restored.name == product.name
+    assert restored.seller is core.user_service.user_db[product.seller.email]
+    assert core.user_service.login("user1@seed.com", "123") is not None
+    assert [p.name for p in p_svc.get_user_favorites(core.user_service.user_db["user1@seed.com"])] == [product.name]
+    assert p_svc.get_advertisements_by_position("homepage_banner")
+    source.close()
+    core.close()
+
+# --- 子功能 13: 分面浏览测试 ---
+
+def test_browse_filters_and_facet_counts(product_service, sample_user):
+    from models import ProductStatus
+    phone = product_service.publish_product(sample_user, "Phone", "D", 3000.0, "Mobile")
+    product_service.publish_product(sample_user, "Case", "D", 30.0, "Mobile")
+    book = product_service.publish_product(sample_user, "Book", "D", 50.0, "Books")
+    product_service.publish_products_bulk([(sample_user, "Novel", "D", 20.0, "Books"),
+                                           (sample_user, "Lamp", "D", 80.0, "Home")])
+
+    result = product_service.browse(price_min=25, price_max=100)
+    assert [p.name for p in result.products] == ["Case", "Book", "Lamp"]
+    assert result.category_counts == {"Mobile": 1, "Books": 1, "Home": 1}
+    assert result.status_counts == {ProductStatus.ON_SALE: 3}
+
+    result = product_service.browse(category="Books", price_max=100)
+    assert [p.name for p in result.products] == ["Novel", "Book"]
+    # 分类维度的计数忽略分类过滤本身，便于界面展示其他分类可选数量
+    assert result.category_counts == {"Books": 2, "Mobile": 1, "Home": 1}
+
+    product_service.update_product(book, price=500.0)
+    assert [p.name for p in product_service.browse(category="Books", price_max=100).products] == ["Novel"]
+    assert product_service.browse(category="Mobile", status=ProductStatus.ON_SALE, price_min=1000).products == [phone]
+    assert product_service.browse(category="Missing").total == 0
+
+# --- 子功能 14: 商品生命周期测试 ---
+
+def test_product_lifecycle_updates_status_partitions(product_service, sample_user):
+    from models import ProductStatus
+    a = product_service.publish_product(sample_user, "A", "x", 1.0, "C")
+    b = product_service.publish_product(sample_user, "B", "x", 2.0, "C")
+    c = product_service.publish_product(sample_user, "C", "x", 3.0, "C")
+
+    assert product_service.mark_sold(a)
+    assert not product_service.mark_sold(a)
+    assert product_service.remove_product(b)
+    assert [p.name for p in product_service.search_products("")] == ["C"]
+    assert [p.name for p in product_service.search_products("x")] == ["C"]
+    assert len(product_service.search_products("", include_unavailable=True)) == 3
+    assert product_service.get_products_by_seller(sample_user, [ProductStatus.SOLD_OUT]) == [a]
+    assert len(product_service.get_products_by_seller(sample_user)) == 3
+    assert product_service.browse(status=ProductStatus.REMOVED).products == [b]
+
+    assert product_service.relist_product(a)
+    assert a.status == ProductStatus.ON_SALE
+    assert {p.name for p in product_service.search_products("")} == {"A", "C"}
+    assert not product_service.relist_product(c)
+
+def test_purge_job_compacts_removed_listings_in_batches(product_service, sample_user):
+    from purge_job import RemovedListingPurger
+    products = product_service.publish_products_bulk(
+        [(sample_user, f"P{i}", "D", float(i), "C") for i in range(10)])
+    product_service.add_to_favorites(sample_user, products[0])
+    product_service.add_to_favorites(sample_user, products[9])
+    for p in products[:7]:
+        product_service.remove_product(p)
+
+    assert product_service.purge_removed(batch_size=3) == 3
+    purger = RemovedListingPurger(product_service, batch_size=2)
+    assert purger.run_once() == 4
+    assert purger.run_once() == 0
+    assert len(product_service.product_db) == 3
+    assert len(product_service.facet_index) == 3
+    assert product_service.get_user_favorites(sample_user) == [products[9]]
+
+def test_purge_runs_safely_alongside_catalog_writers(product_service, sample_user):
+    import threading
+    from models import ProductStatus
+    from purge_job import RemovedListingPurger
+    products = product_service.publish_products_bulk(
+        [(sample_user, f"P{i}", "D", float(i), "C") for i in range(400)])
+    keep = products[-1]
+    stop = threading.Event()
+    errors = []
+    purger = RemovedListingPurger(product_service, batch_size=5)
+
+    def purge_loop():
+        try:
+            while not stop.is_set():
+                purger.run_once()
+        except Exception as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=purge_loop)
+    worker.start()
+    try:
+        for i, p in enumerate(products[:-1]):
+            product_service.remove_product(p)
+            if i % 3 == 0:
+                product_service.relist_product(p)
+            product_service.add_to_favorites(sample_user, keep)
+    finally:
+        stop.set()
+        worker.join()
+    assert errors == []
+    while product_service.purge_removed():
+        pass
+    assert product_service.status_partitions[ProductStatus.REMOVED] == {}
+    assert product_service.get_user_favorites(sample_user) == [keep]
+    assert len(product_service.product_db) == len(product_service.facet_index)
+
+def test_catalog_reads_run_safely_alongside_purge(product_service, sample_user):
+    import threading
+    from purge_job import RemovedListingPurger
+    products = product_service.publish_products_bulk(
+        [(sample_user, f"P{i}", "D", float(i), "C") for i in range(3000)])
+    for p in products[:-1]:
+        product_service.remove_product(p)
+        product_service.add_to_favorites(sample_user, p)
+    stop = threading.Event()
+    errors = []
+    purger = RemovedListingPurger(product_service, batch_size=20)
+
+    def read_loop():
+        try:
+            while not stop.is_set():
+                product_service.search_products("p", include_unavailable=True)
+                product_service.get_products_by_seller(sample_user)
+                product_service.get_user_favorites(sample_user)
+        except Exception as e:
+            errors.append(e)
+
+    import sys
+    interval = sys.getswitchinterval()
+    # 频繁切换线程，让读取更容易落在清理删除的中途
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=read_loop) for _ in range(2)]
+    for t in readers:
+        t.start()
+    try:
+        while purger.run_once():
+            pass
+    finally:
+        stop.set()
+        for t in readers:
+            t.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert product_service.search_products("", include_unavailable=True) == [products[-1]]
+    assert product_service.get_products_by_seller(sample_user) == [products[-1]]
+
+# --- 子功能 15: 图片缩略图流水线测试 ---
+
+def fake_render(source_path, out_dir, sizes):
+    import os
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name in sizes:
+        paths[name] = os.path.join(out_dir, f"{name}.jpg")
+        with open(paths[name], "wb") as f:
+            f.write(name.encode())
+    return paths
+
+def test_thumbnail_pipeline_dedups_by_content(tmp_path, product_service, sample_user):
+    from concurrent.futures import ThreadPoolExecutor
+    from thumbnails import ThumbnailPipeline
+    pipeline = ThumbnailPipeline(str(tmp_path / "cache"), sizes={"small": 64, "large": 640},
+                                 executor=ThreadPoolExecutor(2), renderer=fake_render)
+    product_service.thumbnail_pipeline = pipeline
+    first = tmp_path / "a.png"
+    second = tmp_path / "b.png"
+    first.write_bytes(b"same image bytes")
+    second.write_bytes(b"same image bytes")
+
+    product = product_service.publish_product(sample_user, "P", "D", 1.0, "C")
+    image = product_service.add_product_image(product, str(first))
+    pipeline.submit(str(first)).result()
+    pipeline.shutdown()
+    assert set(image.thumbnails) == {"small", "large"}
+    assert image.thumbnail("small").endswith("small.jpg")
+
+    pipeline = ThumbnailPipeline(str(tmp_path / "cache"), sizes={"small": 64, "large": 640},
+                                 executor=ThreadPoolExecutor(1), renderer=fake_render)
+    dup = product.add_image(str(second))
+    assert dup.thumbnail("small") == str(second)
+    dup.thumbnails.update(pipeline.process(str(second)))
+    assert dup.thumbnails == image.thumbnails
+    assert (pipeline.renders, pipeline.cache_hits) == (0, 1)
+    # 远程 URL 不经过流水线，直接使用原图
+    remote = product_service.add_product_image(product, "http://cdn/x.png")
+    assert remote.thumbnail("large") == "http://cdn/x.png"
+    pipeline.shutdown()
+
+def test_thumbnail_render_with_pillow_in_process_pool(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    from thumbnails import ThumbnailPipeline
+    source = tmp_path / "big.png"
+    Image.new("RGB", (1200, 800), "red").save(source)
+    u_svc = UserService(thumbnail_pipeline=ThumbnailPipeline(str(tmp_path / "cache"), max_workers=1))
+    user = u_svc.register("1", "thumb@test.com", "1", "T")
+    u_svc.update_avatar(user, str(source)).result()
+    u_svc.thumbnail_pipeline.shutdown()
+    with Image.open(user.avatarThumbnails["small"]) as small:
+        assert max(small.size) == 64
+
+# --- 子功能 16: 时间有序 ID 测试 ---
+
+def test_snowflake_ids_monotonic_across_clock_skew():
+    from ids import SnowflakeIdGenerator, id_timestamp_ms, DEFAULT_EPOCH_MS
+    now = [DEFAULT_EPOCH_MS / 1000 + 100.0]
+    gen = SnowflakeIdGenerator(node_id=3, clock=lambda: now[0])
+    first = [gen.next_id() for _ in range(5000)]
+    now[0] -= 5  # 时钟回拨
+    later = [gen.next_id() for _ in range(10)]
+    ids = first + later
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    assert all(i < (1 << 63) for i in ids)
+    assert id_timestamp_ms(first[0]) == DEFAULT_EPOCH_MS + 100000
+    with pytest.raises(ValueError):
+        SnowflakeIdGenerator(node_id=1024)
+
+def test_uuid_compat_mode_and_history_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from ids import UUIDCompatIdGenerator, set_id_generator, decode_id, encode_id
+    previous = set_id_generator(UUIDCompatIdGenerator(node_id=1))
+    try:
+        u_svc = UserService()
+        a = u_svc.register("1", "a@test.com", "x", "A")
+        b = u_svc.register("2", "b@test.com", "x", "B")
+        assert isinstance(a.userId, uuid.UUID)
+        assert decode_id(encode_id(a.userId)) == a.userId
+        im = IMService(NotificationService(), u_svc)
+        sent = [im.receive_message(a, b.userId, str(i)) for i in range(20)]
+    finally:
+        set_id_generator(previous)
+    assert isinstance(User("3", "n@test.com", "x", "N").userId, int)
+    assert [m.messageId for m in sent] == sorted(m.messageId for m in sent)
+    assert [m.content for m in im.get_chat_history(b, a)] == [str(i) for i in range(20)]
+
+# --- 子功能 17: 会话序号与增量同步测试 ---
+
+def test_message_seq_and_delta_sync_across_cold_store(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from message_tier import ColdMessageStore
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    im_svc = IMService(NotificationService(), u_svc,
+                       cold_store=ColdMessageStore(max_age=timedelta(hours=1), block_size=2))
+    a = u_svc.register("1", "seq_a@test.com", "1", "A")
+    b = u_svc.register("2", "seq_b@test.com", "1", "B")
+    c = u_svc.register("3", "seq_c@test.com", "1", "C")
+    sent = [im_svc.receive_message(a if i % 2 else b, (b if i % 2 else a).userId, f"m{i}") for i in range(5)]
+    im_svc.receive_message(a, c.userId, "other")
+    assert [m.seq for m in sent] == [1, 2, 3, 4, 5]
+    assert im_svc.last_seq(b, a) == 5 and im_svc.last_seq(a, c) == 1
+
+    im_svc.compact_cold_messages(now=datetime.now() + timedelta(hours=2))
+    later = im_svc.receive_message(b, a.userId, "m5")
+    assert later.seq == 6
+    assert [m.content for m in im_svc.get_messages_since(a, b, 4)] == ["m4", "m5"]
+    assert [m.seq for m in im_svc.get_chat_history(a, b)] == [1, 2, 3, 4, 5, 6]
+    assert im_svc.get_messages_since(a, b, 6) == []
+
+def test_cold_blocks_follow_seq_when_clock_steps_back(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from message_tier import ColdMessageStore
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    store = ColdMessageStore(max_age=timedelta(hours=1), block_size=2)
+    im_svc = IMService(NotificationService(), u_svc, cold_store=store)
+    a = u_svc.register("1", "step_a@test.com", "1", "A")
+    b = u_svc.register("2", "step_b@test.com", "1", "B")
+    sent = [im_svc.receive_message(a, b.userId, f"m{i}") for i in range(4)]
+    # 发完前两条后系统时钟回拨了一小时
+    for m in sent[2:]:
+        m.sentAt -= timedelta(hours=1)
+    im_svc.compact_cold_messages(now=datetime.now() + timedelta(hours=3))
+    assert [blk.first_seq for blk in store.blocks[next(iter(store.blocks))]] == [1, 3]
+    assert [m.seq for m in store.history(a.userId, b.userId)] == [1, 2, 3, 4]
+    later = im_svc.receive_message(b, a.userId, "m4")
+    assert [m.seq for m in im_svc.get_chat_history(a, b)] == [1, 2, 3, 4, later.seq]
+
+def test_message_seq_resumes_from_segmented_log(tmp_path, monkeypatch):
+    from message_log import SegmentedMessageLog
+    monkeypatch.chdir(tmp_path)
+    u_svc = UserService()
+    a = u_svc.register("1", "seqlog_a@test.com", "1", "A")
+    b = u_svc.register("2", "seqlog_b@test.com", "1", "B")
+    log = SegmentedMessageLog(str(tmp_path / "log"), user_resolver=u_svc.find_user_by_id)
+    im_svc = IMService(NotificationService(), u_svc, message_log=log)
+    for i in range(3):
+        im_svc.receive_message(a, b.userId, f"m{i}")
+    log.close()
+
+    # 重启后序号从日志中的最大值继续
+    log = SegmentedMessageLog(str(tmp_path / "log"), user_resolver=u_svc.find_user_by_id)
+    im_svc = IMService(NotificationService(), u_svc, message_log=log)
+    assert im_svc.last_seq(a, b) == 3
+    assert im_svc.receive_message(b, a.userId, "m3").seq == 4
+    assert [(m.seq, m.content) for m in im_svc.get_messages_since(b, a, 2)] == [(3, "m2"), (4, "m3")]
+    log.close()
+
+# --- 子功能 18: 相似商品推荐测试 ---
+
+def test_tokenize_splits_cjk_into_bigrams():
+    from recommend import tokenize
+    assert tokenize("二手iPhone 15，机械键盘 灯") == ["二手", "iphone", "15", "机械", "械键", "键盘", "灯"]
+
+def test_similar_products_incremental_and_rebuild(sample_user):
+    from recommend import SimilarProductIndex
+    engine = SimilarProductIndex(top_k=2)
+    p_svc = ProductService(recommender=engine)
+    keyboard = p_svc.publish_product(sample_user, "机械键盘", "青轴机械键盘，RGB灯效", 350.0, "电脑配件")
+    p_svc.publish_product(sample_user, "二手iPhone 15", "512GB 手机", 5000.0, "手机")
+    p_svc.publish_products_bulk([(sample_user, "静音机械键盘", "红轴", 299.0, "电脑配件"),
+                                 (sample_user, "Python 编程图书", "入门教程", 59.0, "图书")])
+    similar = p_svc.get_similar_products(keyboard)
+    assert similar[0].name == "静音机械键盘"
+    assert engine.rebuilds == 1
+
+    # 增量发布的商品会补进已缓存的相似列表
+    third = p_svc.publish_product(sample_user, "机械键盘 87键", "茶轴", 199.0, "电脑配件")
+    assert third in p_svc.get_similar_products(keyboard)
+    p_svc.mark_sold(third)
+    assert third not in p_svc.get_similar_products(keyboard)
+    p_svc.update_product(third, name="显示器支架", description="铝合金")
+    engine.rebuild(precompute=True)
+    assert all("键盘" in p.name for p in p_svc.get_similar_products(keyboard))
+    assert ProductService().get_similar_products(keyboard) == []
+
+# --- 子功能 19: 搜索自动补全测试 ---
+
+def test_autocomplete_ranks_names_categories_and_queries(sample_user):
+    from autocomplete import AutocompleteIndex
+    p_svc = ProductService(autocomplete=AutocompleteIndex(top_n=3))
+    p_svc.publish_products_bulk([(sample_user, "机械键盘", "青轴", 350.0, "电脑配件"),
+                                 (sample_user, "机械表", "自动上链", 900.0, "手表")])
+    assert p_svc.suggest("机") == ["机械表", "机械键盘"]
+    keyboard = p_svc.publish_product(sample_user, "机械键盘", "红轴", 299.0, "电脑配件")
+    p_svc.publish_product(sample_user, "Mac mini", "M2", 3999.0, "电脑")
+    assert p_svc.suggest("机械") == ["机械键盘", "机械表"]
+    assert p_svc.suggest("mac") == ["Mac mini"]
+    assert p_svc.suggest("电脑", n=1) == ["电脑配件"]
+
+    # 热门搜索词排在前面；改名后旧名称的权重随之减少
+    p_svc.search_products("机器")
+    p_svc.search_products("m")
+    p_svc.search_products("m")
+    assert p_svc.suggest("m")[0] == "m"
+    p_svc.update_product(keyboard, name="机器人玩具")
+    assert p_svc.suggest("机") == ["机器人玩具", "机械表", "机械键盘"]
+    assert p_svc.suggest("机器") == ["机器人玩具"]
+    assert ProductService().suggest("机") == []
+
+# --- 子功能 20: 查询结果缓存测试 ---
+
+def test_query_cache_lru_and_ttl():
+    from query_cache import QueryCache
+    now = [0.0]
+    cache = QueryCache(max_entries=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.put("a", 1, ["A"])
+    cache.put("b", 1, ["B"])
+    assert cache.get("a", 1) == (True, ["A"])
+    cache.put("c", 1, ["C"])  # 淘汰最久未用的 b
+    assert cache.get("b", 1) == (False, None)
+    assert cache.get("a", 2) == (False, None)  # 版本变化
+    now[0] = 11
+    assert cache.get("c", 1) == (False, None)  # 过期
+    assert cache.stats()["evictions"] == 1 and cache.stale == 1 and cache.expired == 1
+
+def test_product_service_cache_invalidated_by_versions(sample_user):
+    from query_cache import QueryCache
+    p_svc = ProductService(query_cache=QueryCache())
+    other = User("2", "other@test.com", "x", "O")
+    phone = p_svc.publish_product(sample_user, "手机", "旧款", 100.0, "数码")
+    p_svc.publish_product(other, "耳机", "蓝牙", 50.0, "数码")
+    p_svc.add_advertisement("大促", "", "", "homepage_banner")
+
+    assert [p.name for p in p_svc.search_products("机")] == ["手机", "耳机"]
+    p_svc.search_products("机").clear()  # 修改返回值不影响缓存
+    assert len(p_svc.search_products("机")) == 2
+    assert p_svc.get_products_by_seller(sample_user) == [phone]
+    assert p_svc.get_products_by_seller(sample_user) == [phone]
+    assert len(p_svc.get_advertisements_by_position("homepage_banner")) == 1
+    hits = p_svc.query_cache.hits
+    assert hits == 3
+
+    # 其他卖家发布商品只让搜索结果失效，不影响本卖家的列表
+    p_svc.publish_product(other, "充电器", "快充", 30.0, "数码")
+    assert p_svc.get_products_by_seller(sample_user) == [phone]
+    assert p_svc.query_cache.hits == hits + 1
+    p_svc.update_product(phone, description="新款")
+    assert p_svc.search_products("新款") == [phone]
+    # 直接调用模型的 update 同样经过服务，缓存的卖家列表和搜索结果都会失效
+    assert p_svc.search_products("旗舰") == []
+    phone.update(name="旗舰手机")
+    assert p_svc.get_products_by_seller(sample_user)[0].name == "旗舰手机"
+    assert p_svc.search_products("旗舰") == [phone]
+    p_svc.mark_sold(phone)
+    assert p_svc.search_products("机") == [p_svc.search_products("耳")[0]]
+    p_svc.add_advertisement("新品", "", "", "homepage_banner")
+    assert len(p_svc.get_advertisements_by_position("homepage_banner")) == 2
+    assert 0 < p_svc.cache_stats()["hit_rate"] < 1
+
+# --- 子功能 21: 变更事件总线测试 ---
+
+def test_event_bus_batches_and_keeps_per_key_order(sample_user):
+    from events import EventBus, FavoriteAdded, ProductPublished, ProductUpdated
+    bus = EventBus(batch_size=4)
+    seen = []
+    batch_sizes = []
+
+    def handler(batch):
+        batch_sizes.append(len(batch))
+        seen.extend((e.key, type(e).__name__, e.fields if isinstance(e, ProductUpdated) else ()) for e in batch)
+
+    bus.subscribe((ProductPublished, ProductUpdated), handler, lanes=3)
+    failing = bus.subscribe((FavoriteAdded,), lambda batch: 1 / 0, name="broken")
+    p_svc = ProductService(event_bus=bus)
+    products = [p_svc.publish_product(sample_user, f"P{i}", "D", 1.0, "C") for i in range(6)]
+    for p in products:
+        p_svc.update_product(p, price=2.0)
+        p_svc.mark_sold(p)
+    p_svc.add_to_favorites(sample_user, products[0])
+    assert seen == [] and bus.published == 19
+
+    bus.start()
+    bus.flush()
+    bus.stop()
+    assert len(seen) == 18 and max(batch_sizes) <= 4
+    for p in products:
+        assert [(name, fields) for key, name, fields in seen if key == p.productId] == [
+            ("ProductPublished", ()), ("ProductUpdated", ("price",)), ("ProductUpdated", ("status",))]
+    assert failing.errors == 1 and bus.stats()["broken"]["delivered"] == 1
+
+def test_event_bus_moves_notifications_and_indexes_off_write_path(tmp_path, monkeypatch):
+    from autocomplete import AutocompleteIndex
+    from events import EventBus, metrics_subscriber, MessageSent
+    from metrics import MetricsRegistry
+    monkeypatch.chdir(tmp_path)
+    bus = EventBus()
+    registry = MetricsRegistry()
+    bus.subscribe((MessageSent,), metrics_subscriber(registry), name="metrics")
+    notifier = RecordingNotificationService()
+    u_svc = UserService()
+    im_svc = IMService(notifier, u_svc, event_bus=bus)
+    p_svc = ProductService(autocomplete=AutocompleteIndex(), event_bus=bus)
+    a = u_svc.register("1", "bus_a@test.com", "1", "A")
+    b = u_svc.register("2", "bus_b@test.com", "1", "B")
+    im_svc.receive_message(a, b.userId, "hi")
+    product = p_svc.publish_product(a, "机械键盘", "青轴", 1.0, "电脑配件")
+    assert notifier.pushes == [] and p_svc.suggest("机") == []
+
+    assert bus.drain() == 3
+    assert len(notifier.pushes) == 1
+    assert p_svc.suggest("机") == ["机械键盘"]
+    p_svc.update_product(product, name="机器人")
+    bus.drain()
+    assert p_svc.suggest("机") == ["机器人"]
+    assert registry.stats_for("events", "MessageSent").calls == 1
+
+def test_bulk_load_and_purge_go_through_catalog_subscribers(sample_user):
+    from autocomplete import AutocompleteIndex
+    from events import EventBus, ProductPublished, ProductRemoved
+    from recommend import SimilarProductIndex
+    bus = EventBus()
+    seen = []
+    bus.subscribe((ProductPublished, ProductRemoved), lambda batch: seen.extend(type(e).__name__ for e in batch),
+                  name="audit")
+    p_svc = ProductService(recommender=SimilarProductIndex(), autocomplete=AutocompleteIndex(), event_bus=bus)
+    products = p_svc.publish_products_bulk([(sample_user, f"蓝牙耳机{i}", "降噪", 10.0, "数码") for i in range(5)])
+    assert len(p_svc.recommender) == 0 and p_svc.suggest("蓝牙") == []
+
+    bus.drain()
+    assert len(p_svc.recommender) == 5
+    assert p_svc.suggest("蓝牙")
+    p_svc.remove_product(products[0])
+    assert p_svc.purge_removed() == 1
+    assert len(p_svc.recommender) == 5
+    bus.drain()
+    assert len(p_svc.recommender) == 4
+    assert seen == ["ProductPublished"] * 5 + ["ProductRemoved"]
+
+def test_headless_core_close_stops_event_workers():
+    from headless import MarketplaceCore
+    core = MarketplaceCore()
+    core.close()  # 未创建服务时直接返回
+    bus = core.event_bus
+    threads = [t for s in bus.subscriptions for t in s.threads]
+    assert threads and all(t.is_alive() for t in threads)
+    core.close()
+    assert not any(t.is_alive() for t in threads)
+    core.close()
+
+# --- 子功能 22: 写时复制目录快照测试 ---
+
+def test_catalog_snapshot_is_isolated_from_later_writes(sample_user):
+    from snapshot import CatalogStore
+    p_svc = ProductService(snapshots=CatalogStore(shard_count=4))
+    products = p_svc.publish_products_bulk([(sample_user, f"P{i}", "D", float(i), "C") for i in range(10)])
+    pinned = p_svc.catalog_snapshot()
+    assert len(pinned) == 10
+
+    # 遍历旧快照的同时持续写入，不会出现 "dictionary changed size during iteration"
+    seen = 0
+    for record in pinned:
+        p_svc.publish_product(sample_user, "新品", "D", 1.0, "C")
+        seen += 1
+    assert seen == 10
+    p_svc.update_product(products[0], name="改名", price=99.0)
+    p_svc.remove_product(products[1])
+    p_svc.purge_removed()
+
+    assert pinned.get(products[0].productId).name == "P0"
+    assert pinned.get(products[1].productId) is not None
+    latest = p_svc.catalog_snapshot()
+    assert latest.version > pinned.version and len(latest) == 19
+    assert latest.get(products[0].productId)[3:6] == ("改名", "D", 99.0)
+    assert latest.get(products[1].productId) is None
+    assert [r.name for r in latest.search("改")] == ["改名"]
+    assert latest.facet_counts()[0] == {"C": 19}
+    assert ProductService().catalog_snapshot() is None
+
+def test_search_facets_and_seller_pages_read_pinned_snapshot(sample_user, monkeypatch):
+    from models import ProductStatus
+    from snapshot import CatalogSnapshot, CatalogStore
+    other = User("2", "snap_o@test.com", "x", "O")
+    live, pinned = ProductService(), ProductService(snapshots=CatalogStore(shard_count=4))
+    for p_svc in (live, pinned):
+        items = p_svc.publish_products_bulk([(sample_user if i % 2 else other, f"键盘{i}", "青轴", float(i),
+                                              "数码" if i < 6 else "图书") for i in range(8)])
+        p_svc.mark_sold(items[1])
+        p_svc.remove_product(items[2])
+    assert pinned.facet_counts() == live.facet_counts() == (
+        {"数码": 6, "图书": 2}, {ProductStatus.ON_SALE: 6, ProductStatus.SOLD_OUT: 1, ProductStatus.REMOVED: 1})
+
+    # 搜索读快照的在售分区，分面计数读快照维护的计数，都不遍历整个目录，也不碰实时分区
+    monkeypatch.setattr(CatalogSnapshot, "__iter__", lambda self: pytest.fail("不应全表扫描快照"))
+    pinned.status_partitions = pinned.facet_index = None
+    assert pinned.facet_counts() == live.facet_counts()
+    assert [p.name for p in pinned.search_products("键盘")] == [p.name for p in live.search_products("键盘")]
+    assert [p.name for p in pinned.search_products("")] == [p.name for p in live.search_products("")]
+    assert len(pinned.search_products("", include_unavailable=True)) == 8
+    assert [p.name for p in pinned.get_products_by_seller(sample_user, [ProductStatus.ON_SALE])] == \
+        ["键盘3", "键盘5", "键盘7"]
+    assert pinned.search_products("键盘")[0] is pinned.find_product_by_id(pinned.search_products("键盘")[0].productId)
+
+def test_search_during_snapshot_commit_does_not_poison_cache(sample_user):
+    from query_cache import QueryCache
+    from snapshot import CatalogStore
+
+    class SearchingStore(CatalogStore):
+        # 读者恰好在写入提交快照之前查询
+        def upsert(self, product):
+            during.append(len(p_svc.search_products("")))
+            super().upsert(product)
+
+        def upsert_many(self, products):
+            during.append(len(p_svc.search_products("")))
+            super().upsert_many(products)
+
+    during = []
+    p_svc = ProductService(query_cache=QueryCache(), snapshots=SearchingStore())
+    p_svc.publish_product(sample_user, "键盘", "青轴", 1.0, "数码")
+    p_svc.publish_product(sample_user, "鼠标", "无线", 2.0, "数码")
+    assert during == [0, 1]
+    assert len(p_svc.search_products("")) == 2
+    p_svc.publish_products_bulk([(sample_user, "耳机", "蓝牙", 3.0, "数码")])
+    assert len(p_svc.search_products("")) == 3
+
+
+# --- 子功能 23: 聊天压测测试 ---
+
+def test_chat_load_generator_reports_latency_and_notifications():
+    from load_chat import ChatLoadConfig, run_chat_load
+    config = ChatLoadConfig(clients=6, seconds=0.3, rate_per_client=50, history_ratio=0.3,
+                            online_ratio=0.5, sample_interval=0.1, trace_memory=True, seed=7)
+    report = run_chat_load(config)
+
+    assert report.failures == 0
+    assert report.send.total > 0 and report.history.total > 0
+    assert report.operations == report.send.total + report.history.total
+    assert report.send.percentile(50) <= report.send.percentile(99) <= report.send.max_ns
+    # 通知只发给离线接收者，不会超过发送的消息数
+    assert 0 < report.notifications <= report.send.total
+    assert len(report.samples) >= 3 and report.samples[0]["t"] == 0.0
+    assert report.samples[-1]["ops"] >= report.samples[1]["ops"]
+    assert "p99" in report.summary()
+
+def test_chat_load_memory_falls_back_without_proc_or_resource(monkeypatch):
+    import sys
+    import load_chat
+
+    def no_proc(*args, **kwargs):
+        raise FileNotFoundError("/proc/self/statm")
+
+    # 模拟 Windows：没有 /proc，也没有 resource 模块
+    monkeypatch.setattr(load_chat, "open", no_proc, raising=False)
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert load_chat._process_memory_mb() is None
+    report = load_chat.run_chat_load(load_chat.ChatLoadConfig(clients=2, seconds=0.1, rate_per_client=20,
+                                                              sample_interval=0.05, seed=3))
+    assert report.failures == 0
+    assert report.samples[-1]["memory_mb"] > 0
+
+
+# --- 子功能 24: 内存与句柄预算回归测试 ---
+
+def _memory_fixture():
+    u_svc = UserService()
+    p_svc = ProductService()
+    seller = u_svc.register("1", "mem_a@test.com", "pw", "A")
+    buyer = u_svc.register("2", "mem_b@test.com", "pw", "B")
+    for i in range(50):
+        p_svc.publish_product(seller, f"item{i}", "desc", float(i), "C")
+    buyer.is_online = True
+    im = IMService(RecordingNotificationService(), u_svc)
+    for _ in range(20):
+        im.receive_message(seller, buyer.userId, "hi")
+    return u_svc, p_svc, im, seller, buyer
+
+
+@pytest.mark.parametrize("operation", ["login", "find_user", "search", "by_seller", "chat_history"])
+def test_read_operations_retain_no_memory(operation):
+    from memcheck import check_budget
+    u_svc, p_svc, im, seller, buyer = _memory_fixture()
+    ops = {
+        "login": lambda i: u_svc.login("mem_a@test.com", "pw"),
+        "find_user": lambda i: u_svc.find_user_by_id(buyer.userId),
+        "search": lambda i: p_svc.search_products("it"),
+        "by_seller": lambda i: p_svc.get_products_by_seller(seller),
+        "chat_history": lambda i: im.get_chat_history(seller, buyer, 20),
+    }
+    # 只读操作不应留存内存；留少量余量给解释器内部缓存
+    check_budget(ops[operation], bytes_per_op=64, name=operation)
+
+
+def test_publish_product_memory_budget():
+    from memcheck import check_budget
+    u_svc, p_svc, im, seller, buyer = _memory_fixture()
+    usage = check_budget(lambda i: p_svc.publish_product(seller, f"n{i}", "d", 1.0, "C"), bytes_per_op=2048)
+    assert usage.retained_bytes > 0 and usage.unclosed_files == 0
+
+
+@pytest.mark.xfail(strict=True, raises=AssertionError,
+                   reason="IMService._memory_leak_cache 是实验植入的内存泄漏，修复后应去掉此标记")
+def test_receive_message_memory_budget():
+    from memcheck import check_budget
+    u_svc, p_svc, im, seller, buyer = _memory_fixture()
+    # 一条消息本身（Message、序号、会话索引）约几百字节
+    check_budget(lambda i: im.receive_message(seller, buyer.userId, "hello memory budget"),
+                 bytes_per_op=1024, iterations=100)
+
+
+@pytest.mark.xfail(strict=True, raises=AssertionError,
+                   reason="NotificationService.trigger_push 是实验植入的文件句柄泄漏，修复后应去掉此标记")
+def test_trigger_push_handle_budget(tmp_path, monkeypatch):
+    from memcheck import check_budget
+    monkeypatch.chdir(tmp_path)
+    check_budget(lambda i: NotificationService().trigger_push("u1", f"msg {i}"), bytes_per_op=256, iterations=50)
+
+
+def test_memory_budget_failure_reports_top_lines_and_handles(tmp_path):
+    from memcheck import MemoryBudgetExceeded, check_budget
+    hoard = []
+    with pytest.raises(MemoryBudgetExceeded) as exc:
+        check_budget(lambda i: hoard.append(bytearray(4096)), bytes_per_op=512, iterations=50, warmup=0)
+    assert exc.value.usage.bytes_per_op > 4096
+    assert 'hoard.append(bytearray(4096))' in str(exc.value)
+
+    path = tmp_path / "leak.txt"
+    with pytest.raises(MemoryBudgetExceeded) as exc:
+        check_budget(lambda i: open(path, "a").write("x"), bytes_per_op=1024, iterations=20, warmup=0)
+    assert exc.value.usage.unclosed_files == 20
+    assert "文件句柄" in str(exc.value)
+
+
+# --- 子功能 25: 管理员权限位掩码测试 ---
+
+def test_authorization_engine_bitmask_checks_and_invalidation():
+    from authz import AuthorizationEngine, PermissionRegistry
+    from models import AdminUser, Permission, Role
+    engine = AuthorizationEngine(PermissionRegistry())
+    role = Role("运营")
+    role.add_permission(Permission("product.review"))
+    admin = AdminUser("ops", "pw")
+    assert not engine.has_permission(admin, "product.review")
+
+    # 分配角色后缓存失效，重新合并出有效掩码
+    admin.assign_role(role)
+    assert engine.has_permission(admin, "product.review")
+    assert not engine.has_permission(admin, "user.ban")
+    assert engine.effective_mask(admin) == engine.registry.bit("product.review")
+
+    # 已分配的角色新增权限，持有该角色的管理员立即可见
+    role.add_permission(Permission("user.ban"))
+    assert engine.has_permission(admin, "user.ban")
+    assert engine.has_all(admin, ["product.review", "user.ban"])
+    assert not engine.has_all(admin, ["product.review", "never.registered"])
+    # 查询未登记的键不会把它驻留进注册表
+    registered = len(engine.registry)
+    assert not engine.has_all(admin, ["typo.key"]) and not engine.allows(admin, engine.requirement(["typo.key"]))
+    assert len(engine.registry) == registered and engine.registry.lookup("typo.key") == 0
+    assert engine.has_any(admin, ["never.registered", "user.ban"])
+    assert engine.check_many(admin, ["user.ban", "ad.create"]) == {"user.ban": True, "ad.create": False}
+    assert sorted(engine.permissions_of(admin)) == ["product.review", "user.ban"]
+
+    required = engine.requirement(["user.ban"])
+    assert engine.allows(admin, required) and not engine.allows(AdminUser("new", "pw"), required)
+    with pytest.raises(PermissionError):
+        engine.require(AdminUser("new", "pw"), "user.ban")
+
+
+# --- 子功能 26: 跨进程消息代理测试 ---
+
+def _wait_until(condition, timeout=5.0):
+    import time
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"), reason="需要 Unix 域套接字")
+def test_broker_routes_messages_between_im_services(tmp_path):
+    from broker import BrokerClient, ChatBroker, RemoteEnvelope, decode_envelopes, encode_envelopes
+    path = str(tmp_path / "b.sock")
+    broker = ChatBroker(path).start()
+    client_a = BrokerClient(path, name="a", batch_size=4, max_in_flight=2).connect()
+    client_b = BrokerClient(path, name="b").connect()
+    try:
+        assert client_a.node_id != client_b.node_id
+        users_a, users_b = UserService(), UserService()
+        alice = users_a.register("1", "alice@a.com", "pw", "Alice")
+        bob = users_b.register("2", "bob@b.com", "pw", "Bob")
+        notify_b = RecordingNotificationService()
+        im_a = IMService(RecordingNotificationService(), users_a, router=client_a)
+        im_b = IMService(notify_b, users_b, router=client_b)
+
+        # 未登记的接收者仍按找不到处理
+        assert im_a.receive_message(alice, bob.userId, "太早了") is None
+        im_b.attach_session(bob)
+        assert _wait_until(lambda: client_a.is_remote(bob.userId))
+        assert client_a.nickname(bob.userId) == "Bob" and not client_b.is_remote(bob.userId)
+
+        sent = [im_a.receive_message(alice, bob.userId, f"你好 {i}") for i in range(10)]
+        assert all(m is not None and m.receiver.nickname == "Bob" for m in sent)
+        assert client_a.flush(timeout=5.0)
+        assert _wait_until(lambda: len(im_b.message_db) == 10)
+
+        stub = im_b.message_db[0].sender
+        assert stub.userId == alice.userId and stub.nickname == "Alice"
+        received = im_b.get_chat_history(bob, stub)
+        assert [m.content for m in received] == [f"你好 {i}" for i in range(10)]
+        assert [m.seq for m in received] == list(range(1, 11))
+        assert received[0].messageId == sent[0].messageId
+        # bob 在 B 进程离线，由 B 进程发出推送；A 进程保留发送方的记录
+        assert len(notify_b.pushes) == 10
+        assert len(im_a.get_chat_history(alice, sent[0].receiver)) == 10
+        stats = client_a.stats()
+        assert stats["delivered"] == 10 and stats["failed"] == 0 and stats["batches"] <= 10
+
+        im_b.detach_session(bob)
+        assert _wait_until(lambda: not client_a.is_remote(bob.userId))
+        assert im_a.receive_message(alice, bob.userId, "已下线") is None
+
+        round_trip = decode_envelopes(memoryview(encode_envelopes([RemoteEnvelope.of(sent[0])])))
+        assert round_trip == [RemoteEnvelope.of(sent[0])]
+    finally:
+        client_a.close()
+        client_b.close()
+        broker.stop()
+
+
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"), reason="需要 Unix 域套接字")
+def test_remote_users_listed_and_delivery_dispatched_to_owner_thread(tmp_path, monkeypatch):
+    import queue
+    from broker import BrokerClient, ChatBroker
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "b.sock")
+    broker = ChatBroker(path).start()
+    client_a = BrokerClient(path, name="a").connect()
+    client_b = BrokerClient(path, name="b").connect()
+    try:
+        users_a, users_b = UserService(), UserService()
+        alice = users_a.register("1", "alice@a.com", "pw", "Alice")
+        bob = users_b.register("2", "bob@b.com", "pw", "Bob")
+        calls = queue.Queue()
+        im_a = IMService(RecordingNotificationService(), users_a, router=client_a)
+        im_b = IMService(RecordingNotificationService(), users_b, router=client_b,
+                         dispatcher=lambda fn, *args: calls.put((fn, args)))
+        assert im_a.remote_users() == [] and IMService(NotificationService(), users_a).remote_users() == []
+
+        # 两个进程没有共享种子数据：B 进程的 bob 只能以占位对象出现在 A 的聊天对象列表里
+        im_b.attach_session(bob)
+        assert _wait_until(lambda: im_a.remote_users())
+        stub = im_a.remote_users()[0]
+        assert (stub.userId, stub.nickname) == (bob.userId, "Bob") and im_a.remote_users()[0] is stub
+        assert im_a.receive_message(alice, stub.userId, "你好") is not None
+        assert client_a.flush(timeout=5.0)
+
+        # 代理读线程只负责排队，存储发生在取出回调的线程上
+        fn, args = calls.get(timeout=5.0)
+        assert im_b.message_db == []
+        fn(*args)
+        assert [m.content for m in im_b.message_db] == ["你好"]
+    finally:
+        client_a.close()
+        client_b.close()
+        broker.stop()
+
+
+# --- 子功能 27: 近似重复商品检测测试 ---
+
+def test_minhash_estimates_jaccard_similarity():
+    from dedup import minhash, shingles, similarity
+    a = shingles("九成新 iPhone 13 128G 蓝色 电池健康 90% 无拆无修")
+    b = shingles("九成新 iPhone 13 128G 蓝色 电池健康 89% 无拆无修")
+    exact = len(a & b) / len(a | b)
+    estimate = similarity(minhash(a, 256), minhash(b, 256))
+    assert abs(estimate - exact) < 0.1
+    assert similarity(minhash(a), minhash(shingles("全新机械键盘 青轴"))) < 0.2
+    assert shingles("A, b!") == {"a b"} and len(minhash(set())) == 128
+
+
+def test_publish_rejects_near_duplicate_from_same_seller(sample_user):
+    from dedup import DuplicateListing, NearDuplicateIndex
+    p_svc = ProductService(dedup=NearDuplicateIndex())
+    other = User("2", "other@test.com", "pw", "Other")
+    desc = "九成新，电池健康 90%，无拆无修，送原装充电器和手机壳"
+    original = p_svc.publish_product(sample_user, "iPhone 13 128G 蓝色", desc, 3000.0, "手机")
+
+    with pytest.raises(DuplicateListing) as exc:
+        p_svc.publish_product(sample_user, "iPhone13 128G 蓝色", desc + "！", 2999.0, "手机")
+    assert exc.value.product is original and exc.value.similarity >= 0.8
+    assert len(p_svc.product_db) == 1
+
+    # 其他卖家发布相似商品、或原商品下架后重新发布，都允许
+    p_svc.publish_product(other, "iPhone 13 128G 蓝色", desc, 3100.0, "手机")
+    p_svc.remove_product(original)
+    again = p_svc.publish_product(sample_user, "iPhone 13 128G 蓝色", desc, 2900.0, "手机")
+    assert [p for p, _ in p_svc.dedup.query("iPhone 13 128G 蓝色", desc)][0].name == "iPhone 13 128G 蓝色"
+    p_svc.publish_product(sample_user, "机械键盘 青轴", "全新未拆封", 199.0, "外设")
+
+    # 改名后按新内容重新索引
+    p_svc.update_product(again, name="Switch 游戏机", description="日版续航版，带两个手柄")
+    p_svc.publish_product(sample_user, "iPhone 13 128G 蓝色", desc, 2800.0, "手机")
+    p_svc.purge_removed()
+    assert len(p_svc.dedup) == len(p_svc.product_db) == 4
+
+
+def test_duplicate_clusters_batch_mode(sample_user):
+    from dedup import NearDuplicateIndex
+    p_svc = ProductService(dedup=NearDuplicateIndex())
+    desc = "九成新，电池健康 90%，无拆无修，送原装充电器和手机壳"
+    # 同一卖家的重复发布会被拒绝，簇由不同卖家的相似商品组成
+    sellers = [sample_user, User("2", "c2@test.com", "pw", "B"), User("3", "c3@test.com", "pw", "C")]
+    items = [(seller, f"iPhone 13 128G 蓝色{suffix}", desc, 3000.0, "手机") for seller, suffix in zip(sellers, ("", " ", "!"))]
+    items += [(User(str(i), f"f{i}@test.com", "pw", f"F{i}"), f"商品 {i} 号", f"完全不同的描述 {i * 7919}", 1.0, "杂项")
+              for i in range(200)]
+    assert None not in p_svc.publish_products_bulk(items)
+
+    clusters = p_svc.find_duplicate_clusters()
+    assert [sorted(p.name for p in c) for c in clusters if c[0].category.name == "手机"] == \
+        [sorted(name for _, name, _, _, _ in items[:3])]
+    # 只比较 LSH 桶内的候选，远少于 203 件商品两两比较的 20503 次
+    assert p_svc.dedup.comparisons < 2000
+    assert ProductService().find_duplicate_clusters() == []
+
+
+def test_bulk_publish_rejects_duplicates_and_seed_indexes_in_background(sample_user):
+    from dedup import DuplicateListing, NearDuplicateIndex
+    from importers import import_products
+    from models import Category, Product
+    p_svc = ProductService(dedup=NearDuplicateIndex())
+    desc = "九成新，电池健康 90%，无拆无修，送原装充电器和手机壳"
+    original = p_svc.publish_product(sample_user, "iPhone 13 128G 蓝色", desc, 3000.0, "手机")
+    results = p_svc.publish_products_bulk([
+        (sample_user, "iPhone 13 128G 蓝色!", desc, 2999.0, "手机"),   # 与已在售商品重复
+        (sample_user, "机械键盘 青轴 全新", "全新未拆封，带 RGB 灯效", 199.0, "外设"),
+        (sample_user, "机械键盘 青轴 全新！", "全新未拆封，带 RGB 灯效", 189.0, "外设"),  # 与本批前一条重复
+    ])
+    assert results[0] is None and results[2] is None and results[1].name == "机械键盘 青轴 全新"
+    assert len(p_svc.product_db) == 2
+
+    users = UserService()
+    users.user_db[sample_user.email] = sample_user
+    rows = [(2, {"seller_email": sample_user.email, "name": "iPhone 13 128G 蓝色", "description": desc,
+                 "price": "10", "category": "手机"})]
+    report = import_products(rows, p_svc, users)
+    assert report.imported == 0 and report.failed == 1 and "重复" in report.errors[0][1]
+
+    # 种子载入不做检查，签名在后台线程补齐；之后的发布照常被拦截
+    seeded = ProductService(dedup=NearDuplicateIndex())
+    seed = [Product(sample_user, f"商品 {i} 号", f"描述 {i * 7919}", 1.0, Category("杂项")) for i in range(300)]
+    seed.append(Product(sample_user, original.name, desc, 1.0, Category("手机")))
+    seeded.load_products(seed)
+    assert len(seeded.dedup) == 301
+    assert _wait_until(lambda: not seeded.dedup._pending)
+    with pytest.raises(DuplicateListing):
+        seeded.publish_product(sample_user, original.name, desc, 2.0, "手机")
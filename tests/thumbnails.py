@@ -0,0 +1,107 @@
+# thumbnails.py
+import hashlib
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Callable, Dict, Optional
+
+# 缩略图规格：名称 -> 最长边像素
+THUMBNAIL_SIZES: Dict[str, int] = {"small": 64, "medium": 256, "large": 640}
+
+_HASH_CHUNK = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    """分块计算文件内容的 sha256，作为缓存键"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def render_variants(source_path: str, out_dir: str, sizes: Dict[str, int]) -> Dict[str, str]:
+    """在子进程中执行：解码一次原图，依次生成各规格的 JPEG 缩略图"""
+    # Pillow 为可选依赖，只在真正渲染时（子进程内）导入；未安装时只能使用自定义 renderer
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("生成缩略图需要安装 Pillow") from None
+    os.makedirs(out_dir, exist_ok=True)
+    results = {}
+    with Image.open(source_path) as img:
+        img = img.convert("RGB")
+        # 从大到小生成，每一级都在上一级结果上缩放
+        for name, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+            img.thumbnail((edge, edge))
+            path = os.path.join(out_dir, f"{name}.jpg")
+            tmp_path = path + ".tmp"
+            img.save(tmp_path, "JPEG", quality=85, optimize=True)
+            os.replace(tmp_path, path)
+            results[name] = path
+    return results
+
+
+class ThumbnailPipeline:
+    """按内容哈希缓存缩略图；同一内容无论上传几次只处理一次"""
+    def __init__(self, cache_dir: str, sizes: Optional[Dict[str, int]] = None,
+                 executor: Optional[Executor] = None, max_workers: Optional[int] = None,
+                 renderer: Callable[[str, str, Dict[str, int]], Dict[str, str]] = render_variants):
+        self.cache_dir: str = cache_dir
+        self.sizes: Dict[str, int] = dict(sizes or THUMBNAIL_SIZES)
+        self.renderer = renderer
+        self._executor = executor
+        self._max_workers = max_workers
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.cache_hits: int = 0
+        self.renders: int = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+        return self._executor
+
+    def cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def lookup(self, digest: str) -> Optional[Dict[str, str]]:
+        out_dir = self.cache_path(digest)
+        paths = {name: os.path.join(out_dir, f"{name}.jpg") for name in self.sizes}
+        if all(os.path.exists(p) for p in paths.values()):
+            return paths
+        return None
+
+    def submit(self, source_path: str) -> Future:
+        """返回 Future，结果为 {规格名: 缩略图路径}"""
+        digest = file_digest(source_path)
+        with self._lock:
+            inflight = self._inflight.get(digest)
+            if inflight is not None:
+                self.cache_hits += 1
+                return inflight
+            cached = self.lookup(digest)
+            if cached is not None:
+                self.cache_hits += 1
+                future = Future()
+                future.set_result(cached)
+                return future
+            self.renders += 1
+            future = self._get_executor().submit(self.renderer, source_path, self.cache_path(digest), self.sizes)
+            self._inflight[digest] = future
+
+        def done(_):
+            with self._lock:
+                self._inflight.pop(digest, None)
+
+        future.add_done_callback(done)
+        return future
+
+    def process(self, source_path: str) -> Dict[str, str]:
+        return self.submit(source_path).result()
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,124 @@
+# tracing.py
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+
+class _NoopSpan:
+    """未采样或未开启追踪时使用的空 span，进入/退出不做任何事"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "start_ns", "end_ns", "children", "error")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name: str = name
+        self.start_ns: int = 0
+        self.end_ns: int = 0
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ns(self) -> int:
+        return self.end_ns - self.start_ns
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        if stack:
+            stack[-1].children.append(self)
+        stack.append(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        stack = self.tracer._stack()
+        stack.pop()
+        if not stack:
+            self.tracer._finish(self)
+        return False
+
+    def format(self, indent: int = 0) -> List[str]:
+        suffix = f" !{self.error}" if self.error else ""
+        lines = [f"{'  ' * indent}{self.name}: {self.duration_ns / 1000:.1f}us{suffix}"]
+        for child in self.children:
+            lines.extend(child.format(indent + 1))
+        return lines
+
+
+class Tracer:
+    """按采样率记录调用链，超过阈值的慢调用保存在固定长度的环形缓冲区中"""
+    def __init__(self, sample_rate: float = 1.0, slow_threshold_ms: float = 50.0,
+                 capacity: int = 100, rng: Callable[[], float] = random.random):
+        self.sample_rate: float = sample_rate
+        self.slow_threshold_ns: int = int(slow_threshold_ms * 1_000_000)
+        self.slow_traces: deque = deque(maxlen=capacity)
+        self.sampled_count: int = 0
+        self._rng = rng
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def trace(self, name: str):
+        """开始一条新的调用链；已有活动链时作为子 span 嵌套"""
+        if self._stack():
+            return Span(self, name)
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and self._rng() >= self.sample_rate):
+            return _NOOP_SPAN
+        return Span(self, name)
+
+    def span(self, name: str):
+        """在当前调用链下创建阶段 span；不在采样链中时返回空 span"""
+        if not self._stack():
+            return _NOOP_SPAN
+        return Span(self, name)
+
+    def _finish(self, root: Span):
+        with self._lock:
+            self.sampled_count += 1
+            if root.duration_ns >= self.slow_threshold_ns:
+                self.slow_traces.append(root)
+
+    def recent_slow(self) -> List[Span]:
+        with self._lock:
+            return list(self.slow_traces)
+
+    def dump(self) -> str:
+        blocks = ["\n".join(root.format()) for root in self.recent_slow()]
+        return "\n\n".join(blocks)
+
+    def clear(self):
+        with self._lock:
+            self.slow_traces.clear()
+
+
+class NullTracer:
+    """默认追踪器，所有调用都返回空 span"""
+    def trace(self, name: str):
+        return _NOOP_SPAN
+
+    def span(self, name: str):
+        return _NOOP_SPAN
+
+
+NULL_TRACER = NullTracer()